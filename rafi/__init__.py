@@ -12,9 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from . import checkpoint
 from . import emu
+from . import interval
+from . import lockstep
+from . import mem
+from . import sampling
+from . import smp
+from . import trace
 
-def run_emulation(path, max_cycle):
-    emulator = emu.Emulator()
+def run_emulation(path, max_cycle, engine="interpreter", fixedint=False, memory_size=mem.Memory.DEFAULT_SIZE, memory_base=mem.Memory.DEFAULT_BASE, mapped=False):
+    emulator = emu.Emulator(engine, fixedint, memory_size, memory_base, mapped)
     emulator.load(path)
     emulator.run(max_cycle)
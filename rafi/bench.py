@@ -0,0 +1,206 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import json
+import os
+import time
+from . import emu
+from . import reference
+from . import runner
+from . import rv
+from . import rv32a
+from . import rv32i
+from . import rv32m
+
+# Mix of RV32I instruction words taken from compiled C code.
+SAMPLE_INSNS = [
+    0x0065_8333, 0xff43_8393, 0x0135_79b3, 0x0077_f793, 0x0000_2097, 0x00b5_0663, 0x0112_c463, 0xfed7_e2e3,
+    0xfea6_90e3, 0x0000_006f, 0xffc0_80e7, 0x0008_0883, 0x0408_4803, 0xf806_1783, 0x0006_5283, 0x8000_f137,
+    0x00c1_2083, 0x0058_62b3, 0x1005_6513, 0xfcc7_0023, 0x0015_3513, 0xf8c6_9023, 0x00d6_1713, 0x00f5_27b3,
+    0x0115_37b3, 0x40d5_57b3, 0x41f6_d693, 0x00c5_56b3, 0x0116_5713, 0x40f5_0533, 0x00a3_a023, 0x00c7_4633,
+]
+
+# One op per rv32i, rv32m and rv32a class. rs1 = sp is kept pointing into memory so loads and stores stay in range.
+MSCRATCH = rv.CsrAddr.MSCRATCH.value
+
+EXECUTE_OPS = [
+    rv32i.LUI(10, 0x1234_5000), rv32i.AUIPC(10, 0x1000), rv32i.JAL(1, 0x100), rv32i.JALR(1, 2, 0x10),
+    rv32i.BEQ(11, 12, 0x10), rv32i.BNE(11, 12, 0x10), rv32i.BLT(11, 12, 0x10), rv32i.BGE(11, 12, 0x10),
+    rv32i.BLTU(11, 12, 0x10), rv32i.BGEU(11, 12, 0x10),
+    rv32i.LB(10, 2, 0x10), rv32i.LH(10, 2, 0x10), rv32i.LW(10, 2, 0x10), rv32i.LBU(10, 2, 0x10), rv32i.LHU(10, 2, 0x10),
+    rv32i.SB(2, 11, 0x20), rv32i.SH(2, 11, 0x20), rv32i.SW(2, 11, 0x20),
+    rv32i.ADDI(10, 11, 0xffff_fff0), rv32i.SLTI(10, 11, 0x7ff), rv32i.SLTIU(10, 11, 0x7ff), rv32i.XORI(10, 11, 0x555),
+    rv32i.ORI(10, 11, 0x555), rv32i.ANDI(10, 11, 0x555), rv32i.SLLI(10, 11, 3), rv32i.SRLI(10, 11, 3), rv32i.SRAI(10, 11, 3),
+    rv32i.ADD(10, 11, 12), rv32i.SUB(10, 11, 12), rv32i.SLL(10, 11, 12), rv32i.SLT(10, 11, 12), rv32i.SLTU(10, 11, 12),
+    rv32i.XOR(10, 11, 12), rv32i.SRL(10, 11, 12), rv32i.SRA(10, 11, 12), rv32i.OR(10, 11, 12), rv32i.AND(10, 11, 12),
+    rv32i.FENCE(0xf, 0xf), rv32i.CSRRW(MSCRATCH, 10, 11), rv32i.CSRRS(MSCRATCH, 10, 11), rv32i.CSRRC(MSCRATCH, 10, 11),
+    rv32i.CSRRWI(MSCRATCH, 10, 5), rv32i.CSRRSI(MSCRATCH, 10, 5), rv32i.CSRRCI(MSCRATCH, 10, 5),
+    rv32m.MUL(10, 11, 12), rv32m.MULH(10, 11, 12), rv32m.MULHSU(10, 11, 12), rv32m.MULHU(10, 11, 12),
+    rv32m.DIV(10, 11, 12), rv32m.DIVU(10, 11, 12), rv32m.REM(10, 11, 12), rv32m.REMU(10, 11, 12),
+    rv32a.LR_W(10, 2, 0, 0), rv32a.SC_W(10, 2, 11, 0, 0), rv32a.AMOSWAP_W(10, 2, 11, 0, 0), rv32a.AMOADD_W(10, 2, 11, 0, 0),
+    rv32a.AMOXOR_W(10, 2, 11, 0, 0), rv32a.AMOAND_W(10, 2, 11, 0, 0), rv32a.AMOOR_W(10, 2, 11, 0, 0),
+    rv32a.AMOMIN_W(10, 2, 11, 0, 0), rv32a.AMOMAX_W(10, 2, 11, 0, 0), rv32a.AMOMINU_W(10, 2, 11, 0, 0), rv32a.AMOMAXU_W(10, 2, 11, 0, 0),
+]
+
+# Synthetic loop kernels. Each loops forever, so a run executes exactly the requested number of instructions.
+KERNELS = {
+    # addi a0, zero, 0; loop: add a1, a1, a0; xor a2, a2, a1; slli a3, a2, 3; srl a4, a3, a0; addi a0, a0, 1; j loop
+    'alu': [0x0000_0513, 0x00a5_85b3, 0x00b6_4633, 0x0036_1693, 0x00a6_d733, 0x0015_0513, 0xfedf_f06f],
+    # lui a0, 0x80008; addi a1, zero, 0
+    # loop: lw a2, 0(a0); add a2, a2, a1; sw a2, 4(a0); lbu a3, 1(a0); sh a3, 8(a0); addi a1, a1, 1; j loop
+    'memory': [0x8000_8537, 0x0000_0593, 0x0005_2603, 0x00b6_0633, 0x00c5_2223, 0x0015_4683, 0x00d5_1423, 0x0015_8593, 0xfe9f_f06f],
+    # addi a0, zero, 0; loop: addi a0, a0, 1; andi a1, a0, 1; beqz a1, 1f; addi a2, a2, 1
+    # 1: andi a1, a0, 2; bnez a1, 2f; addi a3, a3, 1; 2: j loop
+    'branch': [0x0000_0513, 0x0015_0513, 0x0015_7593, 0x0005_8463, 0x0016_0613, 0x0025_7593, 0x0005_9463, 0x0016_8693, 0xfe5f_f06f],
+    # loop: jal ra, func; j loop; func: addi a0, a0, 1; ret
+    'call': [0x0080_00ef, 0xffdf_f06f, 0x0015_0513, 0x0000_8067],
+    # lui a0, 0x80008; loop: lr.w a1, (a0); addi a1, a1, 1; sc.w a2, a1, (a0); amoadd.w a3, a2, (a0); j loop
+    'atomic': [0x8000_8537, 0x1005_25af, 0x0015_8593, 0x18b5_262f, 0x00c5_26af, 0xff1f_f06f],
+}
+
+def measure(func, count, rounds=3):
+    """Call func() rounds times and return the number of operations per second of the fastest call,
+    given it performs count operations. Taking the fastest filters out noise from the rest of the system."""
+    elapsed = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return count / elapsed if elapsed > 0 else float('inf')
+
+def bench_decode(decoder, insns=SAMPLE_INSNS, repeat=1000):
+    def run():
+        for _ in range(repeat):
+            for insn in insns:
+                decoder(insn)
+    return measure(run, len(insns) * repeat)
+
+def bench_execute(fixedint=False, ops=EXECUTE_OPS, repeat=10000):
+    """Return executed ops per second of each op's execute(), keyed by op class name.
+
+    With fixedint the ops run their fixedint reference implementations on the fixedint register file."""
+    emulator = emu.Emulator(fixedint=fixedint)
+    state = emulator.processor.cpuState
+    bus = emulator.bus
+    state.int_reg[2] = 0x8000_8000
+    state.int_reg[11] = 0x8765_4321
+    state.int_reg[12] = 0x0000_0013
+
+    results = {}
+    for op in ops:
+        def run():
+            for _ in range(repeat):
+                if fixedint:
+                    reference.execute(op, state, bus)
+                else:
+                    op.execute(state, bus)
+        results[type(op).__name__] = measure(run, repeat)
+    return results
+
+def bench_accessors(target, base, repeat=10000):
+    """Return accesses per second of each read_uint*/write_uint* method of target, aligned and unaligned"""
+    results = {}
+    for width in (8, 16, 32):
+        read = getattr(target, f"read_uint{width}")
+        write = getattr(target, f"write_uint{width}")
+        value = (1 << width) - 1
+        for aligned in (True, False):
+            if width == 8 and not aligned:
+                continue
+            addr = base + (0x100 if aligned else 0x101)
+            name = f"{width}bit {'aligned' if aligned else 'unaligned'}"
+
+            def run_read():
+                for _ in range(repeat):
+                    read(addr)
+            def run_write():
+                for _ in range(repeat):
+                    write(addr, value)
+            results[f"read {name}"] = measure(run_read, repeat)
+            results[f"write {name}"] = measure(run_write, repeat)
+    return results
+
+def bench_memory(memory, repeat=10000):
+    """Return accesses per second of each Memory accessor, aligned and unaligned"""
+    return bench_accessors(memory, memory.base, repeat)
+
+def bench_bus(bus, repeat=10000):
+    """Return accesses per second of each Bus accessor, which also check code caches and write watches on writes"""
+    return bench_accessors(bus, bus.memory.base, repeat)
+
+def make_kernel_emulator(words, engine, fixedint=False):
+    emulator = emu.Emulator(engine, fixedint)
+    for i, word in enumerate(words):
+        emulator.bus.write_uint32(emulator.memory.base + i * 4, word)
+    emulator.processor.cpuState.pc = emulator.memory.base
+    return emulator
+
+def bench_kernel(words, engine, count, fixedint=False):
+    """Run a loop kernel for count instructions and return executed instructions per second"""
+    emulator = make_kernel_emulator(words, engine, fixedint)
+    return measure(lambda: emulator.step(count), count)
+
+def run_binary(path, engine, max_cycle, fixedint=False, xlen=32):
+    """Run a binary to completion and return (executed instructions, elapsed seconds)"""
+    emulator = emu.Emulator(engine, fixedint, xlen=xlen)
+    emulator.load(path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        emulator.run(max_cycle)
+        elapsed = time.perf_counter() - start
+    return emulator.cycle, elapsed
+
+def bench_run(path, engine, max_cycle, fixedint=False):
+    """Run a binary to completion and return executed instructions per second"""
+    cycle, elapsed = run_binary(path, engine, max_cycle, fixedint)
+    return cycle / elapsed if elapsed > 0 else float('inf')
+
+def bench_runs(paths, engine, max_cycle, fixedint=False):
+    """Run each binary to completion and return executed instructions per second over all of them.
+
+    Suites of short tests such as riscv-tests are measured together, as each one alone is too short to time.
+    Each binary runs with the XLEN its riscv-tests name tells."""
+    total_cycle = 0
+    total_elapsed = 0.0
+    for path in paths:
+        cycle, elapsed = run_binary(path, engine, max_cycle, fixedint, runner.get_xlen(os.path.basename(path)))
+        total_cycle += cycle
+        total_elapsed += elapsed
+    return total_cycle / total_elapsed if total_elapsed > 0 else float('inf')
+
+# =============================================================================
+# Results
+#
+# Results are a flat dict of benchmark name to operations per second, so that runs can be compared by name.
+#
+def find_regressions(results, baseline, threshold):
+    """Return a description of each result slower than its baseline by more than threshold, a fraction"""
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None or base <= 0:
+            continue
+        if value < base * (1 - threshold):
+            regressions.append(f"{name}: {value:.0f}/s < {base:.0f}/s ({(value / base - 1) * 100:+.1f}%)")
+    return regressions
+
+def write_json(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=4)
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
@@ -0,0 +1,177 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import os
+import struct
+import zlib
+from . import mem
+
+# =============================================================================
+# Checkpoint file format (version 1, little-endian)
+#
+#   header          magic, version, compression
+#   state           cycle, pc, next_pc, host IO address, host IO value, memory base, memory size
+#   int_reg         x0..x31
+#   csr             count, then (address, value) for each counter CSR and each other non-zero CSR
+#   pages           (page number, encoding, length, 0) and the page data padded to 8 bytes, for each non-zero page
+#   end             a page record with number END_OF_PAGES
+#
+# Raw page data starts 8-byte aligned, so a reader can use slices of a mapping of the file as pages.
+#
+MAGIC = b'RAFICKPT'
+VERSION = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+ENCODING_RAW = 0
+ENCODING_ZLIB = 1
+
+END_OF_PAGES = 0xffff_ffff
+
+HEADER = struct.Struct('<8sII')
+STATE = struct.Struct('<QIIIIQQ')
+INT_REG = struct.Struct('<32I')
+CSR_COUNT = struct.Struct('<II')
+CSR = struct.Struct('<II')
+PAGE = struct.Struct('<IIII')
+
+ZERO_PAGE = bytes(mem.PAGE_SIZE)
+
+def padding(length):
+    return -length & 7
+
+def write_page(f, number, page, compression):
+    data = page
+    encoding = ENCODING_RAW
+    if compression == COMPRESSION_ZLIB:
+        compressed = zlib.compress(page)
+        if len(compressed) < len(page):
+            data = compressed
+            encoding = ENCODING_ZLIB
+    f.write(PAGE.pack(number, encoding, len(data), 0))
+    f.write(data)
+    f.write(bytes(padding(len(data))))
+
+def check_emulator(emulator):
+    if emulator.processor.xlen != 32:
+        raise Exception(f"Checkpoints hold RV32 state, but the emulator runs RV{emulator.processor.xlen}.")
+    if len(emulator.processors) > 1:
+        raise Exception(f"Checkpoints hold the state of one hart, but the emulator has {len(emulator.processors)}.")
+
+def save(emulator, path, compression=COMPRESSION_NONE):
+    """Write the emulator state to path. Pages are streamed one at a time and all-zero pages are skipped."""
+    check_emulator(emulator)
+    state = emulator.processor.cpuState
+    memory = emulator.memory
+    # Counter CSRs are saved as derived values and turned back into offsets from the cycle on load. They are saved
+    # even when zero, since a zero counter at a non-zero cycle has an offset too.
+    csrs = [(addr, value) for addr, value in ((addr, state.read_csr(addr)) for addr in range(0x1000))
+        if value != 0 or addr in state.counter_csrs]
+
+    # Written to a temporary file first, so an interrupted save never leaves a truncated checkpoint behind.
+    temp_path = f"{path}.tmp"
+    with open(temp_path, mode='wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, compression))
+        f.write(STATE.pack(emulator.cycle, state.pc, state.next_pc, emulator.host_io_addr, emulator.host_io_value, memory.base, memory.size))
+        f.write(INT_REG.pack(*(state.int_reg[i] for i in range(32))))
+        f.write(CSR_COUNT.pack(len(csrs), 0))
+        for addr, value in csrs:
+            f.write(CSR.pack(addr, value))
+        for number in sorted(memory.pages):
+            page = memory.pages[number]
+            if page != ZERO_PAGE:
+                write_page(f, number, page, compression)
+        f.write(PAGE.pack(END_OF_PAGES, 0, 0, 0))
+    os.replace(temp_path, path)
+
+def read_cycle(path):
+    """Return the instruction count a checkpoint was taken at, reading only its header"""
+    with open(path, mode='rb') as f:
+        data = f.read(HEADER.size + STATE.size)
+    magic, version, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise Exception(f"'{path}' is not a version {VERSION} checkpoint file.")
+    return STATE.unpack_from(data, HEADER.size)[0]
+
+def save_periodic(emulator, period, prefix, max_cycle, compression=COMPRESSION_NONE):
+    """Run up to max_cycle instructions, saving a checkpoint named <prefix>.<cycle>.ckpt every period instructions.
+
+    A checkpoint is also saved at the start. Returns the paths of the saved checkpoints."""
+    paths = []
+    end = emulator.cycle + max_cycle
+    while emulator.host_io_value == 0:
+        path = f"{prefix}.{emulator.cycle}.ckpt"
+        save(emulator, path, compression)
+        paths.append(path)
+        if emulator.cycle >= end:
+            break
+        emulator.step(min(period, end - emulator.cycle))
+    return paths
+
+def load(emulator, path):
+    """Restore the emulator state from path.
+
+    The file is mapped read-only and raw pages are used in place; the memory copies them on the first write."""
+    check_emulator(emulator)
+    with open(path, mode='rb') as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    magic, version, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise Exception(f"'{path}' is not a checkpoint file.")
+    if version != VERSION:
+        raise Exception(f"Checkpoint version {version} of '{path}' is not supported (expected {VERSION}).")
+    offset = HEADER.size
+
+    cycle, pc, next_pc, host_io_addr, host_io_value, memory_base, memory_size = STATE.unpack_from(data, offset)
+    offset += STATE.size
+    memory = emulator.memory
+    if (memory_base, memory_size) != (memory.base, memory.size):
+        raise Exception(f"Checkpoint memory [0x{memory_base:x}, +0x{memory_size:x}) does not match the emulator memory [0x{memory.base:x}, +0x{memory.size:x}).")
+
+    state = emulator.processor.cpuState
+    state.reset()
+    emulator.cycle = cycle
+    state.pc = pc
+    state.next_pc = next_pc
+    for i, value in enumerate(INT_REG.unpack_from(data, offset)):
+        state.int_reg[i] = value
+    offset += INT_REG.size
+
+    count, _ = CSR_COUNT.unpack_from(data, offset)
+    offset += CSR_COUNT.size
+    for addr, value in CSR.iter_unpack(data[offset:offset + count * CSR.size]):
+        state.write_csr(addr, value)
+    offset += count * CSR.size
+
+    memory.clear()
+    while True:
+        number, encoding, length, _ = PAGE.unpack_from(data, offset)
+        offset += PAGE.size
+        if number == END_OF_PAGES:
+            break
+        page = data[offset:offset + length]
+        if encoding == ENCODING_RAW:
+            memory.set_page(number, page, False)
+        elif encoding == ENCODING_ZLIB:
+            memory.set_page(number, bytearray(zlib.decompress(page)), True)
+        else:
+            raise Exception(f"Unknown page encoding {encoding} in '{path}'.")
+        offset += length + padding(length)
+
+    emulator.bus.invalidate_code_caches()
+    emulator.set_host_io_addr(host_io_addr)
+    emulator.host_io_value = host_io_value
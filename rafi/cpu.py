@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from array import array
 from fixedint import *
 from enum import Enum
+from . import rv
 
 # =============================================================================
 # Trap
@@ -66,6 +68,26 @@ class EnvironmentCallFromMachineException(Trap):
     def __init__(self, pc):
         super().__init__(TrapType.EXCEPTION, ExceptionType.ECALL_FROM_U.value, pc, pc)
 
+class InsnAccessFaultException(Trap):
+    def __init__(self, pc, addr):
+        super().__init__(TrapType.EXCEPTION, ExceptionType.INSN_ACCESS_FAULT.value, pc, addr)
+
+class LoadAddrMisalignedException(Trap):
+    def __init__(self, pc, addr):
+        super().__init__(TrapType.EXCEPTION, ExceptionType.LOAD_ADDR_MISALIGNED.value, pc, addr)
+
+class StoreAddrMisalignedException(Trap):
+    def __init__(self, pc, addr):
+        super().__init__(TrapType.EXCEPTION, ExceptionType.STORE_ADDR_MISALIGNED.value, pc, addr)
+
+class LoadAccessFaultException(Trap):
+    def __init__(self, pc, addr):
+        super().__init__(TrapType.EXCEPTION, ExceptionType.LOAD_ACCESS_FAULT.value, pc, addr)
+
+class StoreAccessFaultException(Trap):
+    def __init__(self, pc, addr):
+        super().__init__(TrapType.EXCEPTION, ExceptionType.STORE_ACCESS_FAULT.value, pc, addr)
+
 class TrapReturn(Trap):
     def __init__(self, pc):
         super().__init__(TrapType.RETURN, None, pc, pc)
@@ -73,27 +95,183 @@ class TrapReturn(Trap):
 # =============================================================================
 # CPU State
 #
-class IntReg32:
-    __values = [UInt32(0)] * 32
+class IntReg32(array):
+    """Integer register file holding plain ints.
+
+    Writes to x0 are not filtered here; Processor clears x0 after every op."""
+    TYPECODE = 'I'
+
+    def __new__(cls):
+        return super().__new__(cls, cls.TYPECODE, [0] * 32)
+
+    def reset(self):
+        self[:] = array(self.typecode, [0] * 32)
+
+    def snapshot(self):
+        return array(self.typecode, self)
+
+    def restore(self, values):
+        self[:] = values
+
+class IntReg64(IntReg32):
+    "Integer register file of RV64"
+    TYPECODE = 'Q'
+
+class Csr32(array):
+    TYPECODE = 'I'
+
+    def __new__(cls):
+        return super().__new__(cls, cls.TYPECODE, [0] * 0x1000)
+
+    def reset(self):
+        self[:] = array(self.typecode, [0] * 0x1000)
+
+    def snapshot(self):
+        return array(self.typecode, self)
+
+    def restore(self, values):
+        self[:] = values
+
+class Csr64(Csr32):
+    TYPECODE = 'Q'
+
+class FixedIntReg32:
+    """Integer register file storing fixedint.UInt32, used to cross-check the plain-int register file"""
+    VALUE_TYPE = UInt32
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.__values = [self.VALUE_TYPE(0)] * 32
+
+    def snapshot(self):
+        return list(self.__values)
+
+    def restore(self, values):
+        self.__values = list(values)
 
     def __getitem__(self, key):
-        return self.__values[int(key)]
+        return int(self.__values[int(key)])
 
     def __setitem__(self, key, value):
         if int(key) != 0:
-            self.__values[int(key)] = value
+            self.__values[int(key)] = self.VALUE_TYPE(value)
+
+class FixedIntReg64(FixedIntReg32):
+    VALUE_TYPE = UInt64
+
+class FixedCsr32:
+    VALUE_TYPE = UInt32
+
+    def __init__(self):
+        self.reset()
 
-class Csr32:
-    __values = [UInt32(0)] * 0x1000
+    def reset(self):
+        self.__values = [self.VALUE_TYPE(0)] * 0x1000
+
+    def snapshot(self):
+        return list(self.__values)
+
+    def restore(self, values):
+        self.__values = list(values)
 
     def __getitem__(self, key):
-        return self.__values[int(key)]
+        return int(self.__values[int(key)])
 
     def __setitem__(self, key, value):
-        self.__values[int(key)] = value
+        self.__values[int(key)] = self.VALUE_TYPE(value)
+
+class FixedCsr64(FixedCsr32):
+    VALUE_TYPE = UInt64
+
+# Counter CSRs, mapped to (the M-mode counter they read, shift of the half they hold).
+COUNTER_CSRS = {
+    rv.CsrAddr.MCYCLE.value:    (rv.CsrAddr.MCYCLE.value, 0),
+    rv.CsrAddr.MCYCLEH.value:   (rv.CsrAddr.MCYCLE.value, 32),
+    rv.CsrAddr.MINSTRET.value:  (rv.CsrAddr.MINSTRET.value, 0),
+    rv.CsrAddr.MINSTRETH.value: (rv.CsrAddr.MINSTRET.value, 32),
+    rv.CsrAddr.CYCLE.value:     (rv.CsrAddr.MCYCLE.value, 0),
+    rv.CsrAddr.CYCLEH.value:    (rv.CsrAddr.MCYCLE.value, 32),
+    rv.CsrAddr.INSTRET.value:   (rv.CsrAddr.MINSTRET.value, 0),
+    rv.CsrAddr.INSTRETH.value:  (rv.CsrAddr.MINSTRET.value, 32),
+}
+
+# The high halves only exist in RV32, where a counter CSR holds 32 bits.
+COUNTER_CSRS_RV64 = {addr: counter for addr, counter in COUNTER_CSRS.items() if counter[1] == 0}
+
+# Only the M-mode counters are writable, the user-mode ones are read-only shadows.
+WRITABLE_COUNTER_CSRS = {rv.CsrAddr.MCYCLE.value, rv.CsrAddr.MCYCLEH.value, rv.CsrAddr.MINSTRET.value, rv.CsrAddr.MINSTRETH.value}
+
+COUNTER_MASK = (1 << 64) - 1
+
+def no_count():
+    return 0
+
+# Register and CSR file classes keyed by (xlen, fixedint).
+REGISTER_FILES = {
+    (32, False): (IntReg32, Csr32),
+    (32, True):  (FixedIntReg32, FixedCsr32),
+    (64, False): (IntReg64, Csr64),
+    (64, True):  (FixedIntReg64, FixedCsr64),
+}
 
 class CpuState:
-    pc = UInt32(0)
-    next_pc = UInt32(0)
-    int_reg = IntReg32()
-    csr = Csr32()
+    def __init__(self, fixedint=False, xlen=32):
+        if xlen not in (32, 64):
+            raise ValueError(f"XLEN must be 32 or 64, not {xlen}.")
+        self.xlen = xlen
+        self.xlen_mask = (1 << xlen) - 1
+        self.fixedint = fixedint
+        self.pc = 0
+        self.next_pc = 0
+        int_reg, csr = REGISTER_FILES[(xlen, fixedint)]
+        self.int_reg = int_reg()
+        self.csr = csr()
+        self.counter_csrs = COUNTER_CSRS if xlen == 32 else COUNTER_CSRS_RV64
+        # Counter CSRs are not updated per instruction. A read derives them from get_count(), the number of
+        # instructions run before the current chain of blocks as kept by the run loop, plus count_in_block, which
+        # the block engine sets before it runs the last op of a block. A write keeps the difference in counter_offsets.
+        self.get_count = no_count
+        self.count_in_block = 0
+        self.counter_offsets = {rv.CsrAddr.MCYCLE.value: 0, rv.CsrAddr.MINSTRET.value: 0}
+
+    def reset(self):
+        self.pc = 0
+        self.next_pc = 0
+        self.int_reg.reset()
+        self.csr.reset()
+        self.count_in_block = 0
+        self.counter_offsets = dict.fromkeys(self.counter_offsets, 0)
+
+    def read_counter(self, counter):
+        """Return the 64-bit value of MCYCLE or MINSTRET"""
+        return (self.get_count() + self.count_in_block + self.counter_offsets[counter]) & COUNTER_MASK
+
+    def read_csr(self, addr):
+        counter = self.counter_csrs.get(addr)
+        if counter is None:
+            return self.csr[addr]
+        counter, shift = counter
+        return (self.read_counter(counter) >> shift) & self.xlen_mask
+
+    def write_csr(self, addr, value):
+        counter = self.counter_csrs.get(addr)
+        if counter is None:
+            self.csr[addr] = value
+            return
+        if addr not in WRITABLE_COUNTER_CSRS:
+            return
+        counter, shift = counter
+        old = self.read_counter(counter)
+        new = (old & ~(self.xlen_mask << shift)) | ((int(value) & self.xlen_mask) << shift)
+        self.counter_offsets[counter] = (self.counter_offsets[counter] + new - old) & COUNTER_MASK
+
+    def snapshot(self):
+        return (self.pc, self.next_pc, self.int_reg.snapshot(), self.csr.snapshot(), dict(self.counter_offsets))
+
+    def restore(self, snapshot):
+        self.pc, self.next_pc, int_reg, csr, counter_offsets = snapshot
+        self.int_reg.restore(int_reg)
+        self.csr.restore(csr)
+        self.counter_offsets = dict(counter_offsets)
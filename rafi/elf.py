@@ -0,0 +1,137 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import mmap
+import struct
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+EM_RISCV = 243
+
+PT_LOAD = 1
+SHT_SYMTAB = 2
+
+ELF32_EHDR = struct.Struct('<16sHHIIIIIHHHHHH')
+ELF32_PHDR = struct.Struct('<IIIIIIII')
+ELF32_SHDR = struct.Struct('<IIIIIIIIII')
+ELF32_SYM = struct.Struct('<IIIBBH')
+
+ELF64_EHDR = struct.Struct('<16sHHIQQQIHHHHHH')
+ELF64_PHDR = struct.Struct('<IIQQQQQQ')
+ELF64_SHDR = struct.Struct('<IIQQQQIIQQ')
+ELF64_SYM = struct.Struct('<IBBHQQ')
+
+def is_elf(path):
+    with open(path, mode='rb') as f:
+        return f.read(len(ELF_MAGIC)) == ELF_MAGIC
+
+# =============================================================================
+# ELF file
+#
+class Segment:
+    def __init__(self, offset, vaddr, paddr, filesz, memsz, flags):
+        self.offset = offset
+        self.vaddr = vaddr
+        self.paddr = paddr
+        self.filesz = filesz
+        self.memsz = memsz
+        self.flags = flags
+
+class ElfFile:
+    """ELF32 or ELF64 little-endian RISC-V executable. xlen is 32 or 64 after the class of the file.
+
+    The file is mapped read-only and only the header is parsed up front.
+    Segments and symbols are parsed on first use, reading the file through memoryview slices."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, mode='rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise Exception(f"'{path}' is empty.")
+        self.data = memoryview(self.map)
+
+        if len(self.data) < ELF32_EHDR.size:
+            self.close()
+            raise Exception(f"'{path}' is too small to be an ELF file.")
+        self.xlen = 64 if self.data[4] == ELFCLASS64 else 32
+        ehdr = ELF64_EHDR if self.xlen == 64 else ELF32_EHDR
+        if len(self.data) < ehdr.size:
+            self.close()
+            raise Exception(f"'{path}' is too small to be an ELF file.")
+        (ident, self.type, machine, _, self.entry, self.phoff, self.shoff, _, _,
+            self.phentsize, self.phnum, self.shentsize, self.shnum, _) = ehdr.unpack_from(self.data)
+        if ident[0:4] != ELF_MAGIC or ident[4] not in (ELFCLASS32, ELFCLASS64) or ident[5] != ELFDATA2LSB or machine != EM_RISCV:
+            self.close()
+            raise Exception(f"'{path}' is not a little-endian ELF32 or ELF64 RISC-V file.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.data.release()
+        self.map.close()
+        self.file.close()
+
+    def read_string(self, table, offset):
+        end = self.map.find(b'\0', table + offset)
+        return bytes(self.data[table + offset:end]).decode()
+
+    @functools.cached_property
+    def segments(self):
+        """PT_LOAD segments"""
+        segments = []
+        for i in range(self.phnum):
+            position = self.phoff + i * self.phentsize
+            if self.xlen == 64:
+                # ELF64 moves p_flags next to p_type.
+                p_type, flags, offset, vaddr, paddr, filesz, memsz, _ = ELF64_PHDR.unpack_from(self.data, position)
+            else:
+                p_type, offset, vaddr, paddr, filesz, memsz, flags, _ = ELF32_PHDR.unpack_from(self.data, position)
+            if p_type == PT_LOAD:
+                segments.append(Segment(offset, vaddr, paddr, filesz, memsz, flags))
+        return segments
+
+    @functools.cached_property
+    def symbols(self):
+        """Values of the symbols in .symtab, keyed by name"""
+        shdr, sym = (ELF64_SHDR, ELF64_SYM) if self.xlen == 64 else (ELF32_SHDR, ELF32_SYM)
+        sections = [shdr.unpack_from(self.data, self.shoff + i * self.shentsize) for i in range(self.shnum)]
+        symbols = {}
+        for _, sh_type, _, _, offset, size, link, _, _, entsize in sections:
+            if sh_type != SHT_SYMTAB:
+                continue
+            strtab = sections[link][4]
+            for position in range(offset, offset + size, entsize or sym.size):
+                if self.xlen == 64:
+                    name, _, _, _, value, _ = sym.unpack_from(self.data, position)
+                else:
+                    name, value, _, _, _, _ = sym.unpack_from(self.data, position)
+                if name != 0:
+                    symbols[self.read_string(strtab, name)] = value
+        return symbols
+
+    def load(self, memory):
+        """Copy PT_LOAD segments to their physical addresses and zero-fill the rest of each segment"""
+        for segment in self.segments:
+            memory.load_image(segment.paddr, self.file, segment.offset, segment.filesz)
+            memory.zero(segment.paddr + segment.filesz, segment.memsz - segment.filesz)
@@ -14,9 +14,18 @@
 
 from fixedint import *
 from . import cpu
+from . import elf
 from . import mem
+from . import profiler
+from . import reference
 from . import rv
 from . import rv32i
+from . import rv32a
+from . import rv32m
+from . import rv64i
+from . import sampling
+from . import trace
+from . import translator
 from . import util
 
 # =============================================================================
@@ -73,7 +82,10 @@ class OperandJ:
         self.imm =      util.sign_extend32(21, util.pick(insn, 31) << 20 | util.pick(insn, 21, 10) << 1 | util.pick(insn, 20) << 11 | util.pick(insn, 12, 8) << 12)
         self.rd =       util.pick(insn, 7, 5)
 
-def decode(insn):
+def decode_reference(insn):
+    """Straightforward decoder, kept as the reference for the table-driven decode()"""
+    if insn & 0x3 != 0x3:
+        return compressed(decode_reference(expand_compressed(insn & 0xffff)))
     opcode = util.pick(insn, 0, 7)
 
     r = OperandR(insn)
@@ -171,6 +183,52 @@ def decode(insn):
             return rv32i.SUB(r.rd, r.rs1, r.rs2)
         elif r.funct7 == 0b0100000 and r.funct3 == 0b101:
             return rv32i.SRA(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b000:
+            return rv32m.MUL(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b001:
+            return rv32m.MULH(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b010:
+            return rv32m.MULHSU(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b011:
+            return rv32m.MULHU(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b100:
+            return rv32m.DIV(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b101:
+            return rv32m.DIVU(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b110:
+            return rv32m.REM(r.rd, r.rs1, r.rs2)
+        elif r.funct7 == 0b0000001 and r.funct3 == 0b111:
+            return rv32m.REMU(r.rd, r.rs1, r.rs2)
+        else:
+            raise Exception(f"Failed to decode insn 0x{insn:08x}")
+    elif opcode == 0b0101111:
+        funct5 = util.pick(insn, 27, 5)
+        aq = util.pick(insn, 26)
+        rl = util.pick(insn, 25)
+        if r.funct3 != 0b010:
+            raise Exception(f"Failed to decode insn 0x{insn:08x}")
+        elif funct5 == 0b00010 and r.rs2 == 0b00000:
+            return rv32a.LR_W(r.rd, r.rs1, aq, rl)
+        elif funct5 == 0b00011:
+            return rv32a.SC_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b00001:
+            return rv32a.AMOSWAP_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b00000:
+            return rv32a.AMOADD_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b00100:
+            return rv32a.AMOXOR_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b01100:
+            return rv32a.AMOAND_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b01000:
+            return rv32a.AMOOR_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b10000:
+            return rv32a.AMOMIN_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b10100:
+            return rv32a.AMOMAX_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b11000:
+            return rv32a.AMOMINU_W(r.rd, r.rs1, r.rs2, aq, rl)
+        elif funct5 == 0b11100:
+            return rv32a.AMOMAXU_W(r.rd, r.rs1, r.rs2, aq, rl)
         else:
             raise Exception(f"Failed to decode insn 0x{insn:08x}")
     elif opcode == 0b0001111:
@@ -212,65 +270,848 @@ def decode(insn):
     else:
         raise Exception(f"Failed to decode insn 0x{insn:08x}")
 
+def encode_r(funct7, funct3, rd, rs1, rs2):
+    return funct7 << 25 | rs2 << 20 | rs1 << 15 | funct3 << 12 | rd << 7 | 0b0110011
+
+def encode_i(opcode, funct3, rd, rs1, imm):
+    return util.pick(imm, 0, 12) << 20 | rs1 << 15 | funct3 << 12 | rd << 7 | opcode
+
+def encode_s(funct3, rs1, rs2, imm):
+    return util.pick(imm, 5, 7) << 25 | rs2 << 20 | rs1 << 15 | funct3 << 12 | util.pick(imm, 0, 5) << 7 | 0b0100011
+
+def encode_b(funct3, rs1, rs2, imm):
+    return (util.pick(imm, 12) << 31 | util.pick(imm, 5, 6) << 25 | rs2 << 20 | rs1 << 15 | funct3 << 12
+        | util.pick(imm, 1, 4) << 8 | util.pick(imm, 11) << 7 | 0b1100011)
+
+def encode_u(opcode, rd, imm):
+    return util.pick(imm, 12, 20) << 12 | rd << 7 | opcode
+
+def encode_j(rd, imm):
+    return (util.pick(imm, 20) << 31 | util.pick(imm, 1, 10) << 21 | util.pick(imm, 11) << 20 | util.pick(imm, 12, 8) << 12
+        | rd << 7 | 0b1101111)
+
+def signed(value, width):
+    return value - (util.pick(value, width - 1) << width)
+
+def expand_compressed(insn):
+    """Expand a 16-bit encoding into the 32-bit instruction it stands for, following the RVC listings.
+
+    This is the reference for decode_compressed(), which builds the ops directly."""
+    quadrant = util.pick(insn, 0, 2)
+    funct3 = util.pick(insn, 13, 3)
+    rd = util.pick(insn, 7, 5)
+    rs2 = util.pick(insn, 2, 5)
+    rd_short = 8 + util.pick(insn, 7, 3)
+    rs2_short = 8 + util.pick(insn, 2, 3)
+    imm6 = signed(util.pick(insn, 12) << 5 | util.pick(insn, 2, 5), 6)
+    uimm_w = util.pick(insn, 10, 3) << 3 | util.pick(insn, 6) << 2 | util.pick(insn, 5) << 6
+    imm_j = signed(util.pick(insn, 12) << 11 | util.pick(insn, 11) << 4 | util.pick(insn, 9, 2) << 8 | util.pick(insn, 8) << 10
+        | util.pick(insn, 7) << 6 | util.pick(insn, 6) << 7 | util.pick(insn, 3, 3) << 1 | util.pick(insn, 2) << 5, 12)
+    imm_b = signed(util.pick(insn, 12) << 8 | util.pick(insn, 10, 2) << 3 | util.pick(insn, 5, 2) << 6
+        | util.pick(insn, 3, 2) << 1 | util.pick(insn, 2) << 5, 9)
+
+    if quadrant == 0b00:
+        if funct3 == 0b000:
+            nzuimm = util.pick(insn, 11, 2) << 4 | util.pick(insn, 7, 4) << 6 | util.pick(insn, 6) << 2 | util.pick(insn, 5) << 3
+            if nzuimm != 0:
+                return encode_i(0b0010011, 0b000, rs2_short, 2, nzuimm)
+        elif funct3 == 0b010:
+            return encode_i(0b0000011, 0b010, rs2_short, rd_short, uimm_w)
+        elif funct3 == 0b110:
+            return encode_s(0b010, rd_short, rs2_short, uimm_w)
+    elif quadrant == 0b01:
+        if funct3 == 0b000:
+            return encode_i(0b0010011, 0b000, rd, rd, imm6)
+        elif funct3 == 0b001:
+            return encode_j(1, imm_j)
+        elif funct3 == 0b010:
+            return encode_i(0b0010011, 0b000, rd, 0, imm6)
+        elif funct3 == 0b011 and rd == 2:
+            nzimm = signed(util.pick(insn, 12) << 9 | util.pick(insn, 6) << 4 | util.pick(insn, 5) << 6
+                | util.pick(insn, 3, 2) << 7 | util.pick(insn, 2) << 5, 10)
+            if nzimm != 0:
+                return encode_i(0b0010011, 0b000, 2, 2, nzimm)
+        elif funct3 == 0b011:
+            if imm6 != 0:
+                return encode_u(0b0110111, rd, imm6 << 12)
+        elif funct3 == 0b100:
+            funct2 = util.pick(insn, 10, 2)
+            if funct2 == 0b10:
+                return encode_i(0b0010011, 0b111, rd_short, rd_short, imm6)
+            elif util.pick(insn, 12) == 1:
+                pass
+            elif funct2 == 0b00:
+                return encode_i(0b0010011, 0b101, rd_short, rd_short, rs2)
+            elif funct2 == 0b01:
+                return encode_i(0b0010011, 0b101, rd_short, rd_short, 0b0100000 << 5 | rs2)
+            else:
+                # c.sub, c.xor, c.or and c.and.
+                funct7, alu_funct3 = [(0b0100000, 0b000), (0b0000000, 0b100), (0b0000000, 0b110), (0b0000000, 0b111)][util.pick(insn, 5, 2)]
+                return encode_r(funct7, alu_funct3, rd_short, rd_short, rs2_short)
+        elif funct3 == 0b101:
+            return encode_j(0, imm_j)
+        elif funct3 == 0b110:
+            return encode_b(0b000, rd_short, 0, imm_b)
+        elif funct3 == 0b111:
+            return encode_b(0b001, rd_short, 0, imm_b)
+    elif quadrant == 0b10:
+        if funct3 == 0b000:
+            if util.pick(insn, 12) == 0:
+                return encode_i(0b0010011, 0b001, rd, rd, rs2)
+        elif funct3 == 0b010:
+            if rd != 0:
+                uimm = util.pick(insn, 12) << 5 | util.pick(insn, 4, 3) << 2 | util.pick(insn, 2, 2) << 6
+                return encode_i(0b0000011, 0b010, rd, 2, uimm)
+        elif funct3 == 0b100:
+            if util.pick(insn, 12) == 0:
+                if rs2 != 0:
+                    return encode_r(0b0000000, 0b000, rd, 0, rs2)
+                elif rd != 0:
+                    return encode_i(0b1100111, 0b000, 0, rd, 0)
+            else:
+                if rs2 != 0:
+                    return encode_r(0b0000000, 0b000, rd, rd, rs2)
+                elif rd == 0:
+                    return encode_i(0b1110011, 0b000, 0, 0, 1)
+                else:
+                    return encode_i(0b1100111, 0b000, 1, rd, 0)
+        elif funct3 == 0b110:
+            return encode_s(0b010, 2, rs2, util.pick(insn, 9, 4) << 2 | util.pick(insn, 7, 2) << 6)
+
+    raise Exception(f"Failed to decode insn 0x{insn:08x}")
+
+# =============================================================================
+# Table-driven decoder
+#
+def decode_error(insn):
+    return Exception(f"Failed to decode insn 0x{insn:08x}")
+
+def imm_i(insn):
+    return (((insn >> 20) ^ 0x800) - 0x800) & 0xffff_ffff
+
+def imm_s(insn):
+    return (((((insn >> 20) & 0xfe0) | ((insn >> 7) & 0x1f)) ^ 0x800) - 0x800) & 0xffff_ffff
+
+def imm_b(insn):
+    imm = (insn >> 19) & 0x1000 | (insn << 4) & 0x800 | (insn >> 20) & 0x7e0 | (insn >> 7) & 0x1e
+    return ((imm ^ 0x1000) - 0x1000) & 0xffff_ffff
+
+def imm_j(insn):
+    imm = (insn >> 11) & 0x10_0000 | insn & 0xf_f000 | (insn >> 9) & 0x800 | (insn >> 20) & 0x7fe
+    return ((imm ^ 0x10_0000) - 0x10_0000) & 0xffff_ffff
+
+def decode_lui(insn):
+    return rv32i.LUI((insn >> 7) & 0x1f, insn & 0xffff_f000)
+
+def decode_auipc(insn):
+    return rv32i.AUIPC((insn >> 7) & 0x1f, insn & 0xffff_f000)
+
+def decode_jal(insn):
+    return rv32i.JAL((insn >> 7) & 0x1f, imm_j(insn))
+
+def decode_jalr(insn):
+    return rv32i.JALR((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, imm_i(insn))
+
+BRANCH_OPS = [rv32i.BEQ, rv32i.BNE, None, None, rv32i.BLT, rv32i.BGE, rv32i.BLTU, rv32i.BGEU]
+
+def decode_branch(insn):
+    cls = BRANCH_OPS[(insn >> 12) & 0x7]
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 15) & 0x1f, (insn >> 20) & 0x1f, imm_b(insn))
+
+LOAD_OPS = [rv32i.LB, rv32i.LH, rv32i.LW, None, rv32i.LBU, rv32i.LHU, None, None]
+
+def decode_load(insn):
+    cls = LOAD_OPS[(insn >> 12) & 0x7]
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, imm_i(insn))
+
+STORE_OPS = [rv32i.SB, rv32i.SH, rv32i.SW, None, None, None, None, None]
+
+def decode_store(insn):
+    cls = STORE_OPS[(insn >> 12) & 0x7]
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 15) & 0x1f, (insn >> 20) & 0x1f, imm_s(insn))
+
+# Indexed by funct3; shifts (funct3 = 0b001 and 0b101) are looked up in OP_IMM_SHIFT_OPS.
+OP_IMM_OPS = [rv32i.ADDI, None, rv32i.SLTI, rv32i.SLTIU, rv32i.XORI, None, rv32i.ORI, rv32i.ANDI]
+
+# Keyed by funct7 << 3 | funct3.
+OP_IMM_SHIFT_OPS = {
+    0b0000000_001: rv32i.SLLI,
+    0b0000000_101: rv32i.SRLI,
+    0b0100000_101: rv32i.SRAI,
+}
+
+def decode_op_imm(insn):
+    funct3 = (insn >> 12) & 0x7
+    cls = OP_IMM_OPS[funct3]
+    if cls is not None:
+        return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, imm_i(insn))
+
+    cls = OP_IMM_SHIFT_OPS.get((insn >> 22) & 0x3f8 | funct3)
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, (insn >> 20) & 0x1f)
+
+# Keyed by funct7 << 3 | funct3.
+OP_OPS = {
+    0b0000000_000: rv32i.ADD,
+    0b0000000_001: rv32i.SLL,
+    0b0000000_010: rv32i.SLT,
+    0b0000000_011: rv32i.SLTU,
+    0b0000000_100: rv32i.XOR,
+    0b0000000_101: rv32i.SRL,
+    0b0000000_110: rv32i.OR,
+    0b0000000_111: rv32i.AND,
+    0b0100000_000: rv32i.SUB,
+    0b0100000_101: rv32i.SRA,
+    0b0000001_000: rv32m.MUL,
+    0b0000001_001: rv32m.MULH,
+    0b0000001_010: rv32m.MULHSU,
+    0b0000001_011: rv32m.MULHU,
+    0b0000001_100: rv32m.DIV,
+    0b0000001_101: rv32m.DIVU,
+    0b0000001_110: rv32m.REM,
+    0b0000001_111: rv32m.REMU,
+}
+
+def decode_op(insn):
+    cls = OP_OPS.get((insn >> 22) & 0x3f8 | (insn >> 12) & 0x7)
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, (insn >> 20) & 0x1f)
+
+# Keyed by funct5 (insn[31:27]); LR.W has no rs2 and is decoded separately.
+AMO_OPS = {
+    0b00011: rv32a.SC_W,
+    0b00001: rv32a.AMOSWAP_W,
+    0b00000: rv32a.AMOADD_W,
+    0b00100: rv32a.AMOXOR_W,
+    0b01100: rv32a.AMOAND_W,
+    0b01000: rv32a.AMOOR_W,
+    0b10000: rv32a.AMOMIN_W,
+    0b10100: rv32a.AMOMAX_W,
+    0b11000: rv32a.AMOMINU_W,
+    0b11100: rv32a.AMOMAXU_W,
+}
+
+def decode_amo(insn):
+    # Only the word width (funct3 = 0b010) exists in RV32.
+    if (insn >> 12) & 0x7 != 0b010:
+        raise decode_error(insn)
+    funct5 = insn >> 27
+    aq = (insn >> 26) & 0x1
+    rl = (insn >> 25) & 0x1
+    if funct5 == 0b00010 and (insn >> 20) & 0x1f == 0:
+        return rv32a.LR_W((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, aq, rl)
+
+    cls = AMO_OPS.get(funct5)
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, (insn >> 20) & 0x1f, aq, rl)
+
+def decode_misc_mem(insn):
+    # rd, funct3 and rs1 must be zero except for funct3 which selects FENCE.I
+    fields = insn & 0x000f_ff80
+    if fields == 0 and (insn >> 28) == 0:
+        return rv32i.FENCE((insn >> 24) & 0xf, (insn >> 20) & 0xf)
+    elif fields == 0x1000 and (insn >> 20) == 0:
+        return rv32i.FENCE_I()
+    else:
+        raise decode_error(insn)
+
+# Keyed by imm when rd, funct3 and rs1 are zero.
+SYSTEM_OPS = {
+    0b0000_0000_0000: rv32i.ECALL,
+    0b0000_0000_0001: rv32i.EBREAK,
+    0b0000_0000_0010: rv32i.URET,
+    0b0001_0000_0010: rv32i.SRET,
+    0b0011_0000_0010: rv32i.MRET,
+    0b0001_0000_0101: rv32i.WFI,
+}
+
+# Indexed by funct3.
+CSR_OPS = [None, rv32i.CSRRW, rv32i.CSRRS, rv32i.CSRRC, None, rv32i.CSRRWI, rv32i.CSRRSI, rv32i.CSRRCI]
+
+def decode_system(insn, csr_ops=CSR_OPS):
+    if insn & 0x000f_ff80 == 0:
+        cls = SYSTEM_OPS.get(insn >> 20)
+        if cls is None:
+            raise decode_error(insn)
+        return cls()
+
+    cls = csr_ops[(insn >> 12) & 0x7]
+    if cls is None:
+        raise decode_error(insn)
+    return cls(insn >> 20, (insn >> 7) & 0x1f, (insn >> 15) & 0x1f)
+
+# Indexed by opcode (insn[6:0]).
+OPCODE_DECODERS = [None] * 128
+OPCODE_DECODERS[0b0110111] = decode_lui
+OPCODE_DECODERS[0b0010111] = decode_auipc
+OPCODE_DECODERS[0b1101111] = decode_jal
+OPCODE_DECODERS[0b1100111] = decode_jalr
+OPCODE_DECODERS[0b1100011] = decode_branch
+OPCODE_DECODERS[0b0000011] = decode_load
+OPCODE_DECODERS[0b0100011] = decode_store
+OPCODE_DECODERS[0b0010011] = decode_op_imm
+OPCODE_DECODERS[0b0110011] = decode_op
+OPCODE_DECODERS[0b0101111] = decode_amo
+OPCODE_DECODERS[0b0001111] = decode_misc_mem
+OPCODE_DECODERS[0b1110011] = decode_system
+
+def decode(insn):
+    decoder = OPCODE_DECODERS[insn & 0x7f]
+    if decoder is None:
+        raise decode_error(insn)
+    return decoder(insn)
+
+# =============================================================================
+# Compressed (RV32C) decoder
+#
+# A 16-bit encoding is expanded into the rv32i op it stands for, with size 2. insn may carry the next
+# halfword in its upper bits, as fetch reads 32 bits; only the lower 16 are used.
+#
+def c_reg(insn, lsb):
+    """Register x8..x15 from a 3-bit field"""
+    return 8 + ((insn >> lsb) & 0x7)
+
+def c_imm6(insn):
+    """Sign-extended imm[5] = insn[12], imm[4:0] = insn[6:2]"""
+    imm = (insn >> 7) & 0x20 | (insn >> 2) & 0x1f
+    return ((imm ^ 0x20) - 0x20) & 0xffff_ffff
+
+def c_imm_j(insn):
+    imm = ((insn >> 1) & 0x800 | (insn >> 7) & 0x10 | (insn >> 1) & 0x300 | (insn << 2) & 0x400
+        | (insn >> 1) & 0x40 | (insn << 1) & 0x80 | (insn >> 2) & 0xe | (insn << 3) & 0x20)
+    return ((imm ^ 0x800) - 0x800) & 0xffff_ffff
+
+def c_imm_b(insn):
+    imm = (insn >> 4) & 0x100 | (insn >> 7) & 0x18 | (insn << 1) & 0xc0 | (insn >> 2) & 0x6 | (insn << 3) & 0x20
+    return ((imm ^ 0x100) - 0x100) & 0xffff_ffff
+
+def c_imm_lw(insn):
+    """Zero-extended uimm[5:3] = insn[12:10], uimm[2] = insn[6], uimm[6] = insn[5]"""
+    return (insn >> 7) & 0x38 | (insn >> 4) & 0x4 | (insn << 1) & 0x40
+
+def compressed(op):
+    op.size = 2
+    return op
+
+def decode_c_addi4spn(insn):
+    imm = (insn >> 7) & 0x30 | (insn >> 1) & 0x3c0 | (insn >> 4) & 0x4 | (insn >> 2) & 0x8
+    if imm == 0:
+        raise decode_error(insn & 0xffff)
+    return compressed(rv32i.ADDI(c_reg(insn, 2), 2, imm))
+
+def decode_c_lw(insn):
+    return compressed(rv32i.LW(c_reg(insn, 2), c_reg(insn, 7), c_imm_lw(insn)))
+
+def decode_c_sw(insn):
+    return compressed(rv32i.SW(c_reg(insn, 7), c_reg(insn, 2), c_imm_lw(insn)))
+
+def decode_c_addi(insn):
+    rd = (insn >> 7) & 0x1f
+    return compressed(rv32i.ADDI(rd, rd, c_imm6(insn)))
+
+def decode_c_jal(insn):
+    return compressed(rv32i.JAL(1, c_imm_j(insn)))
+
+def decode_c_li(insn):
+    return compressed(rv32i.ADDI((insn >> 7) & 0x1f, 0, c_imm6(insn)))
+
+def decode_c_lui(insn):
+    rd = (insn >> 7) & 0x1f
+    if rd == 2:
+        imm = (insn >> 3) & 0x200 | (insn >> 2) & 0x10 | (insn << 1) & 0x40 | (insn << 4) & 0x180 | (insn << 3) & 0x20
+        if imm == 0:
+            raise decode_error(insn & 0xffff)
+        return compressed(rv32i.ADDI(2, 2, ((imm ^ 0x200) - 0x200) & 0xffff_ffff))
+
+    imm = c_imm6(insn)
+    if imm == 0:
+        raise decode_error(insn & 0xffff)
+    return compressed(rv32i.LUI(rd, (imm << 12) & 0xffff_ffff))
+
+# Indexed by insn[6:5] when insn[12:10] is 0b011.
+C_ARITH_OPS = [rv32i.SUB, rv32i.XOR, rv32i.OR, rv32i.AND]
+
+def decode_c_misc_alu(insn):
+    rd = c_reg(insn, 7)
+    funct2 = (insn >> 10) & 0x3
+    if funct2 == 0b10:
+        return compressed(rv32i.ANDI(rd, rd, c_imm6(insn)))
+    if insn & 0x1000:
+        # shamt[5] must be zero and the 0b11 encodings with insn[12] set are RV64 only.
+        raise decode_error(insn & 0xffff)
+    if funct2 == 0b00:
+        return compressed(rv32i.SRLI(rd, rd, (insn >> 2) & 0x1f))
+    if funct2 == 0b01:
+        return compressed(rv32i.SRAI(rd, rd, (insn >> 2) & 0x1f))
+    return compressed(C_ARITH_OPS[(insn >> 5) & 0x3](rd, rd, c_reg(insn, 2)))
+
+def decode_c_j(insn):
+    return compressed(rv32i.JAL(0, c_imm_j(insn)))
+
+def decode_c_beqz(insn):
+    return compressed(rv32i.BEQ(c_reg(insn, 7), 0, c_imm_b(insn)))
+
+def decode_c_bnez(insn):
+    return compressed(rv32i.BNE(c_reg(insn, 7), 0, c_imm_b(insn)))
+
+def decode_c_slli(insn):
+    if insn & 0x1000:
+        raise decode_error(insn & 0xffff)
+    rd = (insn >> 7) & 0x1f
+    return compressed(rv32i.SLLI(rd, rd, (insn >> 2) & 0x1f))
+
+def decode_c_lwsp(insn):
+    rd = (insn >> 7) & 0x1f
+    if rd == 0:
+        raise decode_error(insn & 0xffff)
+    return compressed(rv32i.LW(rd, 2, (insn >> 7) & 0x20 | (insn >> 2) & 0x1c | (insn << 4) & 0xc0))
+
+def decode_c_jr_mv_add(insn):
+    rs1 = (insn >> 7) & 0x1f
+    rs2 = (insn >> 2) & 0x1f
+    if insn & 0x1000 == 0:
+        if rs2 != 0:
+            return compressed(rv32i.ADD(rs1, 0, rs2))
+        if rs1 == 0:
+            raise decode_error(insn & 0xffff)
+        return compressed(rv32i.JALR(0, rs1, 0))
+    if rs2 != 0:
+        return compressed(rv32i.ADD(rs1, rs1, rs2))
+    if rs1 == 0:
+        return compressed(rv32i.EBREAK())
+    return compressed(rv32i.JALR(1, rs1, 0))
+
+def decode_c_swsp(insn):
+    return compressed(rv32i.SW(2, (insn >> 2) & 0x1f, (insn >> 7) & 0x3c | (insn >> 1) & 0xc0))
+
+# Indexed by funct3 (insn[15:13]) << 2 | quadrant (insn[1:0]). Floating point loads and stores are not supported.
+COMPRESSED_DECODERS = [None] * 32
+COMPRESSED_DECODERS[0b000_00] = decode_c_addi4spn
+COMPRESSED_DECODERS[0b010_00] = decode_c_lw
+COMPRESSED_DECODERS[0b110_00] = decode_c_sw
+COMPRESSED_DECODERS[0b000_01] = decode_c_addi
+COMPRESSED_DECODERS[0b001_01] = decode_c_jal
+COMPRESSED_DECODERS[0b010_01] = decode_c_li
+COMPRESSED_DECODERS[0b011_01] = decode_c_lui
+COMPRESSED_DECODERS[0b100_01] = decode_c_misc_alu
+COMPRESSED_DECODERS[0b101_01] = decode_c_j
+COMPRESSED_DECODERS[0b110_01] = decode_c_beqz
+COMPRESSED_DECODERS[0b111_01] = decode_c_bnez
+COMPRESSED_DECODERS[0b000_10] = decode_c_slli
+COMPRESSED_DECODERS[0b010_10] = decode_c_lwsp
+COMPRESSED_DECODERS[0b100_10] = decode_c_jr_mv_add
+COMPRESSED_DECODERS[0b110_10] = decode_c_swsp
+
+def decode_compressed(insn):
+    decoder = COMPRESSED_DECODERS[(insn >> 11) & 0x1c | insn & 0x3]
+    if decoder is None:
+        raise decode_error(insn & 0xffff)
+    return decoder(insn)
+
+for opcode in range(128):
+    if opcode & 0x3 != 0x3:
+        OPCODE_DECODERS[opcode] = decode_compressed
+
+# =============================================================================
+# RV64I decoder
+#
+# RV64I keeps the RV32I encodings, with immediates sign-extended to 64 bits and 6-bit shift amounts,
+# and adds LD, SD, LWU and the *W ops. Compressed and M extension encodings are not decoded for RV64.
+#
+def imm64(imm):
+    """Sign-extend a 32-bit immediate from imm_i() and friends to 64 bits"""
+    return ((imm ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+def decode_lui_rv64(insn):
+    return rv32i.LUI((insn >> 7) & 0x1f, imm64(insn & 0xffff_f000))
+
+def decode_auipc_rv64(insn):
+    return rv64i.AUIPC((insn >> 7) & 0x1f, imm64(insn & 0xffff_f000))
+
+def decode_jal_rv64(insn):
+    return rv64i.JAL((insn >> 7) & 0x1f, imm64(imm_j(insn)))
+
+def decode_jalr_rv64(insn):
+    return rv64i.JALR((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, imm64(imm_i(insn)))
+
+BRANCH_OPS_RV64 = [rv64i.BEQ, rv64i.BNE, None, None, rv64i.BLT, rv64i.BGE, rv64i.BLTU, rv64i.BGEU]
+
+def decode_branch_rv64(insn):
+    cls = BRANCH_OPS_RV64[(insn >> 12) & 0x7]
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 15) & 0x1f, (insn >> 20) & 0x1f, imm64(imm_b(insn)))
+
+LOAD_OPS_RV64 = [rv64i.LB, rv64i.LH, rv64i.LW, rv64i.LD, rv64i.LBU, rv64i.LHU, rv64i.LWU, None]
+
+def decode_load_rv64(insn):
+    cls = LOAD_OPS_RV64[(insn >> 12) & 0x7]
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, imm64(imm_i(insn)))
+
+STORE_OPS_RV64 = [rv64i.SB, rv64i.SH, rv64i.SW, rv64i.SD, None, None, None, None]
+
+def decode_store_rv64(insn):
+    cls = STORE_OPS_RV64[(insn >> 12) & 0x7]
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 15) & 0x1f, (insn >> 20) & 0x1f, imm64(imm_s(insn)))
+
+OP_IMM_OPS_RV64 = [rv64i.ADDI, None, rv64i.SLTI, rv32i.SLTIU, rv32i.XORI, None, rv32i.ORI, rv32i.ANDI]
+
+# Keyed by funct6 << 3 | funct3, as insn[25] is part of the shift amount.
+OP_IMM_SHIFT_OPS_RV64 = {
+    0b000000_001: rv64i.SLLI,
+    0b000000_101: rv32i.SRLI,
+    0b010000_101: rv64i.SRAI,
+}
+
+def decode_op_imm_rv64(insn):
+    funct3 = (insn >> 12) & 0x7
+    cls = OP_IMM_OPS_RV64[funct3]
+    if cls is not None:
+        return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, imm64(imm_i(insn)))
+
+    cls = OP_IMM_SHIFT_OPS_RV64.get((insn >> 23) & 0x1f8 | funct3)
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, (insn >> 20) & 0x3f)
+
+# Keyed by funct7 << 3 | funct3.
+OP_OPS_RV64 = {
+    0b0000000_000: rv64i.ADD,
+    0b0000000_001: rv64i.SLL,
+    0b0000000_010: rv64i.SLT,
+    0b0000000_011: rv32i.SLTU,
+    0b0000000_100: rv32i.XOR,
+    0b0000000_101: rv64i.SRL,
+    0b0000000_110: rv32i.OR,
+    0b0000000_111: rv32i.AND,
+    0b0100000_000: rv64i.SUB,
+    0b0100000_101: rv64i.SRA,
+}
+
+def decode_op_rv64(insn):
+    cls = OP_OPS_RV64.get((insn >> 22) & 0x3f8 | (insn >> 12) & 0x7)
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, (insn >> 20) & 0x1f)
+
+# Keyed by funct7 << 3 | funct3.
+OP_IMM_32_SHIFT_OPS = {
+    0b0000000_001: rv64i.SLLIW,
+    0b0000000_101: rv64i.SRLIW,
+    0b0100000_101: rv64i.SRAIW,
+}
+
+def decode_op_imm_32(insn):
+    funct3 = (insn >> 12) & 0x7
+    if funct3 == 0b000:
+        return rv64i.ADDIW((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, imm64(imm_i(insn)))
+
+    cls = OP_IMM_32_SHIFT_OPS.get((insn >> 22) & 0x3f8 | funct3)
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, (insn >> 20) & 0x1f)
+
+# Keyed by funct7 << 3 | funct3.
+OP_32_OPS = {
+    0b0000000_000: rv64i.ADDW,
+    0b0100000_000: rv64i.SUBW,
+    0b0000000_001: rv64i.SLLW,
+    0b0000000_101: rv64i.SRLW,
+    0b0100000_101: rv64i.SRAW,
+}
+
+def decode_op_32(insn):
+    cls = OP_32_OPS.get((insn >> 22) & 0x3f8 | (insn >> 12) & 0x7)
+    if cls is None:
+        raise decode_error(insn)
+    return cls((insn >> 7) & 0x1f, (insn >> 15) & 0x1f, (insn >> 20) & 0x1f)
+
+CSR_OPS_RV64 = [None, rv32i.CSRRW, rv32i.CSRRS, rv64i.CSRRC, None, rv32i.CSRRWI, rv32i.CSRRSI, rv64i.CSRRCI]
+
+def decode_system_rv64(insn):
+    return decode_system(insn, CSR_OPS_RV64)
+
+# Indexed by opcode (insn[6:0]).
+OPCODE_DECODERS_RV64 = [None] * 128
+OPCODE_DECODERS_RV64[0b0110111] = decode_lui_rv64
+OPCODE_DECODERS_RV64[0b0010111] = decode_auipc_rv64
+OPCODE_DECODERS_RV64[0b1101111] = decode_jal_rv64
+OPCODE_DECODERS_RV64[0b1100111] = decode_jalr_rv64
+OPCODE_DECODERS_RV64[0b1100011] = decode_branch_rv64
+OPCODE_DECODERS_RV64[0b0000011] = decode_load_rv64
+OPCODE_DECODERS_RV64[0b0100011] = decode_store_rv64
+OPCODE_DECODERS_RV64[0b0010011] = decode_op_imm_rv64
+OPCODE_DECODERS_RV64[0b0110011] = decode_op_rv64
+OPCODE_DECODERS_RV64[0b0011011] = decode_op_imm_32
+OPCODE_DECODERS_RV64[0b0111011] = decode_op_32
+OPCODE_DECODERS_RV64[0b0001111] = decode_misc_mem
+OPCODE_DECODERS_RV64[0b1110011] = decode_system_rv64
+
+def decode_rv64(insn):
+    decoder = OPCODE_DECODERS_RV64[insn & 0x7f]
+    if decoder is None:
+        raise decode_error(insn)
+    return decoder(insn)
+
+# Decoder for each XLEN.
+DECODERS = {32: decode, 64: decode_rv64}
+
+# =============================================================================
+# Decode cache
+#
+class DecodeCache:
+    DEFAULT_CAPACITY = 4096
+    PAGE_SHIFT = 12
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, decode=decode):
+        self.capacity = capacity
+        self.decode = decode
+        self.entries = {}
+        self.pages = set()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def lookup(self, pc, insn):
+        entry = self.entries.get(pc)
+        if entry is not None and entry[0] == insn:
+            self.hit_count += 1
+            return entry[1]
+
+        self.miss_count += 1
+        op = self.decode(insn)
+
+        if entry is None and len(self.entries) >= self.capacity:
+            # Evict the oldest entry (dict keeps insertion order).
+            del self.entries[next(iter(self.entries))]
+        self.entries[pc] = (insn, op)
+        self.pages.add(pc >> self.PAGE_SHIFT)
+        return op
+
+    def invalidate(self, addr, size):
+        first_page = addr >> self.PAGE_SHIFT
+        last_page = (addr + size - 1) >> self.PAGE_SHIFT
+        if first_page not in self.pages and last_page not in self.pages:
+            return
+
+        # An instruction starting up to 3 bytes before addr overlaps the write.
+        for pc in range(addr - 3, addr + size):
+            self.entries.pop(pc, None)
+
+    def invalidate_all(self):
+        self.entries.clear()
+        self.pages.clear()
+
+    def get_hit_rate(self):
+        total = self.hit_count + self.miss_count
+        return self.hit_count / total if total > 0 else 0.0
+
 # =============================================================================
 # Bus
 #
+class ReservationTable:
+    """LR.W reservations of the harts sharing a bus, keyed by the harts' CpuState.
+
+    A reservation covers the cache line of the reserved word. harts maps each hart to its line and lines maps
+    each reserved line to the harts holding it, so a store only looks up the lines it writes."""
+    LINE_SHIFT = 6
+
+    def __init__(self):
+        self.harts = {}
+        self.lines = {}
+
+    def reserve(self, hart, addr):
+        self.release(hart)
+        line = addr >> self.LINE_SHIFT
+        self.harts[hart] = line
+        self.lines.setdefault(line, set()).add(hart)
+
+    def release(self, hart):
+        line = self.harts.pop(hart, None)
+        if line is not None:
+            holders = self.lines[line]
+            holders.discard(hart)
+            if not holders:
+                del self.lines[line]
+
+    def is_reserved(self, hart, addr):
+        return self.harts.get(hart) == addr >> self.LINE_SHIFT
+
+    def invalidate(self, addr, size):
+        """Drop the reservations on the lines overlapping [addr, addr + size)"""
+        for line in range(addr >> self.LINE_SHIFT, ((addr + size - 1) >> self.LINE_SHIFT) + 1):
+            for hart in self.lines.pop(line, ()):
+                del self.harts[hart]
+
+    def clear(self):
+        self.harts.clear()
+        self.lines.clear()
+
 class Bus:
     def __init__(self, memory):
         self.memory = memory
-    
-    def get_memory_addr(self, addr):
-        return addr - 0x8000_0000
+        self.code_caches = []
+        self.write_watches = []
+        self.reservations = ReservationTable()
+        # Stores only call into the table while some line is reserved.
+        self.reserved_lines = self.reservations.lines
 
-    def read_uint8(self, addr):
-        memory_addr = self.get_memory_addr(addr)
-        return self.memory.read_uint8(memory_addr)
+        # Reads have no side effects, so they go straight to the memory.
+        self.read_uint8 = memory.read_uint8
+        self.read_uint16 = memory.read_uint16
+        self.read_uint32 = memory.read_uint32
+        self.read_uint64 = memory.read_uint64
 
-    def read_uint16(self, addr):
-        memory_addr = self.get_memory_addr(addr)
-        return self.memory.read_uint16(memory_addr)
+    def add_code_cache(self, cache):
+        """Register a cache which must be invalidated on writes to code and on FENCE.I"""
+        self.code_caches.append(cache)
 
-    def read_uint32(self, addr):
-        memory_addr = self.get_memory_addr(addr)
-        return self.memory.read_uint32(memory_addr)
+    def invalidate_code_caches(self):
+        for cache in self.code_caches:
+            cache.invalidate_all()
+
+    def invalidate_code(self, addr, size):
+        for cache in self.code_caches:
+            cache.invalidate(addr, size)
+
+    def add_write_watch(self, addr, size, callback):
+        """Call callback(addr) after every write overlapping [addr, addr + size). Reads are not watched."""
+        self.write_watches.append((addr, addr + size, callback))
+
+    def remove_write_watch(self, callback):
+        self.write_watches = [watch for watch in self.write_watches if watch[2] != callback]
 
     def write_uint8(self, addr, value):
-        memory_addr = self.get_memory_addr(addr)
-        self.memory.write_uint8(memory_addr, value)
+        self.memory.write_uint8(addr, value)
+        for cache in self.code_caches:
+            cache.invalidate(addr, 1)
+        if self.reserved_lines:
+            self.reservations.invalidate(addr, 1)
+        for start, end, callback in self.write_watches:
+            if start < addr + 1 and addr < end:
+                callback(addr)
 
     def write_uint16(self, addr, value):
-        memory_addr = self.get_memory_addr(addr)
-        self.memory.write_uint16(memory_addr, value)
+        self.memory.write_uint16(addr, value)
+        for cache in self.code_caches:
+            cache.invalidate(addr, 2)
+        if self.reserved_lines:
+            self.reservations.invalidate(addr, 2)
+        for start, end, callback in self.write_watches:
+            if start < addr + 2 and addr < end:
+                callback(addr)
 
     def write_uint32(self, addr, value):
-        memory_addr = self.get_memory_addr(addr)
-        self.memory.write_uint32(memory_addr, value)
+        self.memory.write_uint32(addr, value)
+        for cache in self.code_caches:
+            cache.invalidate(addr, 4)
+        if self.reserved_lines:
+            self.reservations.invalidate(addr, 4)
+        for start, end, callback in self.write_watches:
+            if start < addr + 4 and addr < end:
+                callback(addr)
+
+    def write_uint64(self, addr, value):
+        self.memory.write_uint64(addr, value)
+        for cache in self.code_caches:
+            cache.invalidate(addr, 8)
+        if self.reserved_lines:
+            self.reservations.invalidate(addr, 8)
+        for start, end, callback in self.write_watches:
+            if start < addr + 8 and addr < end:
+                callback(addr)
 
 # =============================================================================
 # Processor
 #
 class Processor:
-    cpuState = cpu.CpuState()
+    RESET_PC = 0x8000_0000
 
-    def __init__(self, bus):
+    def __init__(self, bus, fixedint=False, xlen=32, hartid=0):
         self.bus = bus
-        self.cpuState.pc = 0x8000_0000
+        self.cpuState = cpu.CpuState(fixedint, xlen)
+        self.cpuState.pc = self.RESET_PC
+        self.set_hartid(hartid)
+        self.xlen = xlen
+        # PCs wrap around at XLEN bits.
+        self.pc_mask = self.cpuState.xlen_mask
+        # In fixedint mode RV32I ops run their fixedint reference implementations. The RV64I ops have none.
+        self.reference = fixedint and xlen == 32
+        self.decodeCache = DecodeCache(decode=DECODERS[xlen])
+        self.bus.add_code_cache(self.decodeCache)
+        # Number of exceptions taken, so tracing can tell which instructions trapped.
+        self.exception_count = 0
+
+    def reset(self):
+        self.cpuState.reset()
+        self.cpuState.pc = self.RESET_PC
+        self.set_hartid(self.hartid)
+
+    def set_hartid(self, hartid):
+        self.hartid = hartid
+        self.cpuState.csr[rv.CsrAddr.MHARTID.value] = hartid
 
     def dump_cpu_state(self):
+        digits = self.xlen // 4
         for i in range(32):
-            print(f"{rv.INT_REG_NAMES[i]} {self.cpuState.int_reg[i]:08x}")
+            print(f"{rv.INT_REG_NAMES[i]} {self.cpuState.int_reg[i]:0{digits}x}")
+
+    def fetch(self, pc):
+        """Read the instruction at pc. 32 bits are read, so a compressed instruction carries the next halfword."""
+        try:
+            return self.bus.read_uint32(pc)
+        except mem.MemoryAccessError:
+            return self.fetch_halfwords(pc)
+
+    def fetch_halfwords(self, pc):
+        """Read the instruction at pc when the 32 bits at pc are not all readable, as for a compressed instruction
+        at the end of memory. A 32-bit instruction straddling into an unreadable page faults on its second half."""
+        insn = self.bus.read_uint16(pc)
+        if insn & 0x3 == 0x3:
+            insn |= self.bus.read_uint16((pc + 2) & self.pc_mask) << 16
+        return insn
 
     def process_cycle(self):
         # fetch
-        insn = self.bus.read_uint32(self.cpuState.pc)
-        self.cpuState.next_pc = self.cpuState.pc + 4
+        try:
+            insn = self.bus.read_uint32(self.cpuState.pc)
+        except mem.MemoryAccessError:
+            try:
+                insn = self.fetch_halfwords(self.cpuState.pc)
+            except mem.MemoryAccessError as e:
+                self.process_access_fault(e, fetch=True)
+                return
 
         # decode
-        op = decode(insn)
-        #print(f"{self.cpuState.pc:08x} {op}")
+        op = self.decodeCache.lookup(self.cpuState.pc, insn)
+
+        self.execute_op(op)
+
+    def execute_op(self, op):
+        self.cpuState.next_pc = (self.cpuState.pc + op.size) & self.pc_mask
 
         # execute
-        op.execute(self.cpuState, self.bus)
+        try:
+            if self.reference:
+                reference.execute(op, self.cpuState, self.bus)
+            else:
+                op.execute(self.cpuState, self.bus)
+        except mem.MemoryAccessError as e:
+            self.process_access_fault(e)
+            return
+        self.cpuState.int_reg[0] = 0
         trap = op.post_check_trap(self.cpuState)
         if trap is not None:
             self.process_trap(trap)
@@ -278,6 +1119,20 @@ class Processor:
         # finalize
         self.cpuState.pc = self.cpuState.next_pc
     
+    def process_access_fault(self, error, fetch=False):
+        """Take an access-fault or address-misaligned trap for the op at the current PC, which has not modified any register"""
+        pc = self.cpuState.pc
+        if fetch:
+            trap = cpu.InsnAccessFaultException(pc, error.addr)
+        elif isinstance(error, mem.MisalignedAccessError):
+            trap = (cpu.StoreAddrMisalignedException if error.write else cpu.LoadAddrMisalignedException)(pc, error.addr)
+        elif error.write:
+            trap = cpu.StoreAccessFaultException(pc, error.addr)
+        else:
+            trap = cpu.LoadAccessFaultException(pc, error.addr)
+        self.process_trap(trap)
+        self.cpuState.pc = self.cpuState.next_pc
+
     def process_trap(self, trap):
         if trap.trapType == cpu.TrapType.EXCEPTION:
             self.process_exception(trap)
@@ -287,6 +1142,7 @@ class Processor:
             raise Exception("Not implemented.")
 
     def process_exception(self, trap):
+        self.exception_count += 1
         mtvec = rv.MTVEC(self.read_csr(rv.CsrAddr.MTVEC))
         mstatus = rv.MSTATUS(self.read_csr(rv.CsrAddr.MSTATUS))
 
@@ -295,10 +1151,10 @@ class Processor:
         mstatus.set_MPP(UInt32(3)) # priv M
 
         self.write_csr(rv.CsrAddr.MSTATUS, mstatus.value)
-        self.write_csr(rv.CsrAddr.MCAUSE, UInt32(trap.cause))
-        self.write_csr(rv.CsrAddr.MEPC, UInt32(trap.pc))
-        self.write_csr(rv.CsrAddr.MTVAL, UInt32(trap.trapValue))
-        self.cpuState.next_pc = mtvec.get_BASE() * 4
+        self.write_csr(rv.CsrAddr.MCAUSE, trap.cause)
+        self.write_csr(rv.CsrAddr.MEPC, trap.pc)
+        self.write_csr(rv.CsrAddr.MTVAL, trap.trapValue)
+        self.cpuState.next_pc = int(mtvec.get_BASE()) * 4
 
     def process_trap_return(self, trap):
         mstatus = rv.MSTATUS(self.read_csr(rv.CsrAddr.MSTATUS))
@@ -308,7 +1164,7 @@ class Processor:
         mstatus.set_MIE(mstatus.get_MPIE())
 
         self.write_csr(rv.CsrAddr.MSTATUS, mstatus.value)
-        self.cpuState.next_pc = mepc
+        self.cpuState.next_pc = int(mepc)
 
     def read_csr(self, csrAddr):
         return self.cpuState.csr[csrAddr.value]
@@ -319,27 +1175,266 @@ class Processor:
 # =============================================================================
 # Emulator
 #
+class Snapshot:
+    "Emulator state captured by Emulator.snapshot()"
+    def __init__(self, cpu_states, memory, cycle, host_io_addr, host_io_value):
+        self.cpu_states = cpu_states
+        self.memory = memory
+        self.cycle = cycle
+        self.host_io_addr = host_io_addr
+        self.host_io_value = host_io_value
+
 class Emulator:
     HOST_IO_ADDR = 0x8000_1000
+    ENGINES = ("interpreter", "block")
+    # Instructions a hart runs before the next hart gets its turn.
+    DEFAULT_QUANTUM = 1000
 
-    def __init__(self):
-        self.memory = mem.Memory()
+    def __init__(self, engine="interpreter", fixedint=False, memory_size=mem.Memory.DEFAULT_SIZE, memory_base=mem.Memory.DEFAULT_BASE, mapped=False, profile=False, xlen=32,
+            harts=1, quantum=DEFAULT_QUANTUM, memory=None):
+        """memory, if given, is used instead of a new memory of memory_size at memory_base, as by smp.run_processes()."""
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine '{engine}'.")
+        if harts < 1 or quantum < 1:
+            raise ValueError(f"Number of harts ({harts}) and quantum ({quantum}) must be positive.")
+
+        self.engine = engine
+        if memory is None:
+            memory = (mem.MappedMemory if mapped else mem.Memory)(memory_size, memory_base)
+        self.memory = memory
         self.bus = Bus(self.memory)
-        self.processor = Processor(self.bus)
+        # All harts share the bus. self.processor and self.blockEngine are those of the hart being run,
+        # and of hart 0 between steps.
+        self.processors = [Processor(self.bus, fixedint, xlen, hartid) for hartid in range(harts)]
+        self.blockEngines = [translator.BlockEngine(processor) if engine == "block" else None for processor in self.processors]
+        self.processor = self.processors[0]
+        self.blockEngine = self.blockEngines[0]
+        self.quantum = quantum
+        # While profiling, every instruction runs through step_detailed() to be recorded.
+        self.profiler = profiler.Profiler() if profile else None
+        # A trace.TraceWriter set here gets a record of every instruction run by step().
+        self.trace_writer = None
+        self.cycle = 0
+        for processor in self.processors:
+            processor.cpuState.get_count = self.get_cycle
+        self.host_io_value = 0
+        self.host_io_addr = None
+        self.set_host_io_addr(self.HOST_IO_ADDR)
+
+    def set_host_io_addr(self, addr):
+        if self.host_io_addr is not None:
+            self.bus.remove_write_watch(self.on_host_io_write)
+        self.host_io_addr = addr
+        self.bus.add_write_watch(addr, 4, self.on_host_io_write)
+
+    def get_cycle(self):
+        """Number of instructions run so far, from which the counter CSRs are derived"""
+        return self.cycle
 
     def load(self, path):
-        self.memory.load(path)
+        """Load an ELF file, or a flat binary at the memory base"""
+        if elf.is_elf(path):
+            self.load_elf(path)
+        else:
+            self.memory.load(path)
+        self.bus.invalidate_code_caches()
+
+    def load_elf(self, path):
+        """Map the PT_LOAD segments, start at e_entry and watch 'tohost' if the symbol table has it"""
+        with elf.ElfFile(path) as image:
+            if image.xlen != self.processor.xlen:
+                raise Exception(f"'{path}' is an RV{image.xlen} file, but the emulator runs RV{self.processor.xlen}.")
+            image.load(self.memory)
+            for processor in self.processors:
+                processor.cpuState.pc = image.entry
+            tohost = image.symbols.get('tohost')
+        if tohost is not None:
+            self.set_host_io_addr(tohost)
+
+    def reset(self):
+        """Return to the power-on state, reusing the memory and register buffers"""
+        self.memory.clear()
+        for processor in self.processors:
+            processor.reset()
+        self.bus.invalidate_code_caches()
+        self.bus.reservations.clear()
+        self.cycle = 0
+        self.host_io_value = 0
+        self.set_host_io_addr(self.HOST_IO_ADDR)
+
+    def snapshot(self):
+        """Capture the CPU and memory state. Memory pages are shared with the emulator until it writes them."""
+        return Snapshot([processor.cpuState.snapshot() for processor in self.processors], self.memory.snapshot(), self.cycle, self.host_io_addr, self.host_io_value)
+
+    def restore(self, snapshot):
+        """Return to a snapshot. Only memory pages changed since the last snapshot or restore are put back."""
+        for processor, cpu_state in zip(self.processors, snapshot.cpu_states):
+            processor.cpuState.restore(cpu_state)
+        for number in self.memory.restore(snapshot.memory):
+            self.bus.invalidate_code(number << mem.PAGE_SHIFT, mem.PAGE_SIZE)
+        self.bus.reservations.clear()
+        self.cycle = snapshot.cycle
+        if snapshot.host_io_addr != self.host_io_addr:
+            self.set_host_io_addr(snapshot.host_io_addr)
+        self.host_io_value = snapshot.host_io_value
+
+    def on_host_io_write(self, addr):
+        self.host_io_value = self.bus.read_uint32(self.host_io_addr)
+        if self.blockEngine is not None:
+            self.blockEngine.leave_block = True
+
+    def step(self, count):
+        """Execute count instructions on every hart, stopping early when the guest writes tohost.
+        Returns the number executed per hart."""
+        if len(self.processors) > 1:
+            return self.step_harts(count)
+        return self.step_hart(count)
+
+    def step_harts(self, count):
+        """Let the harts take turns running self.quantum instructions, until each has run count.
+
+        Every turn of a round starts from the same cycle, so the counter CSRs of all harts advance together.
+        Returns the number executed per hart, which is short of count if a hart wrote tohost."""
+        count = int(count)
+        start = self.cycle
+        done = 0
+        while done < count and self.host_io_value == 0:
+            executed = quantum = min(self.quantum, count - done)
+            for processor, blockEngine in zip(self.processors, self.blockEngines):
+                self.processor = processor
+                self.blockEngine = blockEngine
+                self.cycle = start + done
+                executed = self.step_hart(quantum)
+                if executed < quantum:
+                    break
+            done += executed
+        self.processor = self.processors[0]
+        self.blockEngine = self.blockEngines[0]
+        self.cycle = start + done
+        return done
+
+    def step_hart(self, count):
+        """Execute count instructions on the current hart, stopping early when the guest writes tohost.
+        Returns the number executed.
+
+        The block engine only runs blocks which fit in the remaining count, so the count is exact."""
+        if self.profiler is not None:
+            return self.step_detailed(count, self.profiler)
+        if self.trace_writer is not None:
+            return self.step_traced(count, self.trace_writer)
+
+        count = int(count)
+        cycle = 0
+        blockEngine = self.blockEngine
+        # Updated by on_host_io_write() when the guest stores to host_io_addr.
+        while cycle < count and self.host_io_value == 0:
+            executed = blockEngine.execute_blocks(count - cycle) if blockEngine is not None else 0
+            if executed == 0:
+                # The next block is longer than the remaining count.
+                self.processor.process_cycle()
+                executed = 1
+            cycle += executed
+            self.cycle += executed
+        return cycle
+
+    def step_detailed(self, count, stats):
+        """Execute count instructions one at a time in detailed mode, recording them in stats.
+
+        Stops early when the guest writes tohost, like step(). Returns the number executed."""
+        count = int(count)
+        cycle = 0
+        processor = self.processor
+        state = processor.cpuState
+        while cycle < count and self.host_io_value == 0:
+            pc = state.pc
+            try:
+                insn = processor.fetch(pc)
+            except mem.MemoryAccessError as e:
+                processor.process_access_fault(e, fetch=True)
+            else:
+                op = processor.decodeCache.lookup(pc, insn)
+                stats.record(pc, op, state, self.bus)
+                processor.execute_op(op)
+                if state.pc != (pc + op.size) & processor.pc_mask:
+                    stats.taken += 1
+            cycle += 1
+            self.cycle += 1
+        stats.count += cycle
+        return cycle
+
+    def step_traced(self, count, writer):
+        """Execute count instructions one at a time, writing a trace record of each to writer.
+
+        Stops early when the guest writes tohost, like step(). Returns the number executed."""
+        cycle = 0
+        for record in self.trace_records(count):
+            writer.write(*record)
+            cycle += 1
+        return cycle
+
+    def trace_records(self, count):
+        """Execute up to count instructions one at a time, yielding a trace.TraceRecord after each.
+
+        Stops early when the guest writes tohost, like step()."""
+        count = int(count)
+        cycle = 0
+        processor = self.processor
+        state = processor.cpuState
+        while cycle < count and self.host_io_value == 0:
+            pc = state.pc
+            exception_count = processor.exception_count
+            try:
+                insn = processor.fetch(pc)
+            except mem.MemoryAccessError as e:
+                processor.process_access_fault(e, fetch=True)
+                record = trace.TraceRecord(pc, 0, trace.FLAG_TRAP, 0, 0, 0, 0, 0)
+            else:
+                op = processor.decodeCache.lookup(pc, insn)
+                access = trace.get_memory_access(op, state, self.bus)
+                processor.execute_op(op)
+                record = trace.make_record(pc, insn, op, state, access, processor.exception_count != exception_count, self.bus)
+            cycle += 1
+            self.cycle += 1
+            yield record
+
+    def run_sampled(self, maxCycle, intervals):
+        """Run up to maxCycle instructions, fast-forwarding with the configured engine between intervals.
+
+        intervals is a sorted list of (start, length), with start counted in retired instructions like self.cycle.
+        Each interval runs in detailed mode and gets its own sampling.IntervalStats; the list of them is returned.
+        Unlike run(), this does not check the tohost value."""
+        if len(self.processors) > 1:
+            raise Exception("Sampled runs support a single hart.")
+        end = self.cycle + int(maxCycle)
+        results = []
+        for start, length in intervals:
+            if start >= end:
+                break
+            if start + length <= self.cycle:
+                continue
+            if start > self.cycle:
+                self.step(start - self.cycle)
+            if self.host_io_value != 0:
+                break
+            stats = sampling.IntervalStats(self.cycle)
+            self.step_detailed(min(start + length, end) - self.cycle, stats)
+            results.append(stats)
+        self.step(end - self.cycle)
+        return results
 
     def run(self, maxCycle):
-        for cycle in range(int(maxCycle)):
-            self.processor.process_cycle()
+        maxCycle = int(maxCycle)
+        self.step(maxCycle)
+        self.check_host_io(maxCycle)
 
-            host_io_value = self.bus.read_uint32(self.HOST_IO_ADDR)
-            if host_io_value == 1:
-                print(f"HostIo: {host_io_value} (success)")
-                return
-            elif host_io_value != 0:
-                print(f"HostIo: {host_io_value} (failure: testId={host_io_value // 2})")
-                raise Exception(f"Host IO value is not 1.")
-        
-        raise Exception(f"Emulation hasn't finished within {maxCycle} cycles.")
\ No newline at end of file
+    def check_host_io(self, maxCycle):
+        """Print the tohost value. Raises an exception if the guest failed or has not finished."""
+        host_io_value = self.host_io_value
+        if host_io_value == 1:
+            print(f"HostIo: {host_io_value} (success)")
+            return
+        elif host_io_value != 0:
+            print(f"HostIo: {host_io_value} (failure: testId={host_io_value // 2})")
+            raise Exception(f"Host IO value is not 1.")
+
+        raise Exception(f"Emulation hasn't finished within {maxCycle} cycles.")
@@ -0,0 +1,118 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from . import checkpoint
+from . import emu
+from . import mem
+from . import runner
+from . import sampling
+
+# =============================================================================
+# Interval result
+#
+class IntervalResult:
+    def __init__(self, path, start, end, stats, wall_time, mismatches, host_io_value):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.stats = stats
+        self.wall_time = wall_time
+        # Differences from the checkpoint at the end of the interval. Empty when the states match.
+        self.mismatches = mismatches
+        self.host_io_value = host_io_value
+
+def compare(emulator, expected):
+    """Return a description of each difference in pc, registers, CSRs and memory between two emulators"""
+    mismatches = []
+    state = emulator.processor.cpuState
+    expected_state = expected.processor.cpuState
+    digits = state.xlen // 4
+    if state.pc != expected_state.pc:
+        mismatches.append(f"pc: 0x{state.pc:0{digits}x} != 0x{expected_state.pc:0{digits}x}")
+    for i in range(32):
+        if state.int_reg[i] != expected_state.int_reg[i]:
+            mismatches.append(f"x{i}: 0x{state.int_reg[i]:0{digits}x} != 0x{expected_state.int_reg[i]:0{digits}x}")
+    # read_csr() derives the counter CSRs, which are not kept in state.csr.
+    for addr in range(0x1000):
+        value = state.read_csr(addr)
+        expected_value = expected_state.read_csr(addr)
+        if value != expected_value:
+            mismatches.append(f"csr 0x{addr:03x}: 0x{value:0{digits}x} != 0x{expected_value:0{digits}x}")
+
+    pages = emulator.memory.pages
+    expected_pages = expected.memory.pages
+    for number in sorted(pages.keys() | expected_pages.keys()):
+        if pages.get(number, checkpoint.ZERO_PAGE) != expected_pages.get(number, checkpoint.ZERO_PAGE):
+            mismatches.append(f"page 0x{number << 12:08x}")
+    return mismatches
+
+# =============================================================================
+# Worker
+#
+# Each worker process keeps one emulator for replaying intervals and one for loading the expected end state.
+worker_emulator = None
+worker_expected = None
+worker_sample_length = None
+
+def init_worker(engine, fixedint, memory_size, memory_base, sample_length):
+    global worker_emulator, worker_expected, worker_sample_length
+    worker_emulator = emu.Emulator(engine, fixedint, memory_size, memory_base)
+    worker_expected = emu.Emulator(engine, fixedint, memory_size, memory_base)
+    worker_sample_length = sample_length
+
+def run_interval(path, end, end_path):
+    """Replay from the checkpoint at path to instruction count end and check the state against end_path.
+
+    The last interval has no end_path; it runs until the guest writes tohost or end is reached."""
+    emulator = worker_emulator
+    start_time = time.perf_counter()
+    checkpoint.load(emulator, path)
+    start = emulator.cycle
+
+    length = end - start
+    sample_length = length if worker_sample_length is None else min(worker_sample_length, length)
+    stats = emulator.run_sampled(length, [(start, sample_length)])
+
+    mismatches = []
+    if end_path is not None:
+        checkpoint.load(worker_expected, end_path)
+        mismatches = compare(emulator, worker_expected)
+    wall_time = time.perf_counter() - start_time
+
+    return IntervalResult(path, start, emulator.cycle, stats[0] if stats else None, wall_time, mismatches, emulator.host_io_value)
+
+def run_intervals(paths, engine="interpreter", fixedint=False, memory_size=mem.Memory.DEFAULT_SIZE,
+        memory_base=mem.Memory.DEFAULT_BASE, sample_length=None, max_cycle=10000, jobs=None):
+    """Replay the intervals between checkpoints on a process pool, yielding IntervalResult in instruction order.
+
+    The interval after the last checkpoint runs for up to max_cycle instructions."""
+    checkpoints = sorted((checkpoint.read_cycle(path), path) for path in paths)
+    intervals = []
+    for i, (cycle, path) in enumerate(checkpoints):
+        if i + 1 < len(checkpoints):
+            intervals.append((path, checkpoints[i + 1][0], checkpoints[i + 1][1]))
+        else:
+            intervals.append((path, cycle + max_cycle, None))
+
+    initargs = (engine, fixedint, memory_size, memory_base, sample_length)
+    yield from runner.map_jobs(run_interval, intervals, init_worker, initargs, jobs)
+
+def merge_stats(results):
+    """Merge the statistics of all intervals into one sampling.IntervalStats"""
+    merged = sampling.IntervalStats(min((result.start for result in results), default=0))
+    for result in results:
+        if result.stats is not None:
+            merged.merge(result.stats)
+    return merged
@@ -0,0 +1,280 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import io
+import re
+from . import mem
+from . import trace
+
+# =============================================================================
+# Reference logs
+#
+# A reference is a rafi trace file, or a Spike commit log (spike --log-commits), which has lines like
+#
+#   core   0: 3 0x80000004 (0x00a58593) x11 0x00000005
+#   core   0: 3 0x80000028 (0x0063a023) mem 0x80001000 0x00000001
+#   core   0: 3 0x8000002c (0x0003a703) x14 0x00000001 mem 0x80001000
+#
+# Spike logs nothing for an instruction that takes an exception, so such records are dropped from both sides.
+#
+SPIKE_COMMIT = re.compile(r'core\s+\d+:\s+(?:\d\s+)?0x([0-9a-fA-F]+)\s+\(0x([0-9a-fA-F]+)\)(.*)$')
+SPIKE_INT_REG = re.compile(r'x(\d+)$')
+# CSR and floating point register writes, which are not compared.
+SPIKE_OTHER_REG = re.compile(r'(c\d+_\w+|f\d+)$')
+
+def parse_spike_line(line):
+    """Return the TraceRecord of a Spike commit log line, or None for other lines"""
+    match = SPIKE_COMMIT.match(line.strip())
+    if match is None:
+        return None
+    pc = int(match.group(1), 16)
+    insn = int(match.group(2), 16)
+    flags = rd = size = rd_value = mem_addr = mem_value = 0
+
+    tokens = match.group(3).split()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        # Older Spike versions write the register number apart, as 'x 5'.
+        if token == 'x' and i + 2 < len(tokens):
+            token += tokens[i + 1]
+            i += 1
+        if token == 'mem':
+            mem_addr = int(tokens[i + 1], 16)
+            if i + 2 < len(tokens) and tokens[i + 2].startswith('0x'):
+                # Store values are printed with two digits per byte.
+                flags |= trace.FLAG_STORE
+                mem_value = int(tokens[i + 2], 16)
+                size = (len(tokens[i + 2]) - 2) // 2
+                i += 3
+            else:
+                flags |= trace.FLAG_LOAD
+                i += 2
+            continue
+        reg = SPIKE_INT_REG.match(token)
+        if reg is not None:
+            if int(reg.group(1)) != 0:
+                flags |= trace.FLAG_RD
+                rd = int(reg.group(1))
+                rd_value = int(tokens[i + 1], 16)
+        elif SPIKE_OTHER_REG.match(token) is None or i + 1 >= len(tokens):
+            # A disassembly line of 'spike -l', not a commit.
+            return None
+        i += 2
+    return trace.TraceRecord(pc, insn, flags, rd, size, rd_value, mem_addr, mem_value)
+
+def read_reference(path):
+    """Yield the TraceRecords of a rafi trace file or a Spike commit log, leaving out trapped instructions"""
+    with trace.open_file(path, 'rb') as f:
+        is_trace = f.read(len(trace.MAGIC)) == trace.MAGIC
+    if is_trace:
+        for record in trace.read(path):
+            if not record.flags & trace.FLAG_TRAP:
+                yield record
+        return
+
+    with trace.open_file(path, 'rb') as f:
+        for line in io.TextIOWrapper(f, errors='replace'):
+            record = parse_spike_line(line)
+            if record is not None:
+                yield record
+
+def insn_size(insn):
+    return 4 if insn & 0x3 == 0x3 else 2
+
+def format_record(record):
+    if record is None:
+        return "-"
+    insn = f"0x{record.insn:08x}" if insn_size(record.insn) == 4 else f"0x{record.insn:04x}"
+    if record.flags & trace.FLAG_TRAP:
+        return f"0x{record.pc:08x} ({insn}) trap"
+    text = f"0x{record.pc:08x} ({insn})"
+    if record.flags & trace.FLAG_RD:
+        text += f" x{record.rd} 0x{record.rd_value:08x}"
+    if record.flags & trace.FLAG_LOAD:
+        text += f" mem 0x{record.mem_addr:08x}"
+    if record.flags & trace.FLAG_STORE:
+        text += f" mem 0x{record.mem_addr:08x} 0x{record.mem_value:0{record.size * 2}x}"
+    return text
+
+def compare_records(actual, expected):
+    """Return a description of the first difference between two records, or None"""
+    if actual.pc != expected.pc:
+        return f"pc: 0x{actual.pc:08x} != 0x{expected.pc:08x}"
+    if actual.insn != expected.insn:
+        return f"insn: 0x{actual.insn:08x} != 0x{expected.insn:08x}"
+    if actual.flags & trace.FLAG_RD != expected.flags & trace.FLAG_RD or actual.rd != expected.rd:
+        return f"rd: {format_record(actual)} != {format_record(expected)}"
+    if actual.rd_value != expected.rd_value:
+        return f"x{actual.rd}: 0x{actual.rd_value:08x} != 0x{expected.rd_value:08x}"
+    if expected.flags & trace.FLAG_LOAD:
+        if not actual.flags & trace.FLAG_LOAD or actual.mem_addr != expected.mem_addr:
+            return f"load: {format_record(actual)} != {format_record(expected)}"
+    if expected.flags & trace.FLAG_STORE:
+        if (not actual.flags & trace.FLAG_STORE or actual.mem_addr != expected.mem_addr
+                or actual.size != expected.size or actual.mem_value != expected.mem_value):
+            return f"store: {format_record(actual)} != {format_record(expected)}"
+    return None
+
+# =============================================================================
+# Differ
+#
+class Divergence:
+    "The first point where the emulator and the reference disagree"
+
+    def __init__(self, index, reason, context):
+        # Number of reference instructions that matched before the divergence.
+        self.index = index
+        self.reason = reason
+        # (actual, expected) record pairs up to the divergence. Either may be None.
+        self.context = context
+
+    def __str__(self):
+        lines = [f"Divergence after {self.index} insns: {self.reason}", f"  {'emulator':<56} reference"]
+        for actual, expected in self.context:
+            lines.append(f"  {format_record(actual):<56} {format_record(expected)}")
+        return "\n".join(lines)
+
+class Differ:
+    """Runs an emulator against a stream of reference TraceRecords without storing either trace.
+
+    In lockstep mode every instruction is compared. In skip-ahead mode the emulator runs with step() to a
+    control transfer in the reference at least min_distance instructions ahead, and only pc, the registers
+    written and the bytes stored since the previous comparison are checked."""
+
+    def __init__(self, emulator, reference, context=10, skip_ahead=False, min_distance=64):
+        self.emulator = emulator
+        self.reference = iter(reference)
+        self.context = collections.deque(maxlen=context)
+        self.skip_ahead = skip_ahead
+        self.min_distance = min_distance
+        self.count = 0
+
+    def sync(self):
+        """Skip reference records before the emulator PC, such as Spike's boot ROM"""
+        pc = self.emulator.processor.cpuState.pc
+        for record in self.reference:
+            if record.pc == pc:
+                return record
+        return None
+
+    def run(self, max_cycle):
+        """Return the first Divergence within max_cycle instructions, or None if the emulator matches the reference
+        until the reference ends. A reference which never reaches the emulator PC, or which continues after the
+        guest writes tohost, is a Divergence too."""
+        first = self.sync()
+        if first is None:
+            return self.divergence(f"the reference never reaches the start PC 0x{self.emulator.processor.cpuState.pc:08x}")
+        if self.skip_ahead:
+            return self.run_skip_ahead(max_cycle, first)
+        return self.run_lockstep(max_cycle, first)
+
+    def divergence(self, reason):
+        return Divergence(self.count, reason, list(self.context))
+
+    def run_lockstep(self, max_cycle, expected):
+        for actual in self.emulator.trace_records(max_cycle):
+            if actual.flags & trace.FLAG_TRAP:
+                self.context.append((actual, None))
+                continue
+            if expected is None:
+                expected = next(self.reference, None)
+                if expected is None:
+                    return None
+            self.context.append((actual, expected))
+            reason = compare_records(actual, expected)
+            if reason is not None:
+                return self.divergence(reason)
+            self.count += 1
+            expected = None
+        if self.emulator.host_io_value != 0:
+            if expected is None:
+                expected = next(self.reference, None)
+            if expected is not None:
+                self.context.append((None, expected))
+                return self.divergence("the emulator stopped before the reference")
+        return None
+
+    def step(self, count):
+        """Execute count instructions that do not trap. Returns the number executed, which is less if the guest finished first."""
+        emulator = self.emulator
+        processor = emulator.processor
+        remaining = count
+        while remaining > 0:
+            exception_count = processor.exception_count
+            executed = emulator.step(remaining)
+            # Trapped instructions are not in the reference, so run that many more.
+            trapped = processor.exception_count - exception_count
+            if executed < remaining:
+                return count - remaining + executed - trapped
+            remaining = trapped
+        return count
+
+    def run_skip_ahead(self, max_cycle, expected):
+        emulator = self.emulator
+        state = emulator.processor.cpuState
+        pc_mask = emulator.processor.pc_mask
+        cycle = 0
+        while expected is not None and cycle < max_cycle:
+            start = expected.pc
+            records = []
+            # Take reference records up to a control transfer at least min_distance ahead.
+            while True:
+                self.context.append((None, expected))
+                records.append(expected)
+                last = expected
+                expected = next(self.reference, None)
+                if expected is None or cycle + len(records) >= max_cycle:
+                    break
+                if len(records) >= self.min_distance and expected.pc != (last.pc + insn_size(last.insn)) & pc_mask:
+                    break
+
+            count = len(records)
+            executed = self.step(count)
+            cycle += executed
+
+            # When the guest finishes early, the records it did execute are still compared, with the write to tohost.
+            regs = {}
+            stores = {}
+            for record in records[:executed]:
+                if record.flags & trace.FLAG_RD:
+                    regs[record.rd] = record.rd_value
+                if record.flags & trace.FLAG_STORE:
+                    for i in range(record.size):
+                        stores[record.mem_addr + i] = (record.mem_value >> (i * 8)) & 0xff
+
+            mismatches = []
+            next_record = expected
+            if executed < count:
+                mismatches.append(f"the emulator stopped after {executed} of {count} insns")
+                next_record = records[executed]
+            if next_record is not None and state.pc != next_record.pc:
+                mismatches.append(f"pc: 0x{state.pc:08x} != 0x{next_record.pc:08x}")
+            for reg, value in sorted(regs.items()):
+                if state.int_reg[reg] != value:
+                    mismatches.append(f"x{reg}: 0x{state.int_reg[reg]:08x} != 0x{value:08x}")
+            for addr, value in sorted(stores.items()):
+                try:
+                    actual = emulator.memory.read_uint8(addr)
+                except mem.MemoryAccessError:
+                    mismatches.append(f"mem 0x{addr:08x}: not in memory")
+                    continue
+                if actual != value:
+                    mismatches.append(f"mem 0x{addr:08x}: 0x{actual:02x} != 0x{value:02x}")
+            if mismatches:
+                return self.divergence(f"between 0x{start:08x} and 0x{last.pc:08x} (ahead of {self.count}): " + ", ".join(mismatches))
+            self.count += count
+            self.context.clear()
+        return None
@@ -12,40 +12,375 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mmap
+from multiprocessing import shared_memory
+import os
+import struct
+import sys
+
+UINT16 = struct.Struct('<H')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+
+# memoryview.cast() uses the host byte order, so word views are only usable on little-endian hosts.
+HAS_WORD_VIEW = sys.byteorder == 'little'
+
+class MemoryAccessError(Exception):
+    "Raised on an access outside of the memory range. Processor turns it into an access-fault trap."
+    def __init__(self, addr, write):
+        super().__init__(f"Access fault at 0x{addr:08x} ({'write' if write else 'read'}).")
+        self.addr = addr
+        self.write = write
+
+class MisalignedAccessError(MemoryAccessError):
+    "Raised by an access which must be naturally aligned, as for atomics. Processor turns it into an address-misaligned trap."
+    def __init__(self, addr, write):
+        Exception.__init__(self, f"Misaligned access at 0x{addr:08x} ({'write' if write else 'read'}).")
+        self.addr = addr
+        self.write = write
+
+class MemorySnapshot:
+    "Pages frozen by Memory.snapshot(). Frozen pages are never written again."
+    def __init__(self, pages, word_pages):
+        self.pages = pages
+        self.word_pages = word_pages
+
 class Memory:
-    "Memory emulation class"
+    """Sparse memory emulation class.
+
+    The guest range [base, base + size) is split into 4 KiB pages which are allocated on first touch,
+    so a large address space only costs host memory for the pages actually used.
+    Accessors take bus addresses.
+
+    Reads and writes look pages up in separate dicts. The write dicts only hold pages private to the memory;
+    pages shared with a snapshot or a read-only mapping are copied on the first write."""
+    DEFAULT_BASE = 0x8000_0000
+    DEFAULT_SIZE = 0x8000_0000
+
+    def __init__(self, size=DEFAULT_SIZE, base=DEFAULT_BASE):
+        if size <= 0 or size & PAGE_MASK or base & PAGE_MASK:
+            raise ValueError(f"Memory base (0x{base:x}) and size (0x{size:x}) must be multiples of the page size.")
+        self.base = base
+        self.size = size
+        self.pages = {}
+        self.word_pages = {}
+        self.write_pages = {}
+        self.write_word_pages = {}
+        # Page numbers changed since last_snapshot was taken or restored.
+        self.dirty = set()
+        self.last_snapshot = None
+
+    def clear(self):
+        self.pages.clear()
+        self.word_pages.clear()
+        self.write_pages.clear()
+        self.write_word_pages.clear()
+        self.dirty.clear()
+        self.last_snapshot = None
 
-    CAPACITY = 64 * 1024
+    def touch(self, addr, write=False):
+        """Return the page containing addr, allocating it if needed. For writes, the page is made private first."""
+        number = addr >> PAGE_SHIFT
+        page = self.pages.get(number)
+        if page is None:
+            if not self.base <= addr < self.base + self.size:
+                raise MemoryAccessError(addr, write)
+            page = self.allocate_page(number)
+            self.set_page(number, page, not memoryview(page).readonly)
+        if write and number not in self.write_pages:
+            page = bytearray(page)
+            self.set_page(number, page, True)
+        return page
 
-    data = bytearray(CAPACITY)
+    def set_page(self, number, page, private):
+        words = memoryview(page).cast('I') if HAS_WORD_VIEW else None
+        self.pages[number] = page
+        self.word_pages[number] = words
+        if private:
+            self.write_pages[number] = page
+            self.write_word_pages[number] = words
+        else:
+            self.write_pages.pop(number, None)
+            self.write_word_pages.pop(number, None)
+        self.dirty.add(number)
+
+    def drop_page(self, number):
+        page = self.pages.pop(number, None)
+        self.word_pages.pop(number, None)
+        self.write_pages.pop(number, None)
+        self.write_word_pages.pop(number, None)
+        self.dirty.add(number)
+        if page is not None:
+            self.release_page(number, page)
+
+    def release_page(self, number, page):
+        pass
+
+    def snapshot(self):
+        """Freeze the current pages. Later writes copy a page before changing it, so taking a snapshot copies no data."""
+        snapshot = MemorySnapshot(dict(self.pages), dict(self.word_pages))
+        self.write_pages.clear()
+        self.write_word_pages.clear()
+        self.dirty.clear()
+        self.last_snapshot = snapshot
+        return snapshot
+
+    def restore(self, snapshot):
+        """Return to a snapshot and return the numbers of the pages which were put back.
+
+        When restoring the snapshot taken or restored last, only the pages changed since then are visited."""
+        if snapshot is self.last_snapshot:
+            numbers = self.dirty
+        else:
+            numbers = self.pages.keys() | snapshot.pages.keys()
+        self.dirty = set()
+
+        for number in numbers:
+            page = snapshot.pages.get(number)
+            if page is None:
+                self.drop_page(number)
+            else:
+                self.pages[number] = page
+                self.word_pages[number] = snapshot.word_pages[number]
+                self.write_pages.pop(number, None)
+                self.write_word_pages.pop(number, None)
+
+        self.dirty.clear()
+        self.last_snapshot = snapshot
+        return numbers
+
+    def allocate_page(self, number):
+        return bytearray(PAGE_SIZE)
 
     def load(self, path):
+        """Load a flat binary at the base address"""
         with open(path, mode='rb') as f:
-            data = f.read()
-            if len(data) > len(self.data):
-                raise Exception(f"Size of '{path}' ({len(data)}) is larger than memory size ({len(self.data)}).")
-            self.data[0:len(data)] = data[0:len(data)]
+            size = os.fstat(f.fileno()).st_size
+            if size > self.size:
+                raise Exception(f"Size of '{path}' ({size}) is larger than memory size ({self.size}).")
+            self.load_image(self.base, f, 0, size)
+
+    def check_image(self, addr, size):
+        if not (self.base <= addr and addr + size <= self.base + self.size):
+            raise Exception(f"Image at 0x{addr:08x} ({size} bytes) is out of memory range.")
+
+    def load_image(self, addr, f, offset, size):
+        """Copy size bytes at offset of file f to addr, reading straight into the pages"""
+        self.check_image(addr, size)
+        f.seek(offset)
+        end = addr + size
+        while addr < end:
+            page_offset = addr & PAGE_MASK
+            length = min(PAGE_SIZE - page_offset, end - addr)
+            f.readinto(memoryview(self.touch(addr, True))[page_offset:page_offset + length])
+            addr += length
+
+    def zero(self, addr, size):
+        """Zero-fill [addr, addr + size). Pages which were never touched are already zero and stay unallocated."""
+        self.check_image(addr, size)
+        end = addr + size
+        while addr < end:
+            page_offset = addr & PAGE_MASK
+            length = min(PAGE_SIZE - page_offset, end - addr)
+            if (addr >> PAGE_SHIFT) in self.pages:
+                self.touch(addr, True)[page_offset:page_offset + length] = bytes(length)
+            addr += length
 
+    def read_bytes(self, addr, size):
+        data = bytearray()
+        end = addr + size
+        while addr < end:
+            offset = addr & PAGE_MASK
+            length = min(PAGE_SIZE - offset, end - addr)
+            data += self.touch(addr)[offset:offset + length]
+            addr += length
+        return bytes(data)
+
+    def write_bytes(self, addr, data):
+        data = memoryview(data)
+        if len(data) > 0:
+            # Fault before anything is written if the range runs past the end of memory.
+            self.touch(addr, True)
+            self.touch(addr + len(data) - 1, True)
+        while len(data) > 0:
+            offset = addr & PAGE_MASK
+            length = min(PAGE_SIZE - offset, len(data))
+            self.touch(addr, True)[offset:offset + length] = data[:length]
+            addr += length
+            data = data[length:]
+
+    # Accesses crossing a page boundary fall back to read_bytes() / write_bytes().
+    # Pages missing from the dicts are handled by touch() in the KeyError path.
     def read_uint8(self, addr):
-        return int.from_bytes(self.data[addr:addr+1], byteorder='little')
+        try:
+            return self.pages[addr >> PAGE_SHIFT][addr & PAGE_MASK]
+        except KeyError:
+            return self.touch(addr)[addr & PAGE_MASK]
 
     def read_uint16(self, addr):
-        return int.from_bytes(self.data[addr:addr+2], byteorder='little')
+        offset = addr & PAGE_MASK
+        if offset > PAGE_SIZE - 2:
+            return int.from_bytes(self.read_bytes(addr, 2), 'little')
+        try:
+            return UINT16.unpack_from(self.pages[addr >> PAGE_SHIFT], offset)[0]
+        except KeyError:
+            return UINT16.unpack_from(self.touch(addr), offset)[0]
 
     def read_uint32(self, addr):
-        return int.from_bytes(self.data[addr:addr+4], byteorder='little')
+        if addr & 3 == 0 and HAS_WORD_VIEW:
+            try:
+                return self.word_pages[addr >> PAGE_SHIFT][(addr & PAGE_MASK) >> 2]
+            except KeyError:
+                self.touch(addr)
+                return self.word_pages[addr >> PAGE_SHIFT][(addr & PAGE_MASK) >> 2]
+        offset = addr & PAGE_MASK
+        if offset > PAGE_SIZE - 4:
+            return int.from_bytes(self.read_bytes(addr, 4), 'little')
+        try:
+            return UINT32.unpack_from(self.pages[addr >> PAGE_SHIFT], offset)[0]
+        except KeyError:
+            return UINT32.unpack_from(self.touch(addr), offset)[0]
+
+    def read_uint64(self, addr):
+        offset = addr & PAGE_MASK
+        if offset > PAGE_SIZE - 8:
+            return int.from_bytes(self.read_bytes(addr, 8), 'little')
+        try:
+            return UINT64.unpack_from(self.pages[addr >> PAGE_SHIFT], offset)[0]
+        except KeyError:
+            return UINT64.unpack_from(self.touch(addr), offset)[0]
 
     def write_uint8(self, addr, value):
-        x = value.to_bytes(byteorder='little')
-        for i in range(1):
-            self.data[addr + i] = x[i]
+        try:
+            self.write_pages[addr >> PAGE_SHIFT][addr & PAGE_MASK] = value & 0xff
+        except KeyError:
+            self.touch(addr, True)[addr & PAGE_MASK] = value & 0xff
 
     def write_uint16(self, addr, value):
-        x = value.to_bytes(byteorder='little')
-        for i in range(2):
-            self.data[addr + i] = x[i]
+        offset = addr & PAGE_MASK
+        if offset > PAGE_SIZE - 2:
+            self.write_bytes(addr, (value & 0xffff).to_bytes(2, 'little'))
+            return
+        try:
+            UINT16.pack_into(self.write_pages[addr >> PAGE_SHIFT], offset, value & 0xffff)
+        except KeyError:
+            UINT16.pack_into(self.touch(addr, True), offset, value & 0xffff)
 
     def write_uint32(self, addr, value):
-        x = value.to_bytes(byteorder='little')
-        for i in range(4):
-            self.data[addr + i] = x[i]
+        if addr & 3 == 0 and HAS_WORD_VIEW:
+            try:
+                self.write_word_pages[addr >> PAGE_SHIFT][(addr & PAGE_MASK) >> 2] = value & 0xffff_ffff
+            except KeyError:
+                self.touch(addr, True)
+                self.write_word_pages[addr >> PAGE_SHIFT][(addr & PAGE_MASK) >> 2] = value & 0xffff_ffff
+            return
+        offset = addr & PAGE_MASK
+        if offset > PAGE_SIZE - 4:
+            self.write_bytes(addr, (value & 0xffff_ffff).to_bytes(4, 'little'))
+            return
+        UINT32.pack_into(self.touch(addr, True), offset, value & 0xffff_ffff)
+
+    def write_uint64(self, addr, value):
+        offset = addr & PAGE_MASK
+        if offset > PAGE_SIZE - 8:
+            self.write_bytes(addr, (value & 0xffff_ffff_ffff_ffff).to_bytes(8, 'little'))
+            return
+        try:
+            UINT64.pack_into(self.write_pages[addr >> PAGE_SHIFT], offset, value & 0xffff_ffff_ffff_ffff)
+        except KeyError:
+            UINT64.pack_into(self.touch(addr, True), offset, value & 0xffff_ffff_ffff_ffff)
+
+class MappedMemory(Memory):
+    """Memory backed by mmap.
+
+    Pages are slices of an anonymous mapping of the whole range, or of read-only mappings of loaded images,
+    so they only become resident when the guest touches them. Image pages are copied on the first write,
+    so guest writes never reach the image files."""
+
+    def __init__(self, size=Memory.DEFAULT_SIZE, base=Memory.DEFAULT_BASE):
+        super().__init__(size, base)
+        self.anonymous = mmap.mmap(-1, size)
+        # (first page, end page, mapping, file position of the first page)
+        self.images = []
+        # Dropped pages. Their anonymous slices may still be held by a snapshot, so they are never handed out again.
+        self.released = set()
+
+    def clear(self):
+        super().clear()
+        # Pages hold views of the old mappings, so they are replaced rather than closed.
+        self.anonymous = mmap.mmap(-1, self.size)
+        self.images = []
+        self.released = set()
+
+    def allocate_page(self, number):
+        for first, end, mapping, position in self.images:
+            if first <= number < end:
+                position += (number - first) << PAGE_SHIFT
+                return memoryview(mapping)[position:position + PAGE_SIZE]
+        if number in self.released:
+            return bytearray(PAGE_SIZE)
+        offset = (number << PAGE_SHIFT) - self.base
+        return memoryview(self.anonymous)[offset:offset + PAGE_SIZE]
+
+    def release_page(self, number, page):
+        self.released.add(number)
+
+    def zero(self, addr, size):
+        # Untouched pages of an image are not zero, so they are touched first.
+        for first, end, _, _ in self.images:
+            for number in range(max(first, addr >> PAGE_SHIFT), min(end, (addr + size + PAGE_MASK) >> PAGE_SHIFT)):
+                self.touch(number << PAGE_SHIFT, True)
+        super().zero(addr, size)
+
+    def load_image(self, addr, f, offset, size):
+        """Map the whole pages of the image and copy the partial pages at both ends"""
+        self.check_image(addr, size)
+        first = (addr + PAGE_MASK) >> PAGE_SHIFT
+        end = (addr + size) >> PAGE_SHIFT
+        position = offset + (first << PAGE_SHIFT) - addr
+        if first >= end or position & PAGE_MASK:
+            # Nothing to map, or the file is not page-aligned with the addresses.
+            super().load_image(addr, f, offset, size)
+            return
+
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Pages already touched in the mapped range are dropped, so they are taken from the image on next touch.
+        for number in [number for number in self.pages if first <= number < end]:
+            self.drop_page(number)
+        self.images.insert(0, (first, end, mapping, position))
+
+        self.write_bytes(addr, mapping[offset:position])
+        self.write_bytes(end << PAGE_SHIFT, mapping[position + ((end - first) << PAGE_SHIFT):offset + size])
+
+class SharedMemory(Memory):
+    """Memory backed by a multiprocessing.shared_memory block, so emulators in several processes share guest RAM.
+
+    Pages are slices of the block and are never copied, so snapshots and clear() are not supported.
+    The process which created the block (name=None) must unlink() it when every process has closed it."""
+
+    def __init__(self, size=Memory.DEFAULT_SIZE, base=Memory.DEFAULT_BASE, name=None):
+        super().__init__(size, base)
+        self.shared = shared_memory.SharedMemory(name, name is None, size)
+        self.name = self.shared.name
+
+    def allocate_page(self, number):
+        offset = (number << PAGE_SHIFT) - self.base
+        return self.shared.buf[offset:offset + PAGE_SIZE]
+
+    def clear(self):
+        raise Exception("Shared memory can not be cleared.")
+
+    def snapshot(self):
+        raise Exception("Shared memory can not be snapshotted.")
+
+    def close(self):
+        """Detach from the block. The pages are views of it, so they are dropped first."""
+        Memory.clear(self)
+        self.shared.close()
+
+    def unlink(self):
+        self.shared.unlink()
@@ -0,0 +1,85 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+from . import rv32i
+
+PAGE_SHIFT = 12
+PAGE_MASK = (1 << PAGE_SHIFT) - 1
+# One counter per halfword, so compressed instructions get their own counters too.
+PAGE_COUNTERS = 1 << (PAGE_SHIFT - 1)
+
+def get_op_classes(base=rv32i.Op):
+    classes = []
+    for cls in base.__subclasses__():
+        classes.append(cls)
+        classes.extend(get_op_classes(cls))
+    return classes
+
+# =============================================================================
+# Profiler
+#
+class Profiler:
+    """Counts executed instructions per op class and per PC.
+
+    Emulator only calls record() while profiling is enabled, so the normal run loop pays nothing for it.
+    Counters live in arrays: one per op class, and one per halfword of each executed code page.
+    Code pages are kept in a dict by page number, so PCs may take all 64 bits."""
+
+    def __init__(self):
+        self.op_classes = get_op_classes()
+        self.op_indexes = {cls: index for index, cls in enumerate(self.op_classes)}
+        self.op_counts = array('Q', bytes(8 * len(self.op_classes)))
+        self.pc_pages = {}
+        self.count = 0
+        self.taken = 0
+
+    def record(self, pc, op, state, bus):
+        self.op_counts[self.op_indexes[type(op)]] += 1
+        page = self.pc_pages.get(pc >> PAGE_SHIFT)
+        if page is None:
+            page = array('Q', bytes(8 * PAGE_COUNTERS))
+            self.pc_pages[pc >> PAGE_SHIFT] = page
+        page[(pc & PAGE_MASK) >> 1] += 1
+
+    def get_op_counts(self):
+        """Executed count of each op class name, most frequent first"""
+        counts = [(cls.__name__, count) for cls, count in zip(self.op_classes, self.op_counts) if count > 0]
+        return dict(sorted(counts, key=lambda item: -item[1]))
+
+    def get_hot_pcs(self, top=20):
+        """The top most executed PCs as (pc, count)"""
+        counts = []
+        for number, page in self.pc_pages.items():
+            for index, count in enumerate(page):
+                if count > 0:
+                    counts.append(((number << PAGE_SHIFT) | (index << 1), count))
+        counts.sort(key=lambda item: -item[1])
+        return counts[:top]
+
+    def report(self, bus, decode, top=20):
+        """Return the op and hot PC tables as text. Hot PCs are disassembled with decode() from the current memory."""
+        total = sum(self.op_counts)
+        lines = [f"Profile: {total} insns", "  op:"]
+        for name, count in self.get_op_counts().items():
+            lines.append(f"    {name:<12} {count:>12} {count * 100 / total:6.2f}%")
+
+        lines.append(f"  hot pc (top {top}):")
+        for pc, count in self.get_hot_pcs(top):
+            try:
+                disassembly = str(decode(bus.read_uint32(pc)))
+            except Exception:
+                disassembly = "?"
+            lines.append(f"    {pc:08x} {count:>12} {count * 100 / total:6.2f}%  {disassembly}")
+        return "\n".join(lines)
@@ -0,0 +1,132 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from fixedint import *
+from . import rv32i
+
+# =============================================================================
+# Reference RV32I ops
+#
+# The rv32i ops work on plain ints with explicit masking. These are the earlier implementations, which
+# let fixedint.UInt32 and Int32 do the wrapping instead. Processor runs them in place of op.execute() when
+# the emulator is created with fixedint=True, so that mode checks the plain-int ops against independent code.
+#
+def reg(cpuState, index):
+    return UInt32(cpuState.int_reg[index])
+
+def lui(op, cpuState, bus):
+    cpuState.int_reg[op.rd] = UInt32(op.imm)
+
+def auipc(op, cpuState, bus):
+    cpuState.int_reg[op.rd] = UInt32(cpuState.pc) + UInt32(op.imm)
+
+def jal(op, cpuState, bus):
+    next_pc = cpuState.next_pc
+    cpuState.next_pc = int(UInt32(cpuState.pc) + UInt32(op.imm))
+    cpuState.int_reg[op.rd] = UInt32(next_pc)
+
+def jalr(op, cpuState, bus):
+    next_pc = cpuState.next_pc
+    cpuState.next_pc = int((reg(cpuState, op.rs1) + UInt32(op.imm)) & UInt32(0xffff_fffe))
+    cpuState.int_reg[op.rd] = UInt32(next_pc)
+
+def branch(condition):
+    def execute(op, cpuState, bus):
+        if condition(reg(cpuState, op.rs1), reg(cpuState, op.rs2)):
+            cpuState.next_pc = int(UInt32(cpuState.pc) + UInt32(op.imm))
+    return execute
+
+def load(read, bits, signed):
+    def execute(op, cpuState, bus):
+        addr = reg(cpuState, op.rs1) + UInt32(op.imm)
+        value = UInt32(getattr(bus, read)(int(addr)))
+        if signed:
+            sign = UInt32(1) << (bits - 1)
+            value = (value ^ sign) - sign
+        cpuState.int_reg[op.rd] = value
+    return execute
+
+def store(write, bits):
+    def execute(op, cpuState, bus):
+        addr = reg(cpuState, op.rs1) + UInt32(op.imm)
+        value = reg(cpuState, op.rs2) & UInt32((1 << bits) - 1)
+        getattr(bus, write)(int(addr), int(value))
+    return execute
+
+def alu_imm(func):
+    def execute(op, cpuState, bus):
+        cpuState.int_reg[op.rd] = func(reg(cpuState, op.rs1), UInt32(op.imm))
+    return execute
+
+def shift_imm(func):
+    def execute(op, cpuState, bus):
+        cpuState.int_reg[op.rd] = func(reg(cpuState, op.rs1), op.shamt)
+    return execute
+
+def alu(func):
+    def execute(op, cpuState, bus):
+        cpuState.int_reg[op.rd] = func(reg(cpuState, op.rs1), reg(cpuState, op.rs2))
+    return execute
+
+def flag(value):
+    return UInt32(1) if value else UInt32(0)
+
+EXECUTE = {
+    rv32i.LUI:      lui,
+    rv32i.AUIPC:    auipc,
+    rv32i.JAL:      jal,
+    rv32i.JALR:     jalr,
+    rv32i.BEQ:      branch(lambda a, b: a == b),
+    rv32i.BNE:      branch(lambda a, b: a != b),
+    rv32i.BLT:      branch(lambda a, b: Int32(a) < Int32(b)),
+    rv32i.BGE:      branch(lambda a, b: Int32(a) >= Int32(b)),
+    rv32i.BLTU:     branch(lambda a, b: a < b),
+    rv32i.BGEU:     branch(lambda a, b: a >= b),
+    rv32i.LB:       load('read_uint8', 8, True),
+    rv32i.LH:       load('read_uint16', 16, True),
+    rv32i.LW:       load('read_uint32', 32, False),
+    rv32i.LBU:      load('read_uint8', 8, False),
+    rv32i.LHU:      load('read_uint16', 16, False),
+    rv32i.SB:       store('write_uint8', 8),
+    rv32i.SH:       store('write_uint16', 16),
+    rv32i.SW:       store('write_uint32', 32),
+    rv32i.ADDI:     alu_imm(lambda a, imm: a + imm),
+    rv32i.SLTI:     alu_imm(lambda a, imm: flag(Int32(a) < Int32(imm))),
+    rv32i.SLTIU:    alu_imm(lambda a, imm: flag(a < imm)),
+    rv32i.XORI:     alu_imm(lambda a, imm: a ^ imm),
+    rv32i.ORI:      alu_imm(lambda a, imm: a | imm),
+    rv32i.ANDI:     alu_imm(lambda a, imm: a & imm),
+    rv32i.SLLI:     shift_imm(lambda a, shamt: a << shamt),
+    rv32i.SRLI:     shift_imm(lambda a, shamt: a >> shamt),
+    rv32i.SRAI:     shift_imm(lambda a, shamt: UInt32(Int32(a) >> shamt)),
+    rv32i.ADD:      alu(lambda a, b: a + b),
+    rv32i.SUB:      alu(lambda a, b: a - b),
+    rv32i.SLL:      alu(lambda a, b: a << (b & 0x1f)),
+    rv32i.SLT:      alu(lambda a, b: flag(Int32(a) < Int32(b))),
+    rv32i.SLTU:     alu(lambda a, b: flag(a < b)),
+    rv32i.XOR:      alu(lambda a, b: a ^ b),
+    rv32i.SRL:      alu(lambda a, b: a >> (b & 0x1f)),
+    rv32i.SRA:      alu(lambda a, b: UInt32(Int32(a) >> (b & 0x1f))),
+    rv32i.OR:       alu(lambda a, b: a | b),
+    rv32i.AND:      alu(lambda a, b: a & b),
+}
+
+def execute(op, cpuState, bus):
+    """Execute op with its reference implementation, or with op.execute() for ops which have none"""
+    func = EXECUTE.get(type(op))
+    if func is None:
+        op.execute(cpuState, bus)
+    else:
+        func(op, cpuState, bus)
@@ -0,0 +1,148 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import time
+import xml.etree.ElementTree as ET
+from . import emu
+
+# =============================================================================
+# Test result
+#
+class TestResult:
+    def __init__(self, name, passed, wall_time, instret, test_id=None, message=None):
+        self.name = name
+        self.passed = passed
+        self.wall_time = wall_time
+        self.instret = instret
+        self.test_id = test_id
+        self.message = message
+
+# =============================================================================
+# Worker
+#
+# Each worker process keeps one emulator per XLEN and resets it between tests.
+worker_emulators = {}
+worker_config = None
+worker_max_cycle = None
+
+def init_worker(engine, fixedint, max_cycle):
+    global worker_config, worker_max_cycle
+    worker_emulators.clear()
+    worker_config = (engine, fixedint)
+    worker_max_cycle = max_cycle
+
+def get_xlen(name):
+    """XLEN of a riscv-tests binary, from the prefix of its name such as rv64ui-p-add"""
+    return 64 if name.startswith("rv64") else 32
+
+# riscv-tests listed in CONFIG_PATH, relative to the repository root.
+CONFIG_PATH = "./riscv_tests.json"
+BINARY_DIR_PATH = "./rafi-prebuilt-binary/riscv-tests/isa"
+
+def find_binary(config):
+    """Prefer the riscv-tests ELF, which carries its entry point and tohost symbol, over the flat image"""
+    path = os.path.join(BINARY_DIR_PATH, config)
+    return path if os.path.isfile(path) else f"{path}.bin"
+
+def get_worker_emulator(xlen):
+    emulator = worker_emulators.get(xlen)
+    if emulator is None:
+        engine, fixedint = worker_config
+        emulator = emu.Emulator(engine, fixedint, xlen=xlen)
+        worker_emulators[xlen] = emulator
+    return emulator
+
+def run_test(name, path):
+    emulator = get_worker_emulator(get_xlen(name))
+    emulator.reset()
+
+    start = time.perf_counter()
+    message = None
+    try:
+        emulator.load(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            emulator.run(worker_max_cycle)
+    except Exception as e:
+        message = str(e)
+    wall_time = time.perf_counter() - start
+
+    host_io_value = emulator.host_io_value
+    test_id = host_io_value // 2 if host_io_value not in (0, 1) else None
+    return TestResult(name, message is None, wall_time, emulator.cycle, test_id, message)
+
+def run_tests(tests, engine="interpreter", fixedint=False, max_cycle=10000, jobs=None):
+    """Run (name, path) pairs on a process pool, yielding TestResult in the given order"""
+    yield from map_jobs(run_test, tests, init_worker, (engine, fixedint, max_cycle), jobs)
+
+# =============================================================================
+# Process pool
+#
+def call_star(call):
+    func, args = call
+    return func(*args)
+
+def map_jobs(func, args_list, initializer, initargs, jobs=None):
+    """Call func(*args) for each of args_list on a pool of jobs processes, each set up with initializer(*initargs),
+    yielding the results in the given order. With one job everything runs in this process.
+
+    func and initializer must be module-level functions, so the pool can pickle them."""
+    jobs = jobs or os.cpu_count() or 1
+
+    if jobs == 1:
+        initializer(*initargs)
+        for args in args_list:
+            yield func(*args)
+        return
+
+    with multiprocessing.Pool(jobs, initializer=initializer, initargs=initargs) as pool:
+        yield from pool.imap(call_star, ((func, args) for args in args_list))
+
+# =============================================================================
+# Report
+#
+def write_json(results, path):
+    report = {
+        'tests': len(results),
+        'failures': sum(1 for result in results if not result.passed),
+        'wall_time': sum(result.wall_time for result in results),
+        'results': [vars(result) for result in results],
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
+
+def write_junit(results, path, suite_name="riscv-tests"):
+    suite = ET.Element("testsuite", {
+        'name': suite_name,
+        'tests': str(len(results)),
+        'failures': str(sum(1 for result in results if not result.passed)),
+        'time': f"{sum(result.wall_time for result in results):.6f}",
+    })
+    for result in results:
+        case = ET.SubElement(suite, "testcase", {
+            'classname': suite_name,
+            'name': result.name,
+            'time': f"{result.wall_time:.6f}",
+        })
+        properties = ET.SubElement(case, "properties")
+        ET.SubElement(properties, "property", {'name': 'instret', 'value': str(result.instret)})
+        if not result.passed:
+            message = result.message if result.test_id is None else f"{result.message} (testId={result.test_id})"
+            ET.SubElement(case, "failure", {'message': message})
+
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
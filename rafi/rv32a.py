@@ -0,0 +1,286 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from . import mem
+from . import rv
+from . import rv32i
+
+def ordering(aq, rl):
+    """Mnemonic suffix of the aq and rl bits"""
+    suffix = ("aq" if aq else "") + ("rl" if rl else "")
+    return "." + suffix if suffix else ""
+
+def check_aligned(addr, write):
+    """LR, SC and AMOs trap on a word address which is not 4-byte aligned"""
+    if addr & 0x3:
+        raise mem.MisalignedAccessError(addr, write)
+
+def signed(value):
+    return (value ^ 0x8000_0000) - 0x8000_0000
+
+class LR_W(rv32i.Op):
+    def __init__(self, rd, rs1, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        return f"lr.w{ordering(self.aq, self.rl)} {rd},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, False)
+        value = bus.read_uint32(addr)
+        bus.reservations.reserve(cpuState, addr)
+
+        x[self.rd] = value
+
+class SC_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"sc.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        reservations = bus.reservations
+        if reservations.is_reserved(cpuState, addr):
+            # The store drops the reservations of every hart on the line.
+            bus.write_uint32(addr, x[self.rs2])
+            x[self.rd] = 0
+        else:
+            reservations.release(cpuState)
+            x[self.rd] = 1
+
+class AMOSWAP_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amoswap.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, x[self.rs2])
+
+        x[self.rd] = value
+
+class AMOADD_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amoadd.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, (value + x[self.rs2]) & 0xffff_ffff)
+
+        x[self.rd] = value
+
+class AMOXOR_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amoxor.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, value ^ x[self.rs2])
+
+        x[self.rd] = value
+
+class AMOAND_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amoand.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, value & x[self.rs2])
+
+        x[self.rd] = value
+
+class AMOOR_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amoor.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, value | x[self.rs2])
+
+        x[self.rd] = value
+
+class AMOMIN_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amomin.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, min(value, x[self.rs2], key=signed))
+
+        x[self.rd] = value
+
+class AMOMAX_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amomax.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, max(value, x[self.rs2], key=signed))
+
+        x[self.rd] = value
+
+class AMOMINU_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amominu.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, min(value, x[self.rs2]))
+
+        x[self.rd] = value
+
+class AMOMAXU_W(rv32i.Op):
+    def __init__(self, rd, rs1, rs2, aq, rl):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.aq = aq
+        self.rl = rl
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"amomaxu.w{ordering(self.aq, self.rl)} {rd},{rs2},({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = x[self.rs1]
+        check_aligned(addr, True)
+        value = bus.read_uint32(addr)
+        bus.write_uint32(addr, max(value, x[self.rs2]))
+
+        x[self.rd] = value
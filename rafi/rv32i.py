@@ -12,12 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from fixedint import *
 from . import rv
-from . import util
 from . import cpu
 
 class Op:
+    # Instruction length in bytes. Ops expanded from compressed encodings set it to 2.
+    size = 4
+
     def execute(self, cpuState, bus):
         pass
 
@@ -50,7 +51,7 @@ class AUIPC(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = cpuState.pc + self.imm
+        x[self.rd] = (cpuState.pc + self.imm) & 0xffff_ffff
 
 class JAL(Op):
     def __init__(self, rd, imm):
@@ -66,7 +67,7 @@ class JAL(Op):
         x = cpuState.int_reg
         next_pc = cpuState.next_pc
 
-        cpuState.next_pc = cpuState.pc + self.imm
+        cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff
         x[self.rd] = next_pc
 
 class JALR(Op):
@@ -84,7 +85,8 @@ class JALR(Op):
         x = cpuState.int_reg
         next_pc = cpuState.next_pc
 
-        cpuState.next_pc = x[self.rs1] + self.imm
+        # The lowest bit of the target is cleared.
+        cpuState.next_pc = (x[self.rs1] + self.imm) & 0xffff_fffe
         x[self.rd] = next_pc
 
 class BEQ(Op):
@@ -108,7 +110,7 @@ class BEQ(Op):
         x = cpuState.int_reg
 
         if x[self.rs1] == x[self.rs2]:
-            cpuState.next_pc = cpuState.pc + self.imm
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff
 
 class BNE(Op):
     def __init__(self, rs1, rs2, imm):
@@ -131,7 +133,7 @@ class BNE(Op):
         x = cpuState.int_reg
 
         if x[self.rs1] != x[self.rs2]:
-            cpuState.next_pc = cpuState.pc + self.imm
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff
 
 class BLT(Op):
     def __init__(self, rs1, rs2, imm):
@@ -153,8 +155,8 @@ class BLT(Op):
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
 
-        if Int32(x[self.rs1]) < Int32(x[self.rs2]):
-            cpuState.next_pc = cpuState.pc + self.imm
+        if x[self.rs1] ^ 0x8000_0000 < x[self.rs2] ^ 0x8000_0000:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff
 
 class BGE(Op):
     def __init__(self, rs1, rs2, imm):
@@ -176,8 +178,8 @@ class BGE(Op):
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
 
-        if Int32(x[self.rs1]) >= Int32(x[self.rs2]):
-            cpuState.next_pc = cpuState.pc + self.imm
+        if x[self.rs1] ^ 0x8000_0000 >= x[self.rs2] ^ 0x8000_0000:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff
 
 class BLTU(Op):
     def __init__(self, rs1, rs2, imm):
@@ -195,7 +197,7 @@ class BLTU(Op):
         x = cpuState.int_reg
 
         if x[self.rs1] < x[self.rs2]:
-            cpuState.next_pc = cpuState.pc + self.imm
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff
 
 class BGEU(Op):
     def __init__(self, rs1, rs2, imm):
@@ -213,7 +215,7 @@ class BGEU(Op):
         x = cpuState.int_reg
 
         if x[self.rs1] >= x[self.rs2]:
-            cpuState.next_pc = cpuState.pc + self.imm
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff
 
 class LB(Op):
     def __init__(self, rd, rs1, imm):
@@ -229,10 +231,10 @@ class LB(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
         value = bus.read_uint8(addr)
 
-        x[self.rd] = util.sign_extend32(8, value)
+        x[self.rd] = ((value ^ 0x80) - 0x80) & 0xffff_ffff
 
 class LH(Op):
     def __init__(self, rd, rs1, imm):
@@ -248,10 +250,10 @@ class LH(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
         value = bus.read_uint16(addr)
 
-        x[self.rd] = util.sign_extend32(16, value)
+        x[self.rd] = ((value ^ 0x8000) - 0x8000) & 0xffff_ffff
 
 class LW(Op):
     def __init__(self, rd, rs1, imm):
@@ -267,7 +269,7 @@ class LW(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
         value = bus.read_uint32(addr)
 
         x[self.rd] = value
@@ -286,10 +288,10 @@ class LBU(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
         value = bus.read_uint8(addr)
 
-        x[self.rd] = util.zero_extend32(8, value)
+        x[self.rd] = value
 
 class LHU(Op):
     def __init__(self, rd, rs1, imm):
@@ -305,10 +307,10 @@ class LHU(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
         value = bus.read_uint16(addr)
 
-        x[self.rd] = util.zero_extend32(16, value)
+        x[self.rd] = value
 
 class SB(Op):
     def __init__(self, rs1, rs2, imm):
@@ -324,9 +326,9 @@ class SB(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
-        value = x[self.rs2]
-        
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
+        value = x[self.rs2] & 0xff
+
         bus.write_uint8(addr, value)
 
 class SH(Op):
@@ -343,9 +345,9 @@ class SH(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
-        value = x[self.rs2]
-        
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
+        value = x[self.rs2] & 0xffff
+
         bus.write_uint16(addr, value)
 
 class SW(Op):
@@ -362,9 +364,9 @@ class SW(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        addr = x[self.rs1] + self.imm
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff
         value = x[self.rs2]
-        
+
         bus.write_uint32(addr, value)
 
 class ADDI(Op):
@@ -381,7 +383,7 @@ class ADDI(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = x[self.rs1] + self.imm
+        x[self.rd] = (x[self.rs1] + self.imm) & 0xffff_ffff
 
 class SLTI(Op):
     def __init__(self, rd, rs1, imm):
@@ -397,7 +399,7 @@ class SLTI(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = UInt32(1) if Int32(x[self.rs1]) < Int32(self.imm) else UInt32(0)
+        x[self.rd] = 1 if x[self.rs1] ^ 0x8000_0000 < self.imm ^ 0x8000_0000 else 0
 
 class SLTIU(Op):
     def __init__(self, rd, rs1, imm):
@@ -413,7 +415,7 @@ class SLTIU(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = UInt32(1) if x[self.rs1] < self.imm else UInt32(0)
+        x[self.rd] = 1 if x[self.rs1] < self.imm else 0
 
 class XORI(Op):
     def __init__(self, rd, rs1, imm):
@@ -477,7 +479,7 @@ class SLLI(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = x[self.rs1] << self.shamt
+        x[self.rd] = (x[self.rs1] << self.shamt) & 0xffff_ffff
 
 class SRLI(Op):
     def __init__(self, rd, rs1, shamt):
@@ -509,7 +511,7 @@ class SRAI(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = UInt32(Int32(x[self.rs1]) >> self.shamt)
+        x[self.rd] = (((x[self.rs1] ^ 0x8000_0000) - 0x8000_0000) >> self.shamt) & 0xffff_ffff
 
 class ADD(Op):
     def __init__(self, rd, rs1, rs2):
@@ -525,7 +527,7 @@ class ADD(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = UInt32(x[self.rs1] + x[self.rs2])
+        x[self.rd] = (x[self.rs1] + x[self.rs2]) & 0xffff_ffff
 
 class SUB(Op):
     def __init__(self, rd, rs1, rs2):
@@ -541,7 +543,7 @@ class SUB(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = UInt32(x[self.rs1] - x[self.rs2])
+        x[self.rd] = (x[self.rs1] - x[self.rs2]) & 0xffff_ffff
 
 class SLL(Op):
     def __init__(self, rd, rs1, rs2):
@@ -557,7 +559,7 @@ class SLL(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = x[self.rs1] << (x[self.rs2] & 0x1f)
+        x[self.rd] = (x[self.rs1] << (x[self.rs2] & 0x1f)) & 0xffff_ffff
 
 class SLT(Op):
     def __init__(self, rd, rs1, rs2):
@@ -573,7 +575,7 @@ class SLT(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = UInt32(1) if Int32(x[self.rs1]) < Int32(x[self.rs2]) else UInt32(0)
+        x[self.rd] = 1 if x[self.rs1] ^ 0x8000_0000 < x[self.rs2] ^ 0x8000_0000 else 0
 
 class SLTU(Op):
     def __init__(self, rd, rs1, rs2):
@@ -589,7 +591,7 @@ class SLTU(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        x[self.rd] = UInt32(1) if x[self.rs1] < x[self.rs2] else UInt32(0)
+        x[self.rd] = 1 if x[self.rs1] < x[self.rs2] else 0
 
 class XOR(Op):
     def __init__(self, rd, rs1, rs2):
@@ -638,7 +640,7 @@ class SRA(Op):
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
 
-        x[self.rd] = UInt32(Int32(x[self.rs1]) >> (x[self.rs2] & 0x1f))
+        x[self.rd] = (((x[self.rs1] ^ 0x8000_0000) - 0x8000_0000) >> (x[self.rs2] & 0x1f)) & 0xffff_ffff
 
 class OR(Op):
     def __init__(self, rd, rs1, rs2):
@@ -684,6 +686,9 @@ class FENCE_I(Op):
     def __str__(self):
         return "fence.i"
 
+    def execute(self, cpuState, bus):
+        bus.invalidate_code_caches()
+
 class ECALL(Op):
     def __str__(self):
         return "ecall"
@@ -715,10 +720,9 @@ class CSRRW(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        csr = cpuState.csr
-        value = csr[self.csr]
+        value = cpuState.read_csr(self.csr)
 
-        csr[self.csr] = x[self.rs1]
+        cpuState.write_csr(self.csr, x[self.rs1])
         x[self.rd] = value
 
 class CSRRS(Op):
@@ -740,10 +744,9 @@ class CSRRS(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        csr = cpuState.csr
-        value = csr[self.csr]
+        value = cpuState.read_csr(self.csr)
 
-        csr[self.csr] = value | x[self.rs1]
+        cpuState.write_csr(self.csr, value | x[self.rs1])
         x[self.rd] = value
 
 class CSRRC(Op):
@@ -763,9 +766,9 @@ class CSRRC(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        value = cpuState.csr[self.csr]
+        value = cpuState.read_csr(self.csr)
 
-        cpuState.csr[self.csr] = ~value & x[self.rs1]
+        cpuState.write_csr(self.csr, value & ~x[self.rs1] & 0xffff_ffff)
         x[self.rd] = value
 
 class CSRRWI(Op):
@@ -785,14 +788,13 @@ class CSRRWI(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        csr = cpuState.csr
 
-        value = csr[self.csr]
-        csr[self.csr] = self.zimm
+        value = cpuState.read_csr(self.csr)
+        cpuState.write_csr(self.csr, self.zimm)
         x[self.rd] = value
 
 class CSRRSI(Op):
-    def __init__(self, csr, rd, rs1):
+    def __init__(self, csr, rd, zimm):
         self.csr = csr
         self.rd = rd
         self.zimm = zimm
@@ -808,14 +810,13 @@ class CSRRSI(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        csr = cpuState.csr
 
-        value = csr[self.csr]
-        csr[self.csr] = value | self.zimm
+        value = cpuState.read_csr(self.csr)
+        cpuState.write_csr(self.csr, value | self.zimm)
         x[self.rd] = value
 
 class CSRRCI(Op):
-    def __init__(self, csr, rd, rs1):
+    def __init__(self, csr, rd, zimm):
         self.csr = csr
         self.rd = rd
         self.zimm = zimm
@@ -831,10 +832,9 @@ class CSRRCI(Op):
 
     def execute(self, cpuState, bus):
         x = cpuState.int_reg
-        csr = cpuState.csr
 
-        value = csr[self.csr]
-        csr[self.csr] = ~value & self.zimm
+        value = cpuState.read_csr(self.csr)
+        cpuState.write_csr(self.csr, value & ~self.zimm & 0xffff_ffff)
         x[self.rd] = value
 
 class URET(Op):
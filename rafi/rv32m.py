@@ -0,0 +1,172 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import rv
+from . import rv32i
+
+def div(dividend, divisor):
+    """Signed division of two 32-bit register values, rounding towards zero.
+
+    Division by zero gives all ones and the overflowing -2^31 / -1 gives -2^31, as the spec defines."""
+    if divisor == 0:
+        return 0xffff_ffff
+    dividend = (dividend ^ 0x8000_0000) - 0x8000_0000
+    divisor = (divisor ^ 0x8000_0000) - 0x8000_0000
+    quotient = abs(dividend) // abs(divisor)
+    if (dividend < 0) != (divisor < 0):
+        quotient = -quotient
+    return quotient & 0xffff_ffff
+
+def rem(dividend, divisor):
+    """Signed remainder of two 32-bit register values, with the sign of the dividend.
+
+    Division by zero gives the dividend and the overflowing -2^31 % -1 gives 0, as the spec defines."""
+    if divisor == 0:
+        return dividend
+    dividend = (dividend ^ 0x8000_0000) - 0x8000_0000
+    divisor = (divisor ^ 0x8000_0000) - 0x8000_0000
+    remainder = abs(dividend) % abs(divisor)
+    if dividend < 0:
+        remainder = -remainder
+    return remainder & 0xffff_ffff
+
+class MUL(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"mul {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (x[self.rs1] * x[self.rs2]) & 0xffff_ffff
+
+class MULH(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"mulh {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] ^ 0x8000_0000) - 0x8000_0000) * ((x[self.rs2] ^ 0x8000_0000) - 0x8000_0000)) >> 32) & 0xffff_ffff
+
+class MULHSU(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"mulhsu {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] ^ 0x8000_0000) - 0x8000_0000) * x[self.rs2]) >> 32) & 0xffff_ffff
+
+class MULHU(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"mulhu {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (x[self.rs1] * x[self.rs2]) >> 32
+
+class DIV(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"div {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = div(x[self.rs1], x[self.rs2])
+
+class DIVU(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"divu {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        divisor = x[self.rs2]
+        x[self.rd] = x[self.rs1] // divisor if divisor != 0 else 0xffff_ffff
+
+class REM(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"rem {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = rem(x[self.rs1], x[self.rs2])
+
+class REMU(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"remu {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        divisor = x[self.rs2]
+        x[self.rd] = x[self.rs1] % divisor if divisor != 0 else x[self.rs1]
@@ -0,0 +1,410 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import rv
+from . import rv32i
+
+# RV64I ops. Registers hold 64-bit values and immediates are sign-extended to 64 bits by the decoder.
+#
+# Ops whose RV32I code is also right for 64-bit values (LUI, SLTIU, XORI, ORI, ANDI, SRLI, SLTU, XOR, OR, AND,
+# FENCE and the system ops except the clearing CSR ops) are not redefined here; the RV64 decoder uses
+# the rv32i classes for them.
+
+class AUIPC(rv32i.AUIPC):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+
+class JAL(rv32i.JAL):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        next_pc = cpuState.next_pc
+
+        cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+        x[self.rd] = next_pc
+
+class JALR(rv32i.JALR):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        next_pc = cpuState.next_pc
+
+        cpuState.next_pc = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_fffe
+        x[self.rd] = next_pc
+
+class BEQ(rv32i.BEQ):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+
+        if x[self.rs1] == x[self.rs2]:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+
+class BNE(rv32i.BNE):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+
+        if x[self.rs1] != x[self.rs2]:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+
+class BLT(rv32i.BLT):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+
+        if x[self.rs1] ^ 0x8000_0000_0000_0000 < x[self.rs2] ^ 0x8000_0000_0000_0000:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+
+class BGE(rv32i.BGE):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+
+        if x[self.rs1] ^ 0x8000_0000_0000_0000 >= x[self.rs2] ^ 0x8000_0000_0000_0000:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+
+class BLTU(rv32i.BLTU):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+
+        if x[self.rs1] < x[self.rs2]:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+
+class BGEU(rv32i.BGEU):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+
+        if x[self.rs1] >= x[self.rs2]:
+            cpuState.next_pc = (cpuState.pc + self.imm) & 0xffff_ffff_ffff_ffff
+
+class LB(rv32i.LB):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+        value = bus.read_uint8(addr)
+
+        x[self.rd] = ((value ^ 0x80) - 0x80) & 0xffff_ffff_ffff_ffff
+
+class LH(rv32i.LH):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+        value = bus.read_uint16(addr)
+
+        x[self.rd] = ((value ^ 0x8000) - 0x8000) & 0xffff_ffff_ffff_ffff
+
+class LW(rv32i.LW):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+        value = bus.read_uint32(addr)
+
+        x[self.rd] = ((value ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class LD(rv32i.Op):
+    def __init__(self, rd, rs1, imm):
+        self.rd = rd
+        self.rs1 = rs1
+        self.imm = imm
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        imm = self.imm
+        return f"ld {rd},{imm}({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        x[self.rd] = bus.read_uint64(addr)
+
+class LBU(rv32i.LBU):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        x[self.rd] = bus.read_uint8(addr)
+
+class LHU(rv32i.LHU):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        x[self.rd] = bus.read_uint16(addr)
+
+class LWU(rv32i.Op):
+    def __init__(self, rd, rs1, imm):
+        self.rd = rd
+        self.rs1 = rs1
+        self.imm = imm
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        imm = self.imm
+        return f"lwu {rd},{imm}({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        x[self.rd] = bus.read_uint32(addr)
+
+class SB(rv32i.SB):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        bus.write_uint8(addr, x[self.rs2] & 0xff)
+
+class SH(rv32i.SH):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        bus.write_uint16(addr, x[self.rs2] & 0xffff)
+
+class SW(rv32i.SW):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        bus.write_uint32(addr, x[self.rs2] & 0xffff_ffff)
+
+class SD(rv32i.Op):
+    def __init__(self, rs1, rs2, imm):
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.imm = imm
+
+    def __str__(self):
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        imm = self.imm
+        return f"sd {rs2},{imm}({rs1})"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        addr = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+        bus.write_uint64(addr, x[self.rs2])
+
+class ADDI(rv32i.ADDI):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (x[self.rs1] + self.imm) & 0xffff_ffff_ffff_ffff
+
+class SLTI(rv32i.SLTI):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = 1 if x[self.rs1] ^ 0x8000_0000_0000_0000 < self.imm ^ 0x8000_0000_0000_0000 else 0
+
+class SLLI(rv32i.SLLI):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (x[self.rs1] << self.shamt) & 0xffff_ffff_ffff_ffff
+
+class SRAI(rv32i.SRAI):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (((x[self.rs1] ^ 0x8000_0000_0000_0000) - 0x8000_0000_0000_0000) >> self.shamt) & 0xffff_ffff_ffff_ffff
+
+class ADD(rv32i.ADD):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (x[self.rs1] + x[self.rs2]) & 0xffff_ffff_ffff_ffff
+
+class SUB(rv32i.SUB):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (x[self.rs1] - x[self.rs2]) & 0xffff_ffff_ffff_ffff
+
+class SLL(rv32i.SLL):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (x[self.rs1] << (x[self.rs2] & 0x3f)) & 0xffff_ffff_ffff_ffff
+
+class SLT(rv32i.SLT):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = 1 if x[self.rs1] ^ 0x8000_0000_0000_0000 < x[self.rs2] ^ 0x8000_0000_0000_0000 else 0
+
+class SRL(rv32i.SRL):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = x[self.rs1] >> (x[self.rs2] & 0x3f)
+
+class SRA(rv32i.SRA):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = (((x[self.rs1] ^ 0x8000_0000_0000_0000) - 0x8000_0000_0000_0000) >> (x[self.rs2] & 0x3f)) & 0xffff_ffff_ffff_ffff
+
+class CSRRC(rv32i.CSRRC):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        value = cpuState.read_csr(self.csr)
+
+        cpuState.write_csr(self.csr, value & ~x[self.rs1] & 0xffff_ffff_ffff_ffff)
+        x[self.rd] = value
+
+class CSRRCI(rv32i.CSRRCI):
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+
+        value = cpuState.read_csr(self.csr)
+        cpuState.write_csr(self.csr, value & ~self.zimm & 0xffff_ffff_ffff_ffff)
+        x[self.rd] = value
+
+# *W ops compute on the lower 32 bits and sign-extend the 32-bit result.
+
+class ADDIW(rv32i.Op):
+    def __init__(self, rd, rs1, imm):
+        self.rd = rd
+        self.rs1 = rs1
+        self.imm = imm
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        imm = self.imm
+        return f"addiw {rd},{rs1},{imm}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] + self.imm) & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class SLLIW(rv32i.Op):
+    def __init__(self, rd, rs1, shamt):
+        self.rd = rd
+        self.rs1 = rs1
+        self.shamt = shamt
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        shamt = self.shamt
+        return f"slliw {rd},{rs1},0x{shamt:x}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] << self.shamt) & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class SRLIW(rv32i.Op):
+    def __init__(self, rd, rs1, shamt):
+        self.rd = rd
+        self.rs1 = rs1
+        self.shamt = shamt
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        shamt = self.shamt
+        return f"srliw {rd},{rs1},0x{shamt:x}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] & 0xffff_ffff) >> self.shamt) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class SRAIW(rv32i.Op):
+    def __init__(self, rd, rs1, shamt):
+        self.rd = rd
+        self.rs1 = rs1
+        self.shamt = shamt
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        shamt = self.shamt
+        return f"sraiw {rd},{rs1},0x{shamt:x}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) >> self.shamt) & 0xffff_ffff_ffff_ffff
+
+class ADDW(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"addw {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] + x[self.rs2]) & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class SUBW(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"subw {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] - x[self.rs2]) & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class SLLW(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"sllw {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] << (x[self.rs2] & 0x1f)) & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class SRLW(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"srlw {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] & 0xffff_ffff) >> (x[self.rs2] & 0x1f)) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff
+
+class SRAW(rv32i.Op):
+    def __init__(self, rd, rs1, rs2):
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+
+    def __str__(self):
+        rd = rv.INT_REG_NAMES[self.rd]
+        rs1 = rv.INT_REG_NAMES[self.rs1]
+        rs2 = rv.INT_REG_NAMES[self.rs2]
+        return f"sraw {rd},{rs1},{rs2}"
+
+    def execute(self, cpuState, bus):
+        x = cpuState.int_reg
+        x[self.rd] = ((((x[self.rs1] & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) >> (x[self.rs2] & 0x1f)) & 0xffff_ffff_ffff_ffff
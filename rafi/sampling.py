@@ -0,0 +1,134 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from . import rv32a
+from . import rv32i
+from . import rv64i
+
+AMO_OPS = [
+    rv32a.AMOSWAP_W, rv32a.AMOADD_W, rv32a.AMOXOR_W, rv32a.AMOAND_W, rv32a.AMOOR_W,
+    rv32a.AMOMIN_W, rv32a.AMOMAX_W, rv32a.AMOMINU_W, rv32a.AMOMAXU_W,
+]
+
+# Access size in bytes of load and store ops. AMOs both load and store.
+LOAD_SIZES = {
+    rv32i.LB: 1, rv32i.LH: 2, rv32i.LW: 4, rv32i.LBU: 1, rv32i.LHU: 2,
+    rv64i.LB: 1, rv64i.LH: 2, rv64i.LW: 4, rv64i.LD: 8, rv64i.LBU: 1, rv64i.LHU: 2, rv64i.LWU: 4,
+    rv32a.LR_W: 4, **dict.fromkeys(AMO_OPS, 4),
+}
+STORE_SIZES = {
+    rv32i.SB: 1, rv32i.SH: 2, rv32i.SW: 4, rv64i.SB: 1, rv64i.SH: 2, rv64i.SW: 4, rv64i.SD: 8,
+    rv32a.SC_W: 4, **dict.fromkeys(AMO_OPS, 4),
+}
+
+def get_access(op, state, bus):
+    """Return (load size, store size, address) of the memory access op is about to do, or None.
+
+    A size is 0 when op does not load or store. An SC only stores when it holds a reservation."""
+    load = LOAD_SIZES.get(type(op), 0)
+    store = STORE_SIZES.get(type(op), 0)
+    if load == 0 and store == 0:
+        return None
+    # The atomics have no offset.
+    addr = (state.int_reg[op.rs1] + getattr(op, 'imm', 0)) & state.xlen_mask
+    if type(op) is rv32a.SC_W and not bus.reservations.is_reserved(state, addr):
+        return None
+    return load, store, addr
+
+PAGE_SHIFT = 12
+LINE_SHIFT = 6
+
+# =============================================================================
+# Interval statistics
+#
+class IntervalStats:
+    "Statistics of one interval run in detailed mode"
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.op_counts = {}
+        self.taken = 0
+        self.loads = 0
+        self.stores = 0
+        self.load_bytes = 0
+        self.store_bytes = 0
+        self.misaligned = 0
+        self.code_lines = set()
+        self.data_lines = set()
+
+    def record(self, pc, op, state, bus):
+        """Record op at pc before it is executed"""
+        name = type(op).__name__
+        self.op_counts[name] = self.op_counts.get(name, 0) + 1
+        self.code_lines.add(pc >> LINE_SHIFT)
+
+        access = get_access(op, state, bus)
+        if access is None:
+            return
+        load, store, addr = access
+        if load:
+            self.loads += 1
+            self.load_bytes += load
+        if store:
+            self.stores += 1
+            self.store_bytes += store
+
+        self.data_lines.add(addr >> LINE_SHIFT)
+        if addr & (max(load, store) - 1):
+            self.misaligned += 1
+
+    def merge(self, other):
+        self.count += other.count
+        for name, count in other.op_counts.items():
+            self.op_counts[name] = self.op_counts.get(name, 0) + count
+        self.taken += other.taken
+        self.loads += other.loads
+        self.stores += other.stores
+        self.load_bytes += other.load_bytes
+        self.store_bytes += other.store_bytes
+        self.misaligned += other.misaligned
+        self.code_lines |= other.code_lines
+        self.data_lines |= other.data_lines
+
+    def to_dict(self):
+        return {
+            'start': self.start,
+            'count': self.count,
+            'op_counts': dict(sorted(self.op_counts.items(), key=lambda item: -item[1])),
+            'taken': self.taken,
+            'loads': self.loads,
+            'stores': self.stores,
+            'load_bytes': self.load_bytes,
+            'store_bytes': self.store_bytes,
+            'misaligned': self.misaligned,
+            'code_lines': len(self.code_lines),
+            'data_lines': len(self.data_lines),
+            'code_pages': len({line >> (PAGE_SHIFT - LINE_SHIFT) for line in self.code_lines}),
+            'data_pages': len({line >> (PAGE_SHIFT - LINE_SHIFT) for line in self.data_lines}),
+        }
+
+    def __str__(self):
+        ops = ", ".join(f"{name} {count}" for name, count in sorted(self.op_counts.items(), key=lambda item: -item[1])[:5])
+        return (f"[{self.start}, +{self.count}) loads {self.loads} stores {self.stores} taken {self.taken} "
+            f"code lines {len(self.code_lines)} data lines {len(self.data_lines)} ops: {ops}")
+
+def periodic_intervals(period, length, max_cycle):
+    """Intervals of length instructions at the start of every period, up to max_cycle"""
+    return [(start, min(length, max_cycle - start)) for start in range(0, max_cycle, period)]
+
+def write_json(stats, path):
+    with open(path, "w") as f:
+        json.dump([interval.to_dict() for interval in stats], f, indent=4)
@@ -0,0 +1,141 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import multiprocessing
+import queue
+from . import emu
+from . import mem
+
+# =============================================================================
+# Hart result
+#
+class HartResult:
+    def __init__(self, hartid, cycle, pc, int_reg, csr, counter_offsets, message=None):
+        self.hartid = hartid
+        self.cycle = cycle
+        self.pc = pc
+        self.int_reg = int_reg
+        self.csr = csr
+        self.counter_offsets = counter_offsets
+        self.message = message
+
+# =============================================================================
+# Worker
+#
+def run_hart(config, hartid, max_cycle, results):
+    """Run one hart on the shared memory named in config, putting a HartResult to results when it stops.
+    A hart which fails, even while it is set up, still puts its result, with the error as message."""
+    engine, fixedint, xlen, quantum, name, size, base, pc, int_reg, csr, counter_offsets, host_io_addr, cycle = config
+    memory = None
+    emulator = None
+    message = None
+    try:
+        memory = mem.SharedMemory(size, base, name)
+        emulator = emu.Emulator(engine, fixedint, xlen=xlen, memory=memory)
+        state = emulator.processor.cpuState
+        state.pc = pc
+        state.int_reg.restore(int_reg)
+        state.csr.restore(csr)
+        state.counter_offsets = dict(counter_offsets)
+        emulator.processor.set_hartid(hartid)
+        emulator.set_host_io_addr(host_io_addr)
+        emulator.cycle = cycle
+
+        end = cycle + max_cycle
+        while emulator.cycle < end and emulator.host_io_value == 0:
+            emulator.step(min(quantum, end - emulator.cycle))
+            # Stores of harts in other processes do not trigger the write watch, so tohost is polled.
+            emulator.on_host_io_write(host_io_addr)
+    except Exception as e:
+        message = str(e)
+
+    if emulator is not None:
+        state = emulator.processor.cpuState
+        cycle, pc, int_reg, csr, counter_offsets = emulator.cycle, state.pc, state.int_reg.snapshot(), state.csr.snapshot(), state.counter_offsets
+    results.put(HartResult(hartid, cycle, pc, int_reg, csr, counter_offsets, message))
+    if memory is not None:
+        memory.close()
+
+# =============================================================================
+# Scheduler
+#
+# How long the scheduler waits for a result before it checks whether a process has died.
+RESULT_POLL_SECONDS = 1
+
+def collect_results(processes, results):
+    """Return the HartResult of each process, in hartid order.
+    Raises an Exception if a process exits without sending its result, like one killed by a signal."""
+    hart_results = {}
+    while len(hart_results) < len(processes):
+        try:
+            result = results.get(timeout=RESULT_POLL_SECONDS)
+        except queue.Empty:
+            # A process exits only after what it sent is in the queue, so a result missing after that never comes.
+            for hartid, process in enumerate(processes):
+                if hartid not in hart_results and process.exitcode is not None and results.empty():
+                    raise Exception(f"Hart {hartid}: the process exited with code {process.exitcode} without a result.")
+            continue
+        hart_results[result.hartid] = result
+    return [hart_results[hartid] for hartid in range(len(processes))]
+
+def run_processes(emulator, harts, max_cycle, quantum=emu.Emulator.DEFAULT_QUANTUM):
+    """Run the guest loaded in emulator on harts harts, each in its own process, until one writes tohost
+    or each has run max_cycle instructions. Returns a HartResult per hart, in hartid order.
+
+    emulator must have a single hart and a mem.SharedMemory. Every hart starts from its PC, registers, CSRs and cycle,
+    with its own mhartid. Afterwards emulator holds the tohost value and the state of hart 0, so check_host_io() works as after run().
+
+    The processes only share the memory. Each hart polls tohost every quantum instructions, and its block cache
+    only drops code written by other harts when it runs FENCE.I, as RISC-V requires of the guest anyway.
+    LR/SC reservations are kept per process and AMOs are not atomic between processes, so guests which
+    synchronize with atomics need emu.Emulator(harts=N) instead."""
+    memory = emulator.memory
+    if not isinstance(memory, mem.SharedMemory):
+        raise Exception("Harts in separate processes need an emulator with a mem.SharedMemory.")
+    if len(emulator.processors) > 1:
+        raise Exception(f"The emulator has {len(emulator.processors)} harts, but harts in separate processes take one.")
+
+    state = emulator.processor.cpuState
+    config = (emulator.engine, state.fixedint, state.xlen, quantum, memory.name, memory.size, memory.base,
+        state.pc, state.int_reg.snapshot(), state.csr.snapshot(), state.counter_offsets, emulator.host_io_addr, emulator.cycle)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_hart, args=(config, hartid, int(max_cycle), results)) for hartid in range(harts)]
+    for process in processes:
+        process.start()
+    # Results are taken before joining, since a process does not exit until its result is sent.
+    try:
+        hart_results = collect_results(processes, results)
+    except Exception:
+        # The other harts would run on to max_cycle.
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+
+    first = hart_results[0]
+    state.pc = first.pc
+    state.int_reg.restore(first.int_reg)
+    state.csr.restore(first.csr)
+    state.counter_offsets = first.counter_offsets
+    emulator.cycle = first.cycle
+    emulator.on_host_io_write(emulator.host_io_addr)
+    emulator.bus.invalidate_code_caches()
+
+    for result in hart_results:
+        if result.message is not None:
+            raise Exception(f"Hart {result.hartid}: {result.message}")
+    return hart_results
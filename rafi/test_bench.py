@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import bench
+from . import emu
+import unittest
+
+class TestBench(unittest.TestCase):
+    def test_kernels(self):
+        for name, words in bench.KERNELS.items():
+            states = []
+            for engine in emu.Emulator.ENGINES:
+                emulator = bench.make_kernel_emulator(words, engine)
+                self.assertEqual(1000, emulator.step(1000))
+                self.assertEqual(0, emulator.processor.exception_count, name)
+                states.append([emulator.processor.cpuState.int_reg[i] for i in range(32)])
+            self.assertEqual(states[0], states[1], name)
+
+    def test_find_regressions(self):
+        baseline = {'decode': 1000.0, 'kernel/alu/block': 2000.0, 'removed': 10.0}
+        results = {'decode': 950.0, 'kernel/alu/block': 1500.0, 'added': 1.0}
+        self.assertEqual(["kernel/alu/block: 1500/s < 2000/s (-25.0%)"], bench.find_regressions(results, baseline, 0.1))
+        self.assertEqual([], bench.find_regressions(results, baseline, 0.3))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
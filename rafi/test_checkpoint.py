@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import checkpoint
+from . import cpu
+from . import emu
+from . import rv
+from .test_emu import SUM_PROGRAM, load_words
+import os
+import tempfile
+import unittest
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.ckpt')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def get_state(self, emulator):
+        state = emulator.processor.cpuState
+        return [state.pc, emulator.cycle, emulator.host_io_value] + [state.int_reg[i] for i in range(32)]
+
+    def test_resume(self):
+        for engine in emu.Emulator.ENGINES:
+            for compression in (checkpoint.COMPRESSION_NONE, checkpoint.COMPRESSION_ZLIB):
+                expected = emu.Emulator(engine)
+                load_words(expected, SUM_PROGRAM)
+                expected.run(1000)
+
+                emulator = emu.Emulator(engine)
+                load_words(emulator, SUM_PROGRAM)
+                self.assertEqual(7, emulator.step(7))
+                checkpoint.save(emulator, self.path, compression)
+
+                resumed = emu.Emulator(engine)
+                checkpoint.load(resumed, self.path)
+                self.assertEqual(7, resumed.cycle)
+                resumed.run(1000)
+                self.assertEqual(self.get_state(expected), self.get_state(resumed))
+
+    def test_sparse(self):
+        emulator = emu.Emulator()
+        emulator.processor.cpuState.csr[0x340] = 0x1234
+        emulator.bus.write_uint32(0x8000_0000, 1)
+        emulator.bus.write_uint32(0x9000_0000, 2)
+        emulator.bus.read_uint32(0xa000_0000)
+        checkpoint.save(emulator, self.path)
+
+        # Header, state, registers, the counter CSRs, one other CSR and two pages. The zero page is skipped.
+        page_record = checkpoint.PAGE.size + 4096
+        self.assertEqual(checkpoint.HEADER.size + checkpoint.STATE.size + checkpoint.INT_REG.size + checkpoint.CSR_COUNT.size
+            + (len(cpu.COUNTER_CSRS) + 1) * checkpoint.CSR.size + 2 * page_record + checkpoint.PAGE.size, os.path.getsize(self.path))
+
+        loaded = emu.Emulator()
+        checkpoint.load(loaded, self.path)
+        self.assertEqual(0x1234, loaded.processor.cpuState.csr[0x340])
+        self.assertEqual([1, 2], [loaded.bus.read_uint32(0x8000_0000), loaded.bus.read_uint32(0x9000_0000)])
+        self.assertEqual(2, len(loaded.memory.pages))
+
+        # Raw pages are mapped from the file and copied on write.
+        loaded.bus.write_uint32(0x8000_0000, 3)
+        again = emu.Emulator()
+        checkpoint.load(again, self.path)
+        self.assertEqual(1, again.bus.read_uint32(0x8000_0000))
+
+    def test_counters(self):
+        emulator = emu.Emulator()
+        load_words(emulator, SUM_PROGRAM)
+        emulator.step(7)
+        state = emulator.processor.cpuState
+        state.write_csr(rv.CsrAddr.MINSTRETH.value, 3)
+        checkpoint.save(emulator, self.path)
+
+        loaded = emu.Emulator()
+        checkpoint.load(loaded, self.path)
+        self.assertEqual((3 << 32) + 7, loaded.processor.cpuState.read_counter(rv.CsrAddr.MINSTRET.value))
+        loaded.step(2)
+        self.assertEqual(9, loaded.processor.cpuState.read_csr(rv.CsrAddr.MCYCLE.value))
+
+        # A counter which reads zero at a non-zero cycle stays zero.
+        state.write_csr(rv.CsrAddr.MCYCLE.value, 0)
+        checkpoint.save(emulator, self.path)
+        checkpoint.load(loaded, self.path)
+        self.assertEqual(0, loaded.processor.cpuState.read_csr(rv.CsrAddr.MCYCLE.value))
+        self.assertEqual(7, loaded.processor.cpuState.read_csr(rv.CsrAddr.MINSTRET.value))
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as f:
+            f.write(checkpoint.HEADER.pack(checkpoint.MAGIC, checkpoint.VERSION + 1, 0))
+        with self.assertRaisesRegex(Exception, "version"):
+            checkpoint.load(emu.Emulator(), self.path)
+
+        checkpoint.save(emu.Emulator(), self.path)
+        with self.assertRaisesRegex(Exception, "does not match"):
+            checkpoint.load(emu.Emulator(memory_size=0x1000), self.path)
+
+        with self.assertRaisesRegex(Exception, "RV64"):
+            checkpoint.save(emu.Emulator(xlen=64), self.path)
+        with self.assertRaisesRegex(Exception, "one hart"):
+            checkpoint.save(emu.Emulator(harts=2), self.path)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import elf
+from . import emu
+import os
+import struct
+import tempfile
+import unittest
+
+TOHOST = 0x8000_2000
+
+# Stores 1 to TOHOST and loops.
+PROGRAM = [0x8000_22b7, 0x0010_0313, 0x0062_a023, 0x0000_006f]
+
+def build_elf(addr, entry, code, memsz, symbols):
+    """Build an ELF32 RISC-V executable with one PT_LOAD segment at addr and a symbol table"""
+    code_offset = 0x1000
+    strtab = b'\0' + b''.join(name.encode() + b'\0' for name in symbols)
+    symtab = bytes(16)
+    name_offset = 1
+    for name, value in symbols.items():
+        symtab += elf.ELF32_SYM.pack(name_offset, value, 0, 0, 0, 1)
+        name_offset += len(name) + 1
+
+    symtab_offset = code_offset + len(code)
+    strtab_offset = symtab_offset + len(symtab)
+    shoff = strtab_offset + len(strtab)
+    ident = elf.ELF_MAGIC + bytes([elf.ELFCLASS32, elf.ELFDATA2LSB, 1]) + bytes(9)
+
+    data = bytearray(elf.ELF32_EHDR.pack(ident, 2, elf.EM_RISCV, 1, entry, 52, shoff, 0, 52, 32, 1, 40, 3, 0))
+    data += elf.ELF32_PHDR.pack(elf.PT_LOAD, code_offset, addr, addr, len(code), memsz, 7, 0x1000)
+    data += bytes(code_offset - len(data))
+    data += code + symtab + strtab
+    data += bytes(40)
+    data += elf.ELF32_SHDR.pack(0, elf.SHT_SYMTAB, 0, 0, symtab_offset, len(symtab), 2, 0, 4, 16)
+    data += elf.ELF32_SHDR.pack(0, 3, 0, 0, strtab_offset, len(strtab), 0, 0, 1, 0)
+    return bytes(data)
+
+class TestElf(unittest.TestCase):
+    def write_elf(self, code, memsz=None, entry=0x8000_0000):
+        data = build_elf(0x8000_0000, entry, code, memsz or len(code), {'_start': entry, 'tohost': TOHOST})
+        with tempfile.NamedTemporaryFile(suffix='.elf', delete=False) as f:
+            f.write(data)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_parse(self):
+        path = self.write_elf(struct.pack('<4I', *PROGRAM), 0x3000)
+        self.assertTrue(elf.is_elf(path))
+        with elf.ElfFile(path) as image:
+            self.assertEqual(0x8000_0000, image.entry)
+            self.assertEqual({'_start': 0x8000_0000, 'tohost': TOHOST}, image.symbols)
+            self.assertEqual([(0x8000_0000, 16, 0x3000)], [(s.paddr, s.filesz, s.memsz) for s in image.segments])
+
+    def test_not_elf(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(struct.pack('<4I', *PROGRAM) * 4)
+        self.addCleanup(os.remove, f.name)
+        self.assertFalse(elf.is_elf(f.name))
+        with self.assertRaisesRegex(Exception, "not a little-endian ELF32"):
+            elf.ElfFile(f.name)
+
+    def test_run(self):
+        # bss covers tohost, which must be zero-filled even if the memory was dirty.
+        path = self.write_elf(struct.pack('<4I', *PROGRAM), 0x3000)
+        for mapped in (False, True):
+            emulator = emu.Emulator(mapped=mapped)
+            emulator.bus.write_uint32(TOHOST + 4, 0xffff_ffff)
+            emulator.load(path)
+            self.assertEqual(TOHOST, emulator.host_io_addr)
+            self.assertEqual(0, emulator.bus.read_uint32(TOHOST + 4))
+
+            emulator.run(100)
+            self.assertEqual(1, emulator.host_io_value)
+
+    def test_entry(self):
+        code = struct.pack('<I', 0) * 4 + struct.pack('<4I', *PROGRAM)
+        path = self.write_elf(code, 0x3000, entry=0x8000_0010)
+        emulator = emu.Emulator()
+        emulator.load(path)
+        self.assertEqual(0x8000_0010, emulator.processor.cpuState.pc)
+        emulator.run(100)
+        self.assertEqual(1, emulator.host_io_value)
+
+    def test_mapped_segment(self):
+        # Whole pages of the segment are mapped copy-on-write from the file.
+        code = struct.pack('<4I', *PROGRAM) + bytes(0x2ff0) + b'\x55' * 8
+        path = self.write_elf(code)
+        emulator = emu.Emulator(mapped=True)
+        emulator.load(path)
+        self.assertEqual(0x5555_5555, emulator.bus.read_uint32(0x8000_3000))
+        self.assertEqual(PROGRAM[0], emulator.bus.read_uint32(0x8000_0000))
+
+        emulator.bus.write_uint32(0x8000_0000, 0)
+        with open(path, 'rb') as f:
+            f.seek(0x1000)
+            self.assertEqual(PROGRAM[0], struct.unpack('<I', f.read(4))[0])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
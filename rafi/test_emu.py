@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import cpu
+from . import emu
+from . import mem
+from . import reference
+from . import rv
+from . import rv32i
+import json
+import os
+import random
+import unittest
+
+CONFIG_PATH = "./riscv_tests.json"
+BINARY_DIR_PATH = "./rafi-prebuilt-binary/riscv-tests/isa"
+
+NOP = 0x0000_0013       # addi x0, x0, 0
+ADDI_X1 = 0x0010_0093   # addi x1, x0, 1
+
+# Sums 5..1 into a1 and writes 1 to tohost on success, 3 on failure.
+SUM_PROGRAM = [
+    0x0050_0513, 0x0000_0593, 0x00a5_85b3, 0xfff5_0513, 0xfe05_1ce3, 0x00f0_0293, 0x0055_9c63, 0x0010_0313,
+    0x0000_1397, 0xfe03_8393, 0x0063_a023, 0x0000_006f, 0x0030_0313, 0x0000_1397, 0xfcc3_8393, 0x0063_a023,
+    0xfedf_f06f,
+]
+
+def load_words(emulator, words, addr=0x8000_0000):
+    for i, word in enumerate(words):
+        emulator.bus.write_uint32(addr + i * 4, word)
+
+class TestDecodeCache(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = emu.DecodeCache()
+        op = cache.lookup(0x8000_0000, NOP)
+        self.assertIs(op, cache.lookup(0x8000_0000, NOP))
+        self.assertEqual(1, cache.hit_count)
+        self.assertEqual(1, cache.miss_count)
+
+        # Same PC with a different instruction word must be re-decoded.
+        self.assertIsInstance(cache.lookup(0x8000_0000, ADDI_X1), rv32i.ADDI)
+        self.assertEqual(2, cache.miss_count)
+
+    def test_eviction(self):
+        cache = emu.DecodeCache(capacity=2)
+        for pc in (0x8000_0000, 0x8000_0004, 0x8000_0008):
+            cache.lookup(pc, NOP)
+        self.assertEqual(2, len(cache.entries))
+        self.assertNotIn(0x8000_0000, cache.entries)
+
+    def test_invalidate(self):
+        cache = emu.DecodeCache()
+        cache.lookup(0x8000_0000, NOP)
+        cache.lookup(0x8000_0004, NOP)
+        cache.invalidate(0x8000_0006, 1)
+        self.assertIn(0x8000_0000, cache.entries)
+        self.assertNotIn(0x8000_0004, cache.entries)
+
+        cache.invalidate_all()
+        self.assertEqual(0, len(cache.entries))
+
+class TestDecode(unittest.TestCase):
+    def assertDecodeEqual(self, insn):
+        try:
+            expected = emu.decode_reference(insn)
+        except Exception as e:
+            with self.assertRaises(Exception) as cm:
+                emu.decode(insn)
+            self.assertEqual(str(e), str(cm.exception))
+            return
+
+        actual = emu.decode(insn)
+        self.assertIs(type(expected), type(actual), f"insn 0x{insn:08x}")
+        self.assertEqual(vars(expected), vars(actual), f"insn 0x{insn:08x}")
+
+    def test_all_opcodes(self):
+        rand = random.Random(0)
+        for opcode in range(128):
+            for funct3 in range(8):
+                for funct7 in (0b0000000, 0b0000001, 0b0100000, 0b0001000, 0b0011000, 0b1111111):
+                    for fields in (0, rand.getrandbits(32), rand.getrandbits(32), rand.getrandbits(32)):
+                        insn = fields & 0x01ff_8f80 | funct7 << 25 | funct3 << 12 | opcode
+                        self.assertDecodeEqual(insn)
+
+    def test_system(self):
+        for imm in (0x000, 0x001, 0x002, 0x102, 0x302, 0x105, 0x120, 0x300, 0xc00, 0xf14):
+            for funct3 in range(8):
+                for rs1 in (0, 1):
+                    for rd in (0, 1):
+                        self.assertDecodeEqual(imm << 20 | rs1 << 15 | funct3 << 12 | rd << 7 | 0b1110011)
+
+    @unittest.skipUnless(os.path.isdir(BINARY_DIR_PATH), "riscv-tests binaries are not checked out.")
+    def test_riscv_tests(self):
+        with open(CONFIG_PATH, "r") as f:
+            configs = json.load(f)
+
+        for config in configs:
+            with open(os.path.join(BINARY_DIR_PATH, f"{config}.bin"), mode='rb') as f:
+                data = f.read()
+            for offset in range(0, len(data) - 3, 4):
+                self.assertDecodeEqual(int.from_bytes(data[offset:offset+4], byteorder='little'))
+
+class TestEmulator(unittest.TestCase):
+    def test_independent_state(self):
+        a = emu.Emulator()
+        b = emu.Emulator()
+        load_words(a, SUM_PROGRAM)
+        a.run(1000)
+
+        self.assertEqual(15, a.processor.cpuState.int_reg[11])
+        self.assertEqual(0, b.processor.cpuState.int_reg[11])
+        self.assertEqual(0, b.bus.read_uint32(b.HOST_IO_ADDR))
+
+    def test_reset(self):
+        emulator = emu.Emulator("block")
+        for _ in range(3):
+            emulator.reset()
+            self.assertEqual(0, emulator.bus.read_uint32(emulator.HOST_IO_ADDR))
+            self.assertEqual(0x8000_0000, emulator.processor.cpuState.pc)
+
+            load_words(emulator, SUM_PROGRAM)
+            emulator.run(1000)
+            self.assertEqual(15, emulator.processor.cpuState.int_reg[11])
+
+    def test_host_io_watch(self):
+        emulator = emu.Emulator()
+        emulator.bus.write_uint32(emulator.HOST_IO_ADDR - 4, 1)
+        self.assertEqual(0, emulator.host_io_value)
+        emulator.bus.write_uint8(emulator.HOST_IO_ADDR, 5)
+        self.assertEqual(5, emulator.host_io_value)
+
+        load_words(emulator, [NOP])
+        with self.assertRaisesRegex(Exception, "Host IO"):
+            emulator.run(1)
+
+class TestStep(unittest.TestCase):
+    def test_exact_count(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine)
+            load_words(emulator, [NOP] * 200 + [0x0000_006f])
+            self.assertEqual(150, emulator.step(150))
+            self.assertEqual((150, 0x8000_0000 + 150 * 4), (emulator.cycle, emulator.processor.cpuState.pc))
+
+    def test_stop_on_host_io(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine)
+            load_words(emulator, SUM_PROGRAM)
+            executed = emulator.step(1000)
+            # Right after sw t1, 0(t2), like the interpreter.
+            self.assertEqual(23, executed, engine)
+            self.assertEqual(1, emulator.host_io_value)
+
+class TestSnapshot(unittest.TestCase):
+    def test_restore(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine)
+            load_words(emulator, SUM_PROGRAM)
+            snapshot = emulator.snapshot()
+
+            for _ in range(2):
+                emulator.run(1000)
+                self.assertEqual(15, emulator.processor.cpuState.int_reg[11])
+                self.assertEqual(1, emulator.host_io_value)
+
+                emulator.restore(snapshot)
+                state = emulator.processor.cpuState
+                self.assertEqual(0x8000_0000, state.pc)
+                self.assertEqual([0] * 32, [state.int_reg[i] for i in range(32)])
+                self.assertEqual((0, 0), (emulator.cycle, emulator.host_io_value))
+                self.assertEqual(0, emulator.bus.read_uint32(emulator.HOST_IO_ADDR))
+
+    def test_restore_code(self):
+        # Code written after the snapshot must not survive in the decode cache or the block engine.
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine)
+            load_words(emulator, [ADDI_X1, 0x0000_006f])
+            snapshot = emulator.snapshot()
+            load_words(emulator, [NOP])
+            with self.assertRaises(Exception):
+                emulator.run(10)
+            self.assertEqual(0, emulator.processor.cpuState.int_reg[1])
+
+            emulator.restore(snapshot)
+            with self.assertRaises(Exception):
+                emulator.run(10)
+            self.assertEqual(1, emulator.processor.cpuState.int_reg[1])
+
+class TestAccessFault(unittest.TestCase):
+    HANDLER = 0x8000_0100
+    FAULT_ADDR = 0x1000_0000
+
+    # Sets x5 to 8 and x6 to FAULT_ADDR, then runs the op under test at 0x8000_000c.
+    PROLOGUE = [0x0070_0293, 0x1000_0337, 0x0012_8293]
+    EPILOGUE = [0x0012_8293, 0x0000_006f]
+
+    def run_fault(self, engine, insn):
+        emulator = emu.Emulator(engine, memory_size=0x2000)
+        load_words(emulator, self.PROLOGUE + [insn] + self.EPILOGUE)
+        load_words(emulator, [0x0000_006f], self.HANDLER)
+        emulator.processor.cpuState.csr[rv.CsrAddr.MTVEC.value] = self.HANDLER
+        with self.assertRaisesRegex(Exception, "hasn't finished"):
+            emulator.run(20)
+
+        state = emulator.processor.cpuState
+        self.assertEqual(self.HANDLER, state.pc)
+        self.assertEqual(8, state.int_reg[5])
+        self.assertEqual(0, state.int_reg[7])
+        return [state.csr[csr.value] for csr in (rv.CsrAddr.MCAUSE, rv.CsrAddr.MEPC, rv.CsrAddr.MTVAL)]
+
+    def test_load(self):
+        for engine in emu.Emulator.ENGINES:
+            # lw x7, 0(x6)
+            self.assertEqual([5, 0x8000_000c, self.FAULT_ADDR], self.run_fault(engine, 0x0003_2383), engine)
+
+    def test_store(self):
+        for engine in emu.Emulator.ENGINES:
+            # sw x5, 0(x6)
+            self.assertEqual([7, 0x8000_000c, self.FAULT_ADDR], self.run_fault(engine, 0x0053_2023), engine)
+
+    def test_fetch(self):
+        for engine in emu.Emulator.ENGINES:
+            # jalr x0, 0(x6)
+            self.assertEqual([1, self.FAULT_ADDR, self.FAULT_ADDR], self.run_fault(engine, 0x0003_0067), engine)
+
+class TestCounters(unittest.TestCase):
+    # nop x3; csrr a0, minstret; csrr a1, cycle; li t0, 5; csrw mcycleh, t0; csrr a2, cycleh; csrr a3, mcycle
+    # csrwi mscratch, 15; csrrci a4, mscratch, 5; csrr a5, mscratch; j .
+    PROGRAM = [
+        0x0000_0013, 0x0000_0013, 0x0000_0013, 0xb020_2573, 0xc000_25f3, 0x0050_0293, 0xb802_9073, 0xc800_2673,
+        0xb000_26f3, 0x3407_d073, 0x3402_f773, 0x3400_27f3, 0x0000_006f,
+    ]
+
+    def test_read(self):
+        for engine in emu.Emulator.ENGINES:
+            for fixedint in (False, True):
+                emulator = emu.Emulator(engine, fixedint)
+                load_words(emulator, self.PROGRAM)
+                emulator.step(100)
+
+                state = emulator.processor.cpuState
+                self.assertEqual([3, 4, 5, 8, 15, 10], [state.int_reg[i] for i in range(10, 16)], engine)
+                self.assertEqual(100, state.read_csr(rv.CsrAddr.INSTRET.value))
+                self.assertEqual((5 << 32) + 100, state.read_counter(rv.CsrAddr.MCYCLE.value))
+
+    def test_read_only(self):
+        state = emu.Emulator().processor.cpuState
+        state.write_csr(rv.CsrAddr.CYCLE.value, 7)
+        self.assertEqual(0, state.read_csr(rv.CsrAddr.CYCLE.value))
+        state.write_csr(rv.CsrAddr.MINSTRETH.value, 0xffff_ffff)
+        self.assertEqual(0xffff_ffff, state.read_csr(rv.CsrAddr.INSTRETH.value))
+        self.assertEqual(0, state.read_csr(rv.CsrAddr.INSTRET.value))
+
+    def test_snapshot(self):
+        emulator = emu.Emulator()
+        load_words(emulator, self.PROGRAM)
+        emulator.step(10)
+        snapshot = emulator.snapshot()
+        emulator.step(10)
+        emulator.restore(snapshot)
+        self.assertEqual((5 << 32) + 10, emulator.processor.cpuState.read_counter(rv.CsrAddr.MCYCLE.value))
+
+class TestFixedInt(unittest.TestCase):
+    def test_same_result_as_fixedint(self):
+        rand = random.Random(0)
+        opcodes = (0b0110111, 0b0010111, 0b1101111, 0b1100111, 0b1100011, 0b0010011, 0b0110011)
+        for _ in range(2000):
+            insn = rand.getrandbits(25) << 7 | rand.choice(opcodes)
+            try:
+                op = emu.decode(insn)
+            except Exception:
+                continue
+
+            if type(op) not in reference.EXECUTE:
+                # The RV32M ops have no fixedint implementation.
+                continue
+
+            states = [cpu.CpuState(), cpu.CpuState(fixedint=True)]
+            values = [rand.choice((0, 1, 0x7fff_ffff, 0x8000_0000, 0xffff_ffff, rand.getrandbits(32))) for _ in range(32)]
+            for state in states:
+                state.pc = 0x8000_0000
+                state.next_pc = 0x8000_0004
+                for i in range(1, 32):
+                    state.int_reg[i] = values[i]
+            op.execute(states[0], None)
+            reference.execute(op, states[1], None)
+            for state in states:
+                state.int_reg[0] = 0
+
+            expected, actual = ([state.next_pc] + [state.int_reg[i] for i in range(32)] for state in states)
+            self.assertEqual(expected, actual, str(op))
+
+    def test_memory_ops(self):
+        bus = emu.Bus(mem.Memory())
+        ops = [rv32i.SW(1, 2, 0x10), rv32i.SH(1, 2, 0x16), rv32i.SB(1, 2, 0x19),
+            rv32i.LW(3, 1, 0x10), rv32i.LH(4, 1, 0x16), rv32i.LHU(5, 1, 0x16), rv32i.LB(6, 1, 0x19), rv32i.LBU(7, 1, 0x19)]
+        for value in (0x7fff_7f7f, 0x8765_8321):
+            results = []
+            for fixedint in (False, True):
+                state = cpu.CpuState(fixedint)
+                state.int_reg[1] = 0x8000_0000
+                state.int_reg[2] = value
+                for op in ops:
+                    if fixedint:
+                        reference.execute(op, state, bus)
+                    else:
+                        op.execute(state, bus)
+                results.append([state.int_reg[i] for i in range(3, 8)])
+            self.assertEqual(results[0], results[1])
+
+class TestBlockEngine(unittest.TestCase):
+    def run_program(self, engine, words):
+        emulator = emu.Emulator(engine)
+        load_words(emulator, words)
+        emulator.run(1000)
+        return emulator
+
+    def test_same_result_as_interpreter(self):
+        interpreter = self.run_program("interpreter", SUM_PROGRAM)
+        expected = [int(interpreter.processor.cpuState.int_reg[i]) for i in range(32)]
+
+        block = self.run_program("block", SUM_PROGRAM)
+        actual = [int(block.processor.cpuState.int_reg[i]) for i in range(32)]
+
+        self.assertEqual(expected, actual)
+        self.assertEqual(15, actual[11])
+        self.assertLess(block.cycle, 1000)
+
+    def test_invalidate_on_write(self):
+        emulator = self.run_program("block", SUM_PROGRAM)
+        engine = emulator.blockEngine
+        self.assertIn(0x8000_0014, engine.blocks)
+
+        emulator.bus.write_uint32(0x8000_0014, SUM_PROGRAM[5])
+        self.assertNotIn(0x8000_0014, engine.blocks)
+        self.assertIn(0x8000_0000, engine.blocks)
+
+    def test_store_to_own_block(self):
+        # lui t0, 0x80000; lui t1, 0x250; addi t1, t1, 0x513; sw t1, 16(t0); addi a0, a0, 1; j .
+        # The store rewrites the following op to addi a0, a0, 2.
+        words = [0x8000_02b7, 0x0025_0337, 0x5133_0313, 0x0062_a823, 0x0015_0513, 0x0000_006f]
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine)
+            load_words(emulator, words)
+            emulator.step(200)
+            self.assertEqual(2, emulator.processor.cpuState.int_reg[10], engine)
+
+    def test_chain(self):
+        emulator = emu.Emulator("block")
+        # loop: addi a0, a0, 1; j loop
+        load_words(emulator, [0x0015_0513, 0xffdf_f06f])
+        self.assertEqual(100, emulator.blockEngine.execute_blocks(100))
+        self.assertEqual(50, emulator.processor.cpuState.int_reg[10])
+        # The next block does not fit.
+        self.assertEqual(0, emulator.blockEngine.execute_blocks(1))
+
+    def test_counter_in_chain(self):
+        # addi a0, a0, 1; j 8; nop; addi a0, a0, 1; csrr a1, minstret; j .
+        words = [0x0015_0513, 0x0080_006f, NOP, 0x0015_0513, 0xb020_25f3, 0x0000_006f]
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine)
+            load_words(emulator, words)
+            emulator.step(200)
+            self.assertEqual(3, emulator.processor.cpuState.int_reg[11], engine)
+
+    def test_evict(self):
+        emulator = emu.Emulator("block")
+        engine = emulator.blockEngine
+        engine.MAX_BLOCKS = 2
+        load_words(emulator, SUM_PROGRAM)
+        emulator.run(1000)
+
+        self.assertEqual(15, emulator.processor.cpuState.int_reg[11])
+        self.assertLessEqual(len(engine.blocks), 2)
+        self.assertEqual(set(engine.blocks.values()), {block for blocks in engine.pages.values() for block in blocks})
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
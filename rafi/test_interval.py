@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import checkpoint
+from . import emu
+from . import interval
+from .test_emu import SUM_PROGRAM, load_words
+import os
+import tempfile
+import unittest
+
+class TestInterval(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.prefix = os.path.join(directory.name, "sum")
+
+    def test_run_intervals(self):
+        emulator = emu.Emulator()
+        load_words(emulator, SUM_PROGRAM)
+        paths = checkpoint.save_periodic(emulator, 5, self.prefix, 1000)
+        self.assertEqual(1, emulator.host_io_value)
+        self.assertEqual(list(range(0, emulator.cycle, 5)), [checkpoint.read_cycle(path) for path in paths])
+
+        for jobs in (1, 2):
+            results = list(interval.run_intervals(reversed(paths), "block", jobs=jobs))
+            self.assertEqual([[]] * len(paths), [result.mismatches for result in results])
+            self.assertEqual(1, results[-1].host_io_value)
+
+            merged = interval.merge_stats(results)
+            self.assertEqual(emulator.cycle, merged.count)
+            self.assertEqual(1, merged.stores)
+
+    def test_sample_length(self):
+        emulator = emu.Emulator()
+        load_words(emulator, SUM_PROGRAM)
+        paths = checkpoint.save_periodic(emulator, 10, self.prefix, 1000)
+
+        results = list(interval.run_intervals(paths, sample_length=3, jobs=1))
+        self.assertEqual([3] * len(paths), [result.stats.count for result in results])
+        self.assertEqual([[]] * len(paths), [result.mismatches for result in results])
+
+    def test_compare(self):
+        a = emu.Emulator()
+        b = emu.Emulator()
+        self.assertEqual([], interval.compare(a, b))
+
+        a.processor.cpuState.int_reg[5] = 1
+        b.bus.write_uint8(0x8000_2000, 1)
+        self.assertEqual(["x5: 0x00000001 != 0x00000000", "page 0x80002000"], interval.compare(a, b))
+
+        # The counter CSRs follow the instruction count.
+        a = emu.Emulator()
+        a.cycle = 5
+        self.assertEqual(["csr 0xb00: 0x00000005 != 0x00000000", "csr 0xb02: 0x00000005 != 0x00000000",
+            "csr 0xc00: 0x00000005 != 0x00000000", "csr 0xc02: 0x00000005 != 0x00000000"], interval.compare(a, emu.Emulator()))
+
+        a = emu.Emulator(xlen=64)
+        a.processor.cpuState.int_reg[5] = 0xffff_ffff_ffff_ffff
+        self.assertEqual(["x5: 0xffffffffffffffff != 0x0000000000000000"], interval.compare(a, emu.Emulator(xlen=64)))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
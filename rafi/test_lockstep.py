@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import emu
+from . import lockstep
+from . import trace
+from .test_emu import SUM_PROGRAM, load_words
+from .test_trace import ATOMIC_PROGRAM
+import unittest
+
+def make_emulator(engine="interpreter"):
+    emulator = emu.Emulator(engine)
+    load_words(emulator, SUM_PROGRAM)
+    return emulator
+
+class TestSpikeLog(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(trace.TraceRecord(0x8000_0004, 0x00a5_8593, trace.FLAG_RD, 11, 0, 5, 0, 0),
+            lockstep.parse_spike_line("core   0: 3 0x80000004 (0x00a58593) x11 0x00000005"))
+        self.assertEqual(trace.TraceRecord(0x8000_0028, 0x0063_a023, trace.FLAG_STORE, 0, 4, 0, 0x8000_1000, 1),
+            lockstep.parse_spike_line("core   0: 3 0x80000028 (0x0063a023) mem 0x80001000 0x00000001"))
+        self.assertEqual(trace.TraceRecord(0x8000_002c, 0x0003_c703, trace.FLAG_RD | trace.FLAG_LOAD, 14, 0, 1, 0x8000_1000, 0),
+            lockstep.parse_spike_line("core   0: 3 0x8000002c (0x0003c703) x14 0x00000001 mem 0x80001000"))
+        self.assertEqual(trace.TraceRecord(0x8000_0010, 0x3020_0073, trace.FLAG_RD, 5, 0, 8, 0, 0),
+            lockstep.parse_spike_line("core   0: 0x80000010 (0x30200073) c768_mstatus 0x00000080 x 5 0x00000008"))
+        self.assertEqual(trace.TraceRecord(0x8000_0014, 0xfe05_1ce3, 0, 0, 0, 0, 0, 0),
+            lockstep.parse_spike_line("core   0: 3 0x80000014 (0xfe051ce3)"))
+
+    def test_other_lines(self):
+        self.assertIsNone(lockstep.parse_spike_line("core   0: 0x0000000080000000 (0x00000297) auipc   t0, 0x0"))
+        self.assertIsNone(lockstep.parse_spike_line("core   0: exception trap_user_ecall, epc 0x80000040"))
+
+class TestDiffer(unittest.TestCase):
+    def get_reference(self):
+        emulator = make_emulator()
+        return list(emulator.trace_records(1000))
+
+    def test_match(self):
+        reference = self.get_reference()
+        for engine in emu.Emulator.ENGINES:
+            for skip_ahead in (False, True):
+                differ = lockstep.Differ(make_emulator(engine), reference, skip_ahead=skip_ahead, min_distance=4)
+                self.assertIsNone(differ.run(1000))
+                self.assertEqual(len(reference), differ.count)
+
+    def test_sync(self):
+        # Records before the emulator PC, like a boot ROM, are skipped.
+        reference = [trace.TraceRecord(0x1000, 0x297, trace.FLAG_RD, 5, 0, 0x1000, 0, 0)] + self.get_reference()
+        self.assertIsNone(lockstep.Differ(make_emulator(), reference).run(1000))
+
+        # A reference which never reaches the emulator PC does not match.
+        for skip_ahead in (False, True):
+            divergence = lockstep.Differ(make_emulator(), reference[:1], skip_ahead=skip_ahead).run(1000)
+            self.assertEqual(0, divergence.index)
+            self.assertEqual("the reference never reaches the start PC 0x80000000", divergence.reason)
+
+    def test_divergence(self):
+        reference = self.get_reference()
+        # The last add a1, a1, a0 of the loop.
+        reference[14] = reference[14]._replace(rd_value=100)
+
+        divergence = lockstep.Differ(make_emulator(), reference, context=3).run(1000)
+        self.assertEqual(14, divergence.index)
+        self.assertEqual("x11: 0x0000000f != 0x00000064", divergence.reason)
+        self.assertEqual(3, len(divergence.context))
+        self.assertIn("0x80000008 (0x00a585b3) x11 0x00000064", str(divergence))
+
+        # Compared at the end of the block from the last loop iteration to the store.
+        divergence = lockstep.Differ(make_emulator("block"), reference, skip_ahead=True, min_distance=4).run(1000)
+        self.assertEqual(11, divergence.index)
+        self.assertIn("x11: 0x0000000f != 0x00000064", divergence.reason)
+
+    def test_atomic(self):
+        # Spike logs an AMO as a load and a store of the new value.
+        expected = lockstep.parse_spike_line(
+            "core   0: 3 0x8000000c (0x00b2a52f) x10 0x00000000 mem 0x80000100 mem 0x80000100 0x00000003")
+        emulator = emu.Emulator()
+        load_words(emulator, ATOMIC_PROGRAM)
+        records = list(emulator.trace_records(len(ATOMIC_PROGRAM)))
+        self.assertIsNone(lockstep.compare_records(records[3], expected))
+        self.assertTrue(lockstep.compare_records(records[3], expected._replace(mem_value=4)).startswith("store: "))
+
+    def test_store(self):
+        reference = self.get_reference()
+        reference[-1] = reference[-1]._replace(mem_value=3)
+        divergence = lockstep.Differ(make_emulator(), reference).run(1000)
+        self.assertTrue(divergence.reason.startswith("store: "))
+
+        # The write to tohost is compared in skip-ahead mode too.
+        divergence = lockstep.Differ(make_emulator(), reference, skip_ahead=True).run(1000)
+        self.assertIn("mem 0x80001000: 0x01 != 0x03", divergence.reason)
+
+    def test_stop_early(self):
+        # The reference runs past the write to tohost, where the emulator stops.
+        reference = self.get_reference()
+        reference.append(trace.TraceRecord(0x8000_002c, 0x0000_0013, 0, 0, 0, 0, 0, 0))
+        for skip_ahead in (False, True):
+            self.assertIsNotNone(lockstep.Differ(make_emulator(), reference, skip_ahead=skip_ahead).run(1000))
+
+        divergence = lockstep.Differ(make_emulator(), reference, skip_ahead=True).run(1000)
+        self.assertEqual(0, divergence.index)
+        self.assertEqual("between 0x80000000 and 0x8000002c (ahead of 0): the emulator stopped after 23 of 24 insns",
+            divergence.reason)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import mem
+import os
+import tempfile
+import unittest
+
+BASE = mem.Memory.DEFAULT_BASE
+
+class TestMemory(unittest.TestCase):
+    def test_aligned(self):
+        memory = mem.Memory()
+        memory.write_uint32(BASE + 0x10, 0x1234_5678)
+        self.assertEqual(0x1234_5678, memory.read_uint32(BASE + 0x10))
+        self.assertEqual(0x5678, memory.read_uint16(BASE + 0x10))
+        self.assertEqual(0x12, memory.read_uint8(BASE + 0x13))
+
+    def test_unaligned(self):
+        memory = mem.Memory()
+        memory.write_uint32(BASE + 0x11, 0x89ab_cdef)
+        memory.write_uint16(BASE + 0x21, 0xfedc)
+        self.assertEqual(0x89ab_cdef, memory.read_uint32(BASE + 0x11))
+        self.assertEqual(0xabcd_ef00, memory.read_uint32(BASE + 0x10))
+        self.assertEqual(0xfedc, memory.read_uint16(BASE + 0x21))
+
+    def test_write_truncates(self):
+        memory = mem.Memory()
+        memory.write_uint8(BASE, 0x1ff)
+        memory.write_uint16(BASE + 2, 0x1_ffff)
+        self.assertEqual(0xffff_00ff, memory.read_uint32(BASE))
+
+    def test_page_crossing(self):
+        memory = mem.Memory()
+        memory.write_uint32(BASE + mem.PAGE_SIZE - 2, 0x1234_5678)
+        memory.write_uint16(BASE + 2 * mem.PAGE_SIZE - 1, 0xabcd)
+        self.assertEqual(0x1234_5678, memory.read_uint32(BASE + mem.PAGE_SIZE - 2))
+        self.assertEqual(0x1234, memory.read_uint16(BASE + mem.PAGE_SIZE))
+        self.assertEqual(0xabcd, memory.read_uint16(BASE + 2 * mem.PAGE_SIZE - 1))
+
+    def test_uint64(self):
+        memory = mem.Memory()
+        memory.write_uint64(BASE + 0x10, 0x0123_4567_89ab_cdef)
+        memory.write_uint64(BASE + mem.PAGE_SIZE - 4, 0xfedc_ba98_7654_3210)
+        self.assertEqual(0x0123_4567_89ab_cdef, memory.read_uint64(BASE + 0x10))
+        self.assertEqual(0x89ab_cdef, memory.read_uint32(BASE + 0x10))
+        self.assertEqual(0xfedc_ba98_7654_3210, memory.read_uint64(BASE + mem.PAGE_SIZE - 4))
+        self.assertEqual(0xfedc_ba98, memory.read_uint32(BASE + mem.PAGE_SIZE))
+
+    def test_lazy_pages(self):
+        memory = mem.Memory()
+        memory.write_uint32(BASE + 0x7000_0000, 1)
+        memory.read_uint8(BASE + 0x10)
+        self.assertEqual(2, len(memory.pages))
+        memory.clear()
+        self.assertEqual(0, len(memory.pages))
+        self.assertEqual(0, memory.read_uint32(BASE + 0x7000_0000))
+
+    def test_access_fault(self):
+        memory = mem.Memory(size=2 * mem.PAGE_SIZE, base=0x1000)
+        with self.assertRaises(mem.MemoryAccessError) as context:
+            memory.read_uint32(0x0ffc)
+        self.assertEqual((0x0ffc, False), (context.exception.addr, context.exception.write))
+        with self.assertRaises(mem.MemoryAccessError) as context:
+            memory.write_uint16(0x3000, 0)
+        self.assertEqual((0x3000, True), (context.exception.addr, context.exception.write))
+
+        # A store straddling the end of memory does not write anything.
+        with self.assertRaises(mem.MemoryAccessError):
+            memory.write_uint32(0x2ffe, 0xffff_ffff)
+        self.assertEqual(0, memory.read_uint16(0x2ffe))
+
+    def test_invalid_layout(self):
+        with self.assertRaises(ValueError):
+            mem.Memory(size=0x1800)
+
+class TestSnapshot(unittest.TestCase):
+    def test_restore(self):
+        memory = mem.Memory()
+        memory.write_uint32(BASE, 1)
+        snapshot = memory.snapshot()
+        memory.write_uint32(BASE, 2)
+        memory.write_uint8(BASE + 0x10_0000, 3)
+        self.assertEqual({BASE >> mem.PAGE_SHIFT, (BASE + 0x10_0000) >> mem.PAGE_SHIFT}, memory.dirty)
+
+        memory.restore(snapshot)
+        self.assertEqual(1, memory.read_uint32(BASE))
+        self.assertEqual(1, len(memory.pages))
+        self.assertEqual(0, len(memory.dirty))
+
+        # The frozen page is copied again on the next write.
+        memory.write_uint32(BASE, 4)
+        memory.restore(snapshot)
+        self.assertEqual(1, memory.read_uint32(BASE))
+
+    def test_restore_older(self):
+        memory = mem.Memory()
+        first = memory.snapshot()
+        memory.write_uint32(BASE, 1)
+        second = memory.snapshot()
+        memory.write_uint32(BASE + 4, 2)
+
+        memory.restore(first)
+        self.assertEqual(0, memory.read_uint32(BASE))
+        memory.restore(second)
+        self.assertEqual([1, 0], [memory.read_uint32(BASE), memory.read_uint32(BASE + 4)])
+
+    def test_mapped(self):
+        # Anonymous pages written in place must not come back after a restore drops them.
+        memory = mem.MappedMemory(size=0x10_0000)
+        first = memory.snapshot()
+        memory.write_uint32(BASE, 1)
+        second = memory.snapshot()
+        memory.write_uint32(BASE, 2)
+
+        memory.restore(first)
+        self.assertEqual(0, memory.read_uint32(BASE))
+        memory.write_uint32(BASE, 3)
+        memory.restore(second)
+        self.assertEqual(1, memory.read_uint32(BASE))
+
+class TestMappedMemory(unittest.TestCase):
+    def setUp(self):
+        # Two whole pages and a partial one.
+        self.image = bytes(range(256)) * 40
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(self.image)
+            self.path = f.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_load(self):
+        memory = mem.MappedMemory(size=0x10_0000)
+        memory.load(self.path)
+        # Only the partial last page is copied at load time.
+        self.assertEqual(1, len(memory.pages))
+        self.assertEqual(self.image, memory.read_bytes(BASE, len(self.image)))
+        self.assertEqual(0, memory.read_uint32(BASE + len(self.image)))
+
+    def test_copy_on_write(self):
+        memory = mem.MappedMemory(size=0x10_0000)
+        memory.load(self.path)
+        memory.write_uint32(BASE, 0xffff_ffff)
+        memory.write_uint8(BASE + len(self.image) - 1, 0)
+        self.assertEqual(0xffff_ffff, memory.read_uint32(BASE))
+        self.assertEqual(0, memory.read_uint8(BASE + len(self.image) - 1))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(self.image, f.read())
+
+    def test_clear(self):
+        memory = mem.MappedMemory(size=0x10_0000)
+        memory.load(self.path)
+        memory.write_uint32(BASE + 0x8_0000, 1)
+        memory.clear()
+        self.assertEqual(0, memory.read_uint32(BASE))
+        self.assertEqual(0, memory.read_uint32(BASE + 0x8_0000))
+
+    def test_access_fault(self):
+        memory = mem.MappedMemory(size=0x1000)
+        with self.assertRaises(mem.MemoryAccessError):
+            memory.read_uint8(BASE + 0x1000)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import emu
+from .test_emu import SUM_PROGRAM, load_words
+from .test_rv64i import RV64_PROGRAM
+import unittest
+
+class TestProfiler(unittest.TestCase):
+    def run_profiled(self, engine):
+        emulator = emu.Emulator(engine, profile=True)
+        load_words(emulator, SUM_PROGRAM)
+        emulator.run(1000)
+        return emulator
+
+    def test_counts(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator = self.run_profiled(engine)
+            profiler = emulator.profiler
+            self.assertEqual(emulator.cycle, profiler.count)
+            self.assertEqual(emulator.cycle, sum(profiler.get_op_counts().values()))
+            self.assertEqual({'ADDI': 10, 'BNE': 6, 'ADD': 5, 'AUIPC': 1, 'SW': 1}, profiler.get_op_counts())
+
+            # The loop body: add, addi and bne run once per iteration.
+            self.assertEqual([(0x8000_0008, 5), (0x8000_000c, 5), (0x8000_0010, 5)], profiler.get_hot_pcs(3))
+            self.assertEqual(4, profiler.taken)
+
+    def test_report(self):
+        emulator = self.run_profiled("interpreter")
+        report = emulator.profiler.report(emulator.bus, emu.decode, 1)
+        self.assertIn("Profile: 23 insns", report)
+        self.assertIn("80000008            5  21.74%  add a1,a1,a0", report)
+
+    def test_rv64(self):
+        # PCs above 4 GiB.
+        base = 0x12_3456_0000
+        emulator = emu.Emulator(profile=True, memory_size=0x4000, memory_base=base, xlen=64)
+        load_words(emulator, RV64_PROGRAM, base)
+        emulator.processor.cpuState.pc = base
+        emulator.step(20)
+        # bltu skips one op, so j . runs from the 15th step on.
+        self.assertEqual([(base + 0x3c, 6)], emulator.profiler.get_hot_pcs(1))
+        report = emulator.profiler.report(emulator.bus, emu.decode_rv64, 1)
+        self.assertIn(f"{base + 0x3c:08x}            6  30.00%  jal zero,0", report)
+
+    def test_disabled(self):
+        emulator = emu.Emulator()
+        load_words(emulator, SUM_PROGRAM)
+        emulator.run(1000)
+        self.assertIsNone(emulator.profiler)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import runner
+from .test_emu import SUM_PROGRAM
+import json
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+# Writes 7 to tohost, i.e. fails with testId=3.
+FAIL_PROGRAM = [0x0070_0313, 0x0000_1397, 0xffc3_8393, 0x0063_a023, 0x0000_006f]
+
+class TestRunner(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.tests = []
+        for name, words in (("sum", SUM_PROGRAM), ("fail", FAIL_PROGRAM)):
+            path = os.path.join(self.dir.name, f"{name}.bin")
+            with open(path, "wb") as f:
+                f.write(b"".join(word.to_bytes(4, byteorder='little') for word in words))
+            self.tests.append((name, path))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_run_tests(self):
+        for jobs in (1, 2):
+            results = list(runner.run_tests(self.tests, jobs=jobs))
+            self.assertEqual(["sum", "fail"], [result.name for result in results])
+            self.assertTrue(results[0].passed)
+            self.assertFalse(results[1].passed)
+            self.assertEqual(3, results[1].test_id)
+            self.assertEqual(4, results[1].instret)
+
+    def test_reports(self):
+        results = list(runner.run_tests(self.tests, jobs=1))
+        json_path = os.path.join(self.dir.name, "results.json")
+        junit_path = os.path.join(self.dir.name, "results.xml")
+        runner.write_json(results, json_path)
+        runner.write_junit(results, junit_path)
+
+        with open(json_path) as f:
+            self.assertEqual(1, json.load(f)['failures'])
+        suite = ET.parse(junit_path).getroot()
+        self.assertEqual("2", suite.get('tests'))
+        self.assertEqual(1, len(suite.findall("testcase/failure")))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import cpu
+from . import emu
+from . import mem
+from . import rv
+from . import rv32a
+from .test_emu import load_words
+import unittest
+
+ADDR = 0x8000_0100
+
+# (op, memory, rs2, memory after). rd gets the old memory value.
+CASES = [
+    (rv32a.AMOSWAP_W, 0x1234_5678, 0x89ab_cdef, 0x89ab_cdef),
+    (rv32a.AMOADD_W, 0xffff_ffff, 0x0000_0002, 0x0000_0001),
+    (rv32a.AMOXOR_W, 0x0ff0_0ff0, 0x00ff_00ff, 0x0f0f_0f0f),
+    (rv32a.AMOAND_W, 0x0ff0_0ff0, 0x00ff_00ff, 0x00f0_00f0),
+    (rv32a.AMOOR_W, 0x0ff0_0ff0, 0x00ff_00ff, 0x0fff_0fff),
+    (rv32a.AMOMIN_W, 0xffff_ffff, 0x0000_0001, 0xffff_ffff),
+    (rv32a.AMOMAX_W, 0xffff_ffff, 0x0000_0001, 0x0000_0001),
+    (rv32a.AMOMINU_W, 0xffff_ffff, 0x0000_0001, 0x0000_0001),
+    (rv32a.AMOMAXU_W, 0xffff_ffff, 0x0000_0001, 0xffff_ffff),
+]
+
+# Each hart adds 1 to the word at 0x8000_2000 100 times with an LR/SC loop, then adds 1 to the word at
+# 0x8000_2040 with AMOADD.W. Hart 0 waits for the latter to reach 2, loads the former to a2 and writes tohost.
+LOCK_PROGRAM = [
+    0x8000_22b7, 0x0640_0313, 0x1002_a3af, 0x0013_8393, 0x1872_ae2f, 0xfe0e_1ae3, 0xfff3_0313, 0xfe03_16e3,
+    0x0402_8e93, 0x0010_0f13, 0x01ee_a02f, 0xf140_2573, 0x0005_1e63, 0x000e_af83, 0x0020_0593, 0xfebf_9ce3,
+    0x0002_a603, 0x8000_16b7, 0x01e6_a023, 0x0000_006f,
+]
+
+class TestDecodeRv32a(unittest.TestCase):
+    def test_decode(self):
+        cases = [
+            (0x1005_a52f, "lr.w a0,(a1)"),
+            (0x1401_22af, "lr.w.aq t0,(sp)"),
+            (0x1ed7_262f, "sc.w.aqrl a2,a3,(a4)"),
+            (0x02b6_202f, "amoadd.w.rl zero,a1,(a2)"),
+            (0xe0b6_252f, "amomaxu.w a0,a1,(a2)"),
+        ]
+        for insn, expected in cases:
+            self.assertEqual(expected, str(emu.decode(insn)), hex(insn))
+
+    def test_reserved(self):
+        # The doubleword width, LR.W with rs2 and an unused funct5.
+        for insn in (0x0005_b52f, 0x1015_a52f, 0x3005_a52f):
+            with self.assertRaisesRegex(Exception, "decode"):
+                emu.decode(insn)
+
+class TestRv32a(unittest.TestCase):
+    def setUp(self):
+        self.bus = emu.Bus(mem.Memory())
+
+    def test_amo(self):
+        for fixedint in (False, True):
+            for cls, value, rs2, expected in CASES:
+                state = cpu.CpuState(fixedint)
+                state.int_reg[1] = ADDR
+                state.int_reg[2] = rs2
+                self.bus.write_uint32(ADDR, value)
+                op = cls(3, 1, 2, 0, 0)
+                op.execute(state, self.bus)
+                self.assertEqual(value, state.int_reg[3], str(op))
+                self.assertEqual(expected, self.bus.read_uint32(ADDR), str(op))
+
+    def run_op(self, state, op):
+        op.execute(state, self.bus)
+        return state.int_reg[op.rd]
+
+    def test_lr_sc(self):
+        state = cpu.CpuState()
+        state.int_reg[1] = ADDR
+        state.int_reg[2] = 7
+        self.bus.write_uint32(ADDR, 5)
+        # Without a reservation the store does not happen.
+        self.assertEqual(1, self.run_op(state, rv32a.SC_W(3, 1, 2, 0, 0)))
+        self.assertEqual(5, self.bus.read_uint32(ADDR))
+
+        self.assertEqual(5, self.run_op(state, rv32a.LR_W(3, 1, 0, 0)))
+        self.assertEqual(0, self.run_op(state, rv32a.SC_W(3, 1, 2, 0, 0)))
+        self.assertEqual(7, self.bus.read_uint32(ADDR))
+        # The reservation is used up by the first SC.
+        self.assertEqual(1, self.run_op(state, rv32a.SC_W(3, 1, 2, 0, 0)))
+        self.assertEqual({}, self.bus.reservations.lines)
+
+    def test_conflicting_store(self):
+        harts = [cpu.CpuState(), cpu.CpuState()]
+        for state in harts:
+            state.int_reg[1] = ADDR
+            self.run_op(state, rv32a.LR_W(3, 1, 0, 0))
+
+        # A store to another line keeps the reservations, one to the same line drops them all.
+        self.bus.write_uint8(ADDR + 0x40, 1)
+        self.assertEqual(2, len(self.bus.reservations.harts))
+        self.bus.write_uint16(ADDR + 0x3e, 1)
+        self.assertEqual({}, self.bus.reservations.harts)
+        for state in harts:
+            self.assertEqual(1, self.run_op(state, rv32a.SC_W(3, 1, 2, 0, 0)))
+
+        # An SC drops the reservation of the other hart, and an AMO is a store.
+        for state in harts:
+            self.run_op(state, rv32a.LR_W(3, 1, 0, 0))
+        self.assertEqual(0, self.run_op(harts[0], rv32a.SC_W(3, 1, 2, 0, 0)))
+        self.assertEqual(1, self.run_op(harts[1], rv32a.SC_W(3, 1, 2, 0, 0)))
+        self.run_op(harts[1], rv32a.LR_W(3, 1, 0, 0))
+        self.run_op(harts[0], rv32a.AMOADD_W(0, 1, 2, 0, 0))
+        self.assertEqual(1, self.run_op(harts[1], rv32a.SC_W(3, 1, 2, 0, 0)))
+
+    def test_misaligned(self):
+        state = cpu.CpuState()
+        state.int_reg[1] = ADDR + 2
+        for op in [rv32a.LR_W(3, 1, 0, 0), rv32a.SC_W(3, 1, 2, 0, 0)] + [cls(3, 1, 2, 0, 0) for cls, _, _, _ in CASES]:
+            with self.assertRaises(mem.MisalignedAccessError) as cm:
+                op.execute(state, self.bus)
+            self.assertEqual((ADDR + 2, not isinstance(op, rv32a.LR_W)), (cm.exception.addr, cm.exception.write), str(op))
+
+        # lui t0, 0x80000; addi t0, t0, 0x102, then amoadd.w, lr.w or sc.w a0, a1, (t0). mtvec points to j . at 0x8000_0040.
+        for insn, cause in ((0x00b2_a52f, 6), (0x1002_a52f, 4), (0x18b2_a52f, 6)):
+            for engine in emu.Emulator.ENGINES:
+                emulator = emu.Emulator(engine)
+                load_words(emulator, [0x8000_02b7, 0x1022_8293, insn])
+                load_words(emulator, [0x0000_006f], 0x8000_0040)
+                state = emulator.processor.cpuState
+                state.csr[rv.CsrAddr.MTVEC.value] = 0x8000_0040
+                state.int_reg[10] = 0x1234
+                emulator.step(200)
+                self.assertEqual(0x8000_0040, state.pc, engine)
+                self.assertEqual([cause, 0x8000_0008, 0x8000_0102],
+                    [state.csr[csr.value] for csr in (rv.CsrAddr.MCAUSE, rv.CsrAddr.MEPC, rv.CsrAddr.MTVAL)], engine)
+                self.assertEqual(0x1234, state.int_reg[10], engine)
+
+    def test_harts(self):
+        for engine in emu.Emulator.ENGINES:
+            for quantum in (7, 100):
+                emulator = emu.Emulator(engine, harts=2, quantum=quantum)
+                load_words(emulator, LOCK_PROGRAM)
+                emulator.run(10000)
+                self.assertEqual(200, emulator.processor.cpuState.int_reg[12], f"{engine} {quantum}")
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import cpu
+from . import emu
+from . import rv32m
+from .test_emu import load_words
+import unittest
+
+# (op, rs1, rs2, rd), including the edge cases of the rv32um riscv-tests.
+CASES = [
+    (rv32m.MUL, 0x0000_0007, 0x0000_0003, 0x0000_0015),
+    (rv32m.MUL, 0xffff_8000, 0x0000_8000, 0xc000_0000),
+    (rv32m.MUL, 0xaaaa_aaab, 0x0002_fe7d, 0x0000_ff7f),
+    (rv32m.MULH, 0x8000_0000, 0x8000_0000, 0x4000_0000),
+    (rv32m.MULH, 0xffff_ffff, 0x0000_0001, 0xffff_ffff),
+    (rv32m.MULH, 0xaaaa_aaab, 0x0002_fe7d, 0xffff_0081),
+    (rv32m.MULHSU, 0x8000_0000, 0xffff_ffff, 0x8000_0000),
+    (rv32m.MULHSU, 0xaaaa_aaab, 0x0002_fe7d, 0xffff_0081),
+    (rv32m.MULHU, 0xffff_ffff, 0xffff_ffff, 0xffff_fffe),
+    (rv32m.MULHU, 0xaaaa_aaab, 0x0002_fe7d, 0x0001_fefe),
+    (rv32m.DIV, 0x0000_0014, 0x0000_0006, 0x0000_0003),
+    (rv32m.DIV, 0xffff_ffec, 0x0000_0006, 0xffff_fffd),
+    (rv32m.DIV, 0x0000_0014, 0xffff_fffa, 0xffff_fffd),
+    (rv32m.DIV, 0x8000_0000, 0xffff_ffff, 0x8000_0000),
+    (rv32m.DIV, 0x8000_0000, 0x0000_0000, 0xffff_ffff),
+    (rv32m.DIVU, 0xffff_ffec, 0x0000_0006, 0x2aaa_aaa7),
+    (rv32m.DIVU, 0x8000_0000, 0x0000_0000, 0xffff_ffff),
+    (rv32m.REM, 0xffff_ffec, 0x0000_0006, 0xffff_fffe),
+    (rv32m.REM, 0x0000_0014, 0xffff_fffa, 0x0000_0002),
+    (rv32m.REM, 0x8000_0000, 0xffff_ffff, 0x0000_0000),
+    (rv32m.REM, 0x8000_0000, 0x0000_0000, 0x8000_0000),
+    (rv32m.REMU, 0xffff_ffec, 0x0000_0006, 0x0000_0002),
+    (rv32m.REMU, 0x8000_0000, 0x0000_0000, 0x8000_0000),
+]
+
+FUNCT3_ORDER = [rv32m.MUL, rv32m.MULH, rv32m.MULHSU, rv32m.MULHU, rv32m.DIV, rv32m.DIVU, rv32m.REM, rv32m.REMU]
+
+class TestRv32m(unittest.TestCase):
+    def test_execute(self):
+        for fixedint in (False, True):
+            for cls, rs1, rs2, rd in CASES:
+                state = cpu.CpuState(fixedint)
+                state.int_reg[1] = rs1
+                state.int_reg[2] = rs2
+                op = cls(3, 1, 2)
+                op.execute(state, None)
+                self.assertEqual(rd, state.int_reg[3], f"{op} 0x{rs1:08x} 0x{rs2:08x}")
+
+    def test_block_engine(self):
+        for cls, rs1, rs2, rd in CASES:
+            emulator = emu.Emulator("block")
+            # op x3, x1, x2, then j .
+            funct3 = FUNCT3_ORDER.index(cls)
+            load_words(emulator, [0x0200_0000 | 2 << 20 | 1 << 15 | funct3 << 12 | 3 << 7 | 0b0110011, 0x0000_006f])
+            state = emulator.processor.cpuState
+            state.int_reg[1] = rs1
+            state.int_reg[2] = rs2
+            emulator.blockEngine.execute_blocks(2)
+            self.assertEqual(rd, state.int_reg[3], f"{cls.__name__} 0x{rs1:08x} 0x{rs2:08x}")
+
+    def test_decode(self):
+        # mul a0, a1, a2 and remu t0, t1, t2
+        self.assertEqual("mul a0,a1,a2", str(emu.decode(0x02c5_8533)))
+        self.assertEqual("remu t0,t1,t2", str(emu.decode(0x0273_72b3)))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
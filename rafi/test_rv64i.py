@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import cpu
+from . import emu
+from . import rv
+from . import rv64i
+from .test_emu import load_words
+import unittest
+
+# auipc sp,2; addi a0,zero,-1; srli a1,a0,32; addiw a2,a1,1; slli a3,a1,31; sd a0,8(sp); sw a3,8(sp)
+# lwu a4,8(sp); lw a5,8(sp); ld a6,8(sp); addw a7,a3,a1; sraiw s2,a3,4; lui s4,0x80000
+# bltu a1,a0,1f; addi s3,zero,1; 1: j .
+RV64_PROGRAM = [
+    0x0000_2117, 0xfff0_0513, 0x0205_5593, 0x0015_861b, 0x01f5_9693, 0x00a1_3423, 0x00d1_2423, 0x0081_6703,
+    0x0081_2783, 0x0081_3803, 0x00b6_88bb, 0x4046_d91b, 0x8000_0a37, 0x00a5_e463, 0x0010_0993, 0x0000_006f,
+]
+
+# Expected registers after RV64_PROGRAM, keyed by index.
+RV64_RESULT = {
+    10: 0xffff_ffff_ffff_ffff,
+    11: 0x0000_0000_ffff_ffff,
+    12: 0,
+    13: 0x7fff_ffff_8000_0000,
+    14: 0x0000_0000_8000_0000,
+    15: 0xffff_ffff_8000_0000,
+    16: 0xffff_ffff_8000_0000,
+    17: 0x0000_0000_7fff_ffff,
+    18: 0xffff_ffff_f800_0000,
+    19: 0,
+    20: 0xffff_ffff_8000_0000,
+}
+
+# (op, rs1, rs2, rd) of the *W ops, which sign-extend their 32-bit result.
+CASES = [
+    (rv64i.ADDW, 0x0000_0000_7fff_ffff, 0x0000_0000_0000_0001, 0xffff_ffff_8000_0000),
+    (rv64i.ADDW, 0x1234_5678_0000_0001, 0xffff_ffff_ffff_ffff, 0x0000_0000_0000_0000),
+    (rv64i.SUBW, 0x0000_0000_0000_0000, 0x0000_0000_0000_0001, 0xffff_ffff_ffff_ffff),
+    (rv64i.SLLW, 0x0000_0000_0000_0001, 0x0000_0000_0000_003f, 0xffff_ffff_8000_0000),
+    (rv64i.SRLW, 0xffff_ffff_8000_0000, 0x0000_0000_0000_0000, 0xffff_ffff_8000_0000),
+    (rv64i.SRLW, 0xffff_ffff_8000_0000, 0x0000_0000_0000_0001, 0x0000_0000_4000_0000),
+    (rv64i.SRAW, 0x0000_0000_8000_0000, 0x0000_0000_0000_0004, 0xffff_ffff_f800_0000),
+    (rv64i.SLL,  0x0000_0000_0000_0001, 0x0000_0000_0000_003f, 0x8000_0000_0000_0000),
+    (rv64i.SRA,  0x8000_0000_0000_0000, 0x0000_0000_0000_003f, 0xffff_ffff_ffff_ffff),
+    (rv64i.SLT,  0xffff_ffff_ffff_ffff, 0x0000_0000_0000_0000, 0x0000_0000_0000_0001),
+]
+
+class TestDecodeRv64(unittest.TestCase):
+    def test_decode(self):
+        cases = [
+            (0x0081_3803, "ld a6,8(sp)"),
+            (0x00a1_3423, "sd a0,8(sp)"),
+            (0x0081_6703, "lwu a4,8(sp)"),
+            (0x0015_861b, "addiw a2,a1,1"),
+            (0x4046_d91b, "sraiw s2,a3,0x4"),
+            (0x03f5_1513, "slli a0,a0,0x3f"),
+            (0xfff0_0513, "addi a0,zero,18446744073709551615"),
+        ]
+        for insn, expected in cases:
+            self.assertEqual(expected, str(emu.decode_rv64(insn)), hex(insn))
+
+    def test_not_rv64(self):
+        # The 6-bit shift amount is reserved in RV32, and compressed and M ops are not decoded for RV64.
+        with self.assertRaisesRegex(Exception, "decode"):
+            emu.decode(0x03f5_1513)
+        for insn in (0x0000_4501, 0x02c5_8533):
+            with self.assertRaisesRegex(Exception, "decode"):
+                emu.decode_rv64(insn)
+
+class TestRv64(unittest.TestCase):
+    def test_execute(self):
+        for fixedint in (False, True):
+            for cls, rs1, rs2, rd in CASES:
+                state = cpu.CpuState(fixedint, 64)
+                state.int_reg[1] = rs1
+                state.int_reg[2] = rs2
+                op = cls(3, 1, 2)
+                op.execute(state, None)
+                self.assertEqual(rd, state.int_reg[3], f"{op} 0x{rs1:016x} 0x{rs2:016x}")
+
+    def run_program(self, engine, fixedint=False, base=0x8000_0000):
+        emulator = emu.Emulator(engine, fixedint, memory_size=0x4000, memory_base=base, xlen=64)
+        load_words(emulator, RV64_PROGRAM, base)
+        state = emulator.processor.cpuState
+        state.pc = base
+        emulator.step(200)
+        self.assertEqual(base + 0x3c, state.pc)
+        self.assertEqual(RV64_RESULT, {i: state.int_reg[i] for i in RV64_RESULT}, engine)
+        self.assertEqual(0xffff_ffff_8000_0000, emulator.bus.read_uint64(base + 0x2008))
+
+    def test_program(self):
+        for engine in emu.Emulator.ENGINES:
+            self.run_program(engine)
+        self.run_program("interpreter", fixedint=True)
+
+    def test_wide_address(self):
+        # Code and data above 4 GiB.
+        for engine in emu.Emulator.ENGINES:
+            self.run_program(engine, base=0x12_3456_0000)
+
+    def test_counters(self):
+        state = cpu.CpuState(xlen=64)
+        state.get_count = lambda: 0x1_0000_0005
+        self.assertEqual(0x1_0000_0005, state.read_csr(rv.CsrAddr.MCYCLE.value))
+        state.write_csr(rv.CsrAddr.MINSTRET.value, 0x2_0000_0000)
+        self.assertEqual(0x2_0000_0000, state.read_csr(rv.CsrAddr.INSTRET.value))
+        # The high halves are plain CSRs in RV64.
+        self.assertEqual(0, state.read_csr(rv.CsrAddr.MCYCLEH.value))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
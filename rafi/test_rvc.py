@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import emu
+from . import rv
+from .test_emu import load_words
+import unittest
+
+# Sums 5..1 into a1 with compressed ops, then runs a 32-bit addi at a halfword boundary:
+#   c.li a0,5; c.li a1,0; loop: c.add a1,a0; c.addi a0,-1; c.bnez a0,loop
+#   addi a2,a1,1; c.swsp a2,12(sp); c.lwsp a3,12(sp); c.j .
+RVC_PROGRAM = [0x4581_4515, 0x157d_95aa, 0x8613_fd75, 0xc632_0015, 0xa001_46b2]
+
+class TestDecodeCompressed(unittest.TestCase):
+    def test_expand(self):
+        cases = [
+            (0x1141, "addi sp,sp,4294967280"),
+            (0xc606, "sw ra,12(sp)"),
+            (0x46b2, "lw a3,12(sp)"),
+            (0x450d, "addi a0,zero,3"),
+            (0x95aa, "add a1,a1,a0"),
+            (0x8082, "jalr zero,0"),
+            (0xa001, "jal zero,0"),
+        ]
+        for insn, expected in cases:
+            # The upper halfword belongs to the next instruction and must be ignored.
+            op = emu.decode(0xabcd_0000 | insn)
+            self.assertEqual(expected, str(op), hex(insn))
+            self.assertEqual(2, op.size)
+            self.assertEqual(vars(op), vars(emu.decode_reference(insn)))
+        self.assertEqual(4, emu.decode(0x0015_8613).size)
+
+    def test_same_as_reference(self):
+        # decode_reference expands every encoding to its 32-bit instruction instead of building the op directly.
+        for insn in range(0x10000):
+            if insn & 0x3 == 0x3:
+                continue
+            try:
+                expected = emu.decode_reference(insn)
+            except Exception:
+                with self.assertRaisesRegex(Exception, "decode"):
+                    emu.decode(insn)
+                continue
+            actual = emu.decode(insn)
+            self.assertIs(type(expected), type(actual), hex(insn))
+            self.assertEqual(vars(expected), vars(actual), hex(insn))
+
+    def test_expand_reference(self):
+        cases = [
+            (0x1141, 0xff01_0113),  # addi sp,sp,-16
+            (0xc606, 0x0011_2623),  # sw ra,12(sp)
+            (0x46b2, 0x00c1_2683),  # lw a3,12(sp)
+            (0x8d89, 0x40a5_85b3),  # sub a1,a1,a0
+            (0x9002, 0x0010_0073),  # ebreak
+            (0xfd65, 0xfe05_1ce3),  # bnez a0,-8
+        ]
+        for insn, expected in cases:
+            self.assertEqual(hex(expected), hex(emu.expand_compressed(insn)), hex(insn))
+
+    def test_reserved(self):
+        # c.unimp, c.lui with a zero immediate, RV64 shift amount and c.flw.
+        for insn in (0x0000, 0x6501, 0x1502, 0x6108):
+            with self.assertRaisesRegex(Exception, "decode"):
+                emu.decode(insn)
+
+class TestCompressed(unittest.TestCase):
+    def test_run(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine)
+            load_words(emulator, RVC_PROGRAM)
+            state = emulator.processor.cpuState
+            state.int_reg[2] = 0x8000_1000
+            emulator.step(200)
+            self.assertEqual(0x8000_0012, state.pc, engine)
+            self.assertEqual([15, 16, 16], [state.int_reg[i] for i in (11, 12, 13)], engine)
+            self.assertEqual(16, emulator.bus.read_uint32(0x8000_100c), engine)
+
+    def test_jr_odd_target(self):
+        for engine in emu.Emulator.ENGINES:
+            # lui a0,0x80000; addi a0,a0,13; c.jr a0; c.li a1,1; c.li a1,5; c.j .
+            # jalr clears the lowest bit of the target, so c.jr goes to 0x8000_000c.
+            emulator = emu.Emulator(engine)
+            load_words(emulator, [0x8000_0537, 0x00d5_0513, 0x4585_8502, 0xa001_4595])
+            emulator.step(200)
+            state = emulator.processor.cpuState
+            self.assertEqual(0x8000_000e, state.pc, engine)
+            self.assertEqual(5, state.int_reg[11], engine)
+
+    def test_end_of_memory(self):
+        for engine in emu.Emulator.ENGINES:
+            # c.li a0,7; c.j . in the last word, so the jump can't be fetched as 32 bits.
+            emulator = emu.Emulator(engine, memory_size=0x1000)
+            load_words(emulator, [0xa001_451d], 0x8000_0ffc)
+            state = emulator.processor.cpuState
+            state.pc = 0x8000_0ffc
+            self.assertEqual(200, emulator.step(200))
+            self.assertEqual(0x8000_0ffe, state.pc, engine)
+            self.assertEqual(7, state.int_reg[10], engine)
+
+    def test_straddling_fetch_fault(self):
+        for engine in emu.Emulator.ENGINES:
+            # c.nop, then the first half of a 32-bit addi in the last halfword of memory.
+            emulator = emu.Emulator(engine, memory_size=0x1000)
+            load_words(emulator, [0xa001], 0x8000_0000)
+            load_words(emulator, [0x0013_0001], 0x8000_0ffc)
+            state = emulator.processor.cpuState
+            state.pc = 0x8000_0ffc
+            state.csr[rv.CsrAddr.MTVEC.value] = 0x8000_0000
+            emulator.step(200)
+            self.assertEqual(0x8000_0000, state.pc, engine)
+            self.assertEqual([1, 0x8000_0ffe, 0x8000_1000],
+                [state.csr[csr.value] for csr in (rv.CsrAddr.MCAUSE, rv.CsrAddr.MEPC, rv.CsrAddr.MTVAL)], engine)
+
+    def test_invalidate_on_write(self):
+        emulator = emu.Emulator("block")
+        load_words(emulator, RVC_PROGRAM)
+        emulator.processor.cpuState.int_reg[2] = 0x8000_1000
+        emulator.step(200)
+        engine = emulator.blockEngine
+        # The loop block covers 0x8000_0004..0x8000_0009, so a write to the c.bnez drops it.
+        self.assertEqual(6, engine.blocks[0x8000_0004].size)
+        emulator.bus.write_uint16(0x8000_0008, 0xfd75)
+        self.assertNotIn(0x8000_0004, engine.blocks)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
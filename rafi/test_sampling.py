@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import emu
+from . import sampling
+from .test_emu import SUM_PROGRAM, load_words
+from .test_rv64i import RV64_PROGRAM
+import unittest
+
+class TestSampling(unittest.TestCase):
+    def run_sampled(self, engine, intervals):
+        emulator = emu.Emulator(engine)
+        load_words(emulator, SUM_PROGRAM)
+        stats = emulator.run_sampled(1000, intervals)
+        self.assertEqual(1, emulator.host_io_value)
+        return emulator, [interval.to_dict() for interval in stats]
+
+    def test_intervals(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator, stats = self.run_sampled(engine, [(0, 5), (12, 100)])
+            self.assertEqual([0, 12], [interval['start'] for interval in stats])
+
+            # li a0, 5; li a1, 0; then the loop body: add, addi and a taken bne.
+            self.assertEqual({'ADDI': 3, 'ADD': 1, 'BNE': 1}, stats[0]['op_counts'])
+            self.assertEqual(1, stats[0]['taken'])
+
+            # The rest of the loop, then the store to tohost ends the run.
+            self.assertEqual(emulator.cycle - 12, stats[1]['count'])
+            self.assertEqual((0, 1, 4), (stats[1]['loads'], stats[1]['stores'], stats[1]['store_bytes']))
+            self.assertEqual(1, stats[1]['data_lines'])
+
+    def test_same_result_as_run(self):
+        expected = emu.Emulator()
+        load_words(expected, SUM_PROGRAM)
+        expected.run(1000)
+
+        emulator, _ = self.run_sampled("block", sampling.periodic_intervals(4, 2, 1000))
+        self.assertEqual(expected.cycle, emulator.cycle)
+        self.assertEqual([expected.processor.cpuState.int_reg[i] for i in range(32)], [emulator.processor.cpuState.int_reg[i] for i in range(32)])
+
+    def test_rv64(self):
+        base = 0x12_3456_0000
+        emulator = emu.Emulator(memory_size=0x4000, memory_base=base, xlen=64)
+        load_words(emulator, RV64_PROGRAM, base)
+        emulator.processor.cpuState.pc = base
+        stats = emulator.run_sampled(20, [(0, 20)])[0]
+        # sd, sw, lwu, lw and ld all access the line at base + 0x2000.
+        self.assertEqual((3, 2, 16, 12), (stats.loads, stats.stores, stats.load_bytes, stats.store_bytes))
+        self.assertEqual({(base + 0x2000) >> sampling.LINE_SHIFT}, stats.data_lines)
+
+    def test_periodic_intervals(self):
+        self.assertEqual([(0, 3), (10, 3), (20, 2)], sampling.periodic_intervals(10, 3, 22))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import emu
+from . import mem
+from . import rv
+from . import smp
+from .test_emu import load_words
+import multiprocessing
+import os
+import unittest
+import unittest.mock
+
+# Each hart stores hartid + 1 to the word at 0x8000_2000 + hartid * 4 and parks, except hart 0, which waits
+# for the words of harts 1 and 2, adds them to a1 and writes 1 to tohost.
+SMP_PROGRAM = [
+    0xf140_2573, 0x8000_22b7, 0x0025_1313, 0x0062_8333, 0x0015_0393, 0x0073_2023, 0x0205_1263, 0x0042_ae03,
+    0xfe0e_0ee3, 0x0082_ae83, 0xfe0e_8ae3, 0x01de_05b3, 0x0010_0f13, 0x8000_1fb7, 0x01ef_a023, 0x0000_006f,
+]
+
+def exit_hart(config, hartid, max_cycle, results):
+    # Like a process killed by a signal, it sends no result.
+    os._exit(3)
+
+class TestHarts(unittest.TestCase):
+    def test_run(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine, harts=3, quantum=100)
+            load_words(emulator, SMP_PROGRAM)
+            emulator.run(10000)
+            self.assertEqual(1, emulator.host_io_value)
+            self.assertEqual([0, 1, 2], [processor.cpuState.int_reg[10] for processor in emulator.processors])
+            self.assertEqual(5, emulator.processor.cpuState.int_reg[11])
+            self.assertIs(emulator.processors[0], emulator.processor)
+
+    def test_quantum(self):
+        emulator = emu.Emulator(harts=2, quantum=4)
+        load_words(emulator, SMP_PROGRAM)
+        self.assertEqual(10, emulator.step(10))
+        self.assertEqual(10, emulator.cycle)
+        # Both harts have stored their word.
+        self.assertEqual([1, 2], [emulator.bus.read_uint32(0x8000_2000), emulator.bus.read_uint32(0x8000_2004)])
+        # Counters are shared, so each hart reads the same count at the same point of its execution.
+        for processor in emulator.processors:
+            self.assertEqual(10, processor.cpuState.read_csr(rv.CsrAddr.MINSTRET.value))
+            self.assertEqual(processor.hartid, processor.cpuState.read_csr(rv.CsrAddr.MHARTID.value))
+
+    def test_reset(self):
+        emulator = emu.Emulator(harts=2)
+        emulator.reset()
+        self.assertEqual(1, emulator.processors[1].cpuState.read_csr(rv.CsrAddr.MHARTID.value))
+        with self.assertRaisesRegex(ValueError, "harts"):
+            emu.Emulator(harts=0)
+
+class TestProcesses(unittest.TestCase):
+    def setUp(self):
+        self.memory = mem.SharedMemory(0x4000)
+        self.addCleanup(self.memory.unlink)
+        self.addCleanup(self.memory.close)
+
+    def test_run(self):
+        for engine in emu.Emulator.ENGINES:
+            emulator = emu.Emulator(engine, memory=self.memory)
+            self.memory.write_uint32(0x8000_1000, 0)
+            load_words(emulator, SMP_PROGRAM)
+            results = smp.run_processes(emulator, 3, 100000, quantum=100)
+            self.assertEqual(1, emulator.host_io_value)
+            self.assertEqual([0, 1, 2], [result.hartid for result in results])
+            self.assertEqual([0, 1, 2], [result.int_reg[10] for result in results])
+            self.assertEqual(5, emulator.processor.cpuState.int_reg[11])
+            self.assertEqual(results[0].cycle, emulator.cycle)
+
+    def test_state(self):
+        # csrr a0, mscratch; csrr a1, minstret; j .
+        emulator = emu.Emulator(memory=self.memory)
+        load_words(emulator, [0x3400_2573, 0xb020_25f3, 0x0000_006f])
+        state = emulator.processor.cpuState
+        state.write_csr(rv.CsrAddr.MSCRATCH.value, 0x1234)
+        state.write_csr(rv.CsrAddr.MINSTRET.value, 100)
+        state.int_reg[12] = 7
+        results = smp.run_processes(emulator, 2, 10)
+        for result in results:
+            self.assertEqual([0x1234, 101, 7], [result.int_reg[i] for i in (10, 11, 12)])
+            self.assertEqual(result.hartid, result.csr[rv.CsrAddr.MHARTID.value])
+        self.assertEqual(0x1234, state.read_csr(rv.CsrAddr.MSCRATCH.value))
+        self.assertEqual(110, state.read_csr(rv.CsrAddr.MINSTRET.value))
+
+    def test_setup_error(self):
+        emulator = emu.Emulator(memory=self.memory)
+        state = emulator.processor.cpuState
+        config = (emulator.engine, state.fixedint, state.xlen, 100, "no-such-memory", self.memory.size, self.memory.base,
+            state.pc, state.int_reg.snapshot(), state.csr.snapshot(), state.counter_offsets, emulator.host_io_addr, 5)
+        results = multiprocessing.Queue()
+        smp.run_hart(config, 1, 10, results)
+        result = results.get(timeout=10)
+        self.assertEqual((1, 5), (result.hartid, result.cycle))
+        self.assertIsNotNone(result.message)
+
+    def test_process_exit(self):
+        emulator = emu.Emulator(memory=self.memory)
+        load_words(emulator, SMP_PROGRAM)
+        with unittest.mock.patch.object(smp, 'run_hart', exit_hart), unittest.mock.patch.object(smp, 'RESULT_POLL_SECONDS', 0.1):
+            with self.assertRaisesRegex(Exception, "exited with code 3"):
+                smp.run_processes(emulator, 2, 100)
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(Exception, "SharedMemory"):
+            smp.run_processes(emu.Emulator(), 2, 100)
+        with self.assertRaisesRegex(Exception, "harts"):
+            smp.run_processes(emu.Emulator(harts=2, memory=self.memory), 2, 100)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import emu
+from . import trace
+from .test_emu import SUM_PROGRAM, load_words
+from .test_rv64i import RV64_PROGRAM
+import importlib.util
+import os
+import tempfile
+import unittest
+
+ATOMIC_PROGRAM = [
+    0x8000_02b7, # lui t0, 0x80000
+    0x1002_8293, # addi t0, t0, 0x100
+    0x0030_0593, # li a1, 3
+    0x00b2_a52f, # amoadd.w a0, a1, (t0)
+    0x1002_a52f, # lr.w a0, (t0)
+    0x18b2_a52f, # sc.w a0, a1, (t0)
+    0x18b2_a52f, # sc.w a0, a1, (t0) fails without a reservation
+]
+
+class TestTrace(unittest.TestCase):
+    def make_path(self, suffix):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_round_trip(self):
+        suffixes = ['.trc', '.trc.gz']
+        if importlib.util.find_spec('zstandard') is not None:
+            suffixes.append('.trc.zst')
+        # More than one batch, so the last one is partial.
+        count = trace.BATCH_RECORDS * 2 + 3
+        for suffix in suffixes:
+            path = self.make_path(suffix)
+            with trace.TraceWriter(path) as writer:
+                for i in range(count):
+                    writer.write(0x8000_0000 + i * 4, i, trace.FLAG_RD, i % 32, 0, i * 3)
+            records = list(trace.read(path))
+            self.assertEqual(count, len(records))
+            self.assertEqual(trace.TraceRecord(0x8000_0000 + 4 * 100, 100, trace.FLAG_RD, 4, 0, 300, 0, 0), records[100])
+
+    def test_truncated(self):
+        path = self.make_path('.trc')
+        with trace.TraceWriter(path) as writer:
+            writer.write(0x8000_0000, 0x13)
+        with open(path, 'r+b') as f:
+            f.truncate(trace.HEADER.size + trace.RECORD.size - 1)
+        with self.assertRaisesRegex(Exception, "truncated"):
+            list(trace.read(path))
+
+    def test_emulator(self):
+        path = self.make_path('.trc')
+        emulator = emu.Emulator()
+        load_words(emulator, SUM_PROGRAM)
+        with trace.TraceWriter(path) as writer:
+            emulator.trace_writer = writer
+            emulator.run(1000)
+        records = list(trace.read(path))
+        self.assertEqual(emulator.cycle, len(records))
+
+        # li a0, 5
+        self.assertEqual(trace.TraceRecord(0x8000_0000, SUM_PROGRAM[0], trace.FLAG_RD, 10, 0, 5, 0, 0), records[0])
+        # bne a0, zero, loop
+        self.assertEqual(trace.TraceRecord(0x8000_0010, SUM_PROGRAM[4], 0, 0, 0, 0, 0, 0), records[4])
+        # sw t1, 0(t2) to tohost
+        self.assertEqual(trace.TraceRecord(0x8000_0028, SUM_PROGRAM[10], trace.FLAG_STORE, 0, 4, 0, 0x8000_1000, 1), records[-1])
+
+    def test_trap(self):
+        path = self.make_path('.trc')
+        emulator = emu.Emulator()
+        # lw a0, 0(zero) faults, as address 0 is outside memory.
+        load_words(emulator, [0x0000_2503])
+        with trace.TraceWriter(path) as writer:
+            emulator.trace_writer = writer
+            emulator.step(1)
+        self.assertEqual([trace.TraceRecord(0x8000_0000, 0x0000_2503, trace.FLAG_TRAP, 0, 0, 0, 0, 0)], list(trace.read(path)))
+
+    def test_atomic(self):
+        emulator = emu.Emulator()
+        load_words(emulator, ATOMIC_PROGRAM)
+        records = list(emulator.trace_records(len(ATOMIC_PROGRAM)))
+        addr = 0x8000_0100
+        flags = trace.FLAG_RD | trace.FLAG_LOAD | trace.FLAG_STORE
+        self.assertEqual(trace.TraceRecord(0x8000_000c, ATOMIC_PROGRAM[3], flags, 10, 4, 0, addr, 3), records[3])
+        self.assertEqual(trace.TraceRecord(0x8000_0010, ATOMIC_PROGRAM[4], trace.FLAG_RD | trace.FLAG_LOAD, 10, 4, 3, addr, 3), records[4])
+        self.assertEqual(trace.TraceRecord(0x8000_0014, ATOMIC_PROGRAM[5], trace.FLAG_RD | trace.FLAG_STORE, 10, 4, 0, addr, 3), records[5])
+        self.assertEqual(trace.TraceRecord(0x8000_0018, ATOMIC_PROGRAM[6], trace.FLAG_RD, 10, 0, 1, 0, 0), records[6])
+
+    def test_rv64(self):
+        path = self.make_path('.trc')
+        base = 0x12_3456_0000
+        emulator = emu.Emulator(memory_size=0x4000, memory_base=base, xlen=64)
+        load_words(emulator, RV64_PROGRAM, base)
+        emulator.processor.cpuState.pc = base
+        with trace.TraceWriter(path) as writer:
+            emulator.trace_writer = writer
+            emulator.step(len(RV64_PROGRAM))
+        records = list(trace.read(path))
+
+        # addi a0, zero, -1
+        self.assertEqual(trace.TraceRecord(base + 0x4, RV64_PROGRAM[1], trace.FLAG_RD, 10, 0, 0xffff_ffff_ffff_ffff, 0, 0), records[1])
+        # sd a0, 8(sp)
+        self.assertEqual(trace.TraceRecord(base + 0x14, RV64_PROGRAM[5], trace.FLAG_STORE, 0, 8, 0, base + 0x2008, 0xffff_ffff_ffff_ffff), records[5])
+        # ld a6, 8(sp)
+        value = 0xffff_ffff_8000_0000
+        self.assertEqual(trace.TraceRecord(base + 0x24, RV64_PROGRAM[9], trace.FLAG_RD | trace.FLAG_LOAD, 16, 8, value, base + 0x2008, value), records[9])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,159 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import gzip
+import struct
+from . import sampling
+
+# =============================================================================
+# Trace file format (version 2, little-endian)
+#
+#   header          magic, version, record size
+#   records         one per executed instruction, until the end of the file
+#
+# A record holds the pc and the raw instruction, the destination register and the value it has after the
+# instruction, and the address and value of the memory access. flags tells which of them are valid.
+# pc, register values and addresses take 64 bits, so RV32 and RV64 traces share the format.
+# Files named *.gz are gzip compressed and files named *.zst are zstd compressed (needs the zstandard package).
+#
+MAGIC = b'RAFITRCE'
+VERSION = 2
+
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<QIBBHQQQ')
+
+FLAG_RD = 1
+FLAG_LOAD = 2
+FLAG_STORE = 4
+FLAG_TRAP = 8
+
+# Records are packed into a buffer and written in batches of this many.
+BATCH_RECORDS = 4096
+
+TraceRecord = collections.namedtuple('TraceRecord', ['pc', 'insn', 'flags', 'rd', 'size', 'rd_value', 'mem_addr', 'mem_value'])
+
+def open_file(path, mode):
+    path = str(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    if path.endswith('.zst'):
+        import zstandard
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+def get_memory_access(op, state, bus):
+    """Return (flags, size, addr, store value) of the memory access op is about to do, or None.
+
+    The store value of an AMO is None, since it depends on the loaded value; make_record() reads it back."""
+    access = sampling.get_access(op, state, bus)
+    if access is None:
+        return None
+    load, store, addr = access
+    if store == 0:
+        return FLAG_LOAD, load, int(addr), 0
+    if load != 0:
+        return FLAG_LOAD | FLAG_STORE, store, int(addr), None
+    value = int(state.int_reg[op.rs2]) & ((1 << (store * 8)) - 1)
+    return FLAG_STORE, store, int(addr), value
+
+def make_record(pc, insn, op, state, access, trapped, bus):
+    """Return the TraceRecord of op, just executed at pc. access is what get_memory_access() returned before execution."""
+    if op.size == 2:
+        # Fetch reads 32 bits; the upper half belongs to the next instruction.
+        insn &= 0xffff
+    if trapped:
+        return TraceRecord(pc, insn, FLAG_TRAP, 0, 0, 0, 0, 0)
+
+    flags = 0
+    rd = getattr(op, 'rd', 0)
+    rd_value = 0
+    if rd != 0:
+        flags = FLAG_RD
+        rd_value = int(state.int_reg[rd])
+    if access is None:
+        return TraceRecord(pc, insn, flags, rd, 0, rd_value, 0, 0)
+
+    access_flags, size, addr, value = access
+    if access_flags == FLAG_LOAD:
+        value = rd_value & ((1 << (size * 8)) - 1)
+    elif value is None:
+        value = bus.read_uint32(addr) if size == 4 else bus.read_uint64(addr)
+    return TraceRecord(pc, insn, flags | access_flags, rd, size, rd_value, addr, value)
+
+# =============================================================================
+# Writer
+#
+class TraceWriter:
+    "Packs trace records into a buffer and writes it to a trace file in batches"
+
+    def __init__(self, path):
+        self.file = open_file(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.buffer = bytearray(RECORD.size * BATCH_RECORDS)
+        self.offset = 0
+        self.count = 0
+
+    def write(self, pc, insn, flags=0, rd=0, size=0, rd_value=0, mem_addr=0, mem_value=0):
+        RECORD.pack_into(self.buffer, self.offset, pc, insn, flags, rd, size, rd_value, mem_addr, mem_value)
+        self.offset += RECORD.size
+        self.count += 1
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.offset > 0:
+            self.file.write(memoryview(self.buffer)[:self.offset])
+            self.offset = 0
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# =============================================================================
+# Reader
+#
+def read(path):
+    """Yield the TraceRecords of a trace file, reading it in batches so memory use does not grow with its size"""
+    with open_file(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise Exception(f"'{path}' is not a trace file.")
+        magic, version, record_size = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise Exception(f"'{path}' is not a trace file.")
+        if version != VERSION or record_size != RECORD.size:
+            raise Exception(f"Trace version {version} of '{path}' is not supported (expected {VERSION}).")
+
+        batch_size = RECORD.size * BATCH_RECORDS
+        rest = b''
+        while True:
+            data = f.read(batch_size)
+            if not data:
+                break
+            if rest:
+                data = rest + data
+            end = len(data) - len(data) % RECORD.size
+            rest = data[end:]
+            yield from map(TraceRecord._make, RECORD.iter_unpack(memoryview(data)[:end]))
+        if rest:
+            raise Exception(f"'{path}' ends with a truncated record.")
@@ -0,0 +1,427 @@
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import mem
+from . import rv32i
+from . import rv32m
+from . import rv64i
+
+# =============================================================================
+# Code templates
+#
+# Guest registers live in Python locals named x1..x31 while a block runs.
+# Reads of x0 are replaced by the literal 0 and writes to x0 go to '_'.
+#
+SIGNED = "(({} ^ 0x8000_0000) - 0x8000_0000)"
+
+TEMPLATES = {
+    rv32i.LUI:      "{rd} = {imm}",
+    rv32i.AUIPC:    "{rd} = {auipc}",
+    rv32i.LB:       "{rd} = ((read_uint8(({rs1} + {imm}) & 0xffff_ffff) ^ 0x80) - 0x80) & 0xffff_ffff",
+    rv32i.LH:       "{rd} = ((read_uint16(({rs1} + {imm}) & 0xffff_ffff) ^ 0x8000) - 0x8000) & 0xffff_ffff",
+    rv32i.LW:       "{rd} = read_uint32(({rs1} + {imm}) & 0xffff_ffff)",
+    rv32i.LBU:      "{rd} = read_uint8(({rs1} + {imm}) & 0xffff_ffff)",
+    rv32i.LHU:      "{rd} = read_uint16(({rs1} + {imm}) & 0xffff_ffff)",
+    rv32i.SB:       "write_uint8(({rs1} + {imm}) & 0xffff_ffff, {rs2} & 0xff)",
+    rv32i.SH:       "write_uint16(({rs1} + {imm}) & 0xffff_ffff, {rs2} & 0xffff)",
+    rv32i.SW:       "write_uint32(({rs1} + {imm}) & 0xffff_ffff, {rs2})",
+    rv32i.ADDI:     "{rd} = ({rs1} + {imm}) & 0xffff_ffff",
+    rv32i.SLTI:     "{rd} = 1 if " + SIGNED.format("{rs1}") + " < {simm} else 0",
+    rv32i.SLTIU:    "{rd} = 1 if {rs1} < {imm} else 0",
+    rv32i.XORI:     "{rd} = {rs1} ^ {imm}",
+    rv32i.ORI:      "{rd} = {rs1} | {imm}",
+    rv32i.ANDI:     "{rd} = {rs1} & {imm}",
+    rv32i.SLLI:     "{rd} = ({rs1} << {shamt}) & 0xffff_ffff",
+    rv32i.SRLI:     "{rd} = {rs1} >> {shamt}",
+    rv32i.SRAI:     "{rd} = (" + SIGNED.format("{rs1}") + " >> {shamt}) & 0xffff_ffff",
+    rv32i.ADD:      "{rd} = ({rs1} + {rs2}) & 0xffff_ffff",
+    rv32i.SUB:      "{rd} = ({rs1} - {rs2}) & 0xffff_ffff",
+    rv32i.SLL:      "{rd} = ({rs1} << ({rs2} & 0x1f)) & 0xffff_ffff",
+    rv32i.SLT:      "{rd} = 1 if " + SIGNED.format("{rs1}") + " < " + SIGNED.format("{rs2}") + " else 0",
+    rv32i.SLTU:     "{rd} = 1 if {rs1} < {rs2} else 0",
+    rv32i.XOR:      "{rd} = {rs1} ^ {rs2}",
+    rv32i.SRL:      "{rd} = {rs1} >> ({rs2} & 0x1f)",
+    rv32i.SRA:      "{rd} = (" + SIGNED.format("{rs1}") + " >> ({rs2} & 0x1f)) & 0xffff_ffff",
+    rv32i.OR:       "{rd} = {rs1} | {rs2}",
+    rv32i.AND:      "{rd} = {rs1} & {rs2}",
+    rv32i.FENCE:    "pass",
+    rv32m.MUL:      "{rd} = ({rs1} * {rs2}) & 0xffff_ffff",
+    rv32m.MULH:     "{rd} = ((" + SIGNED.format("{rs1}") + " * " + SIGNED.format("{rs2}") + ") >> 32) & 0xffff_ffff",
+    rv32m.MULHSU:   "{rd} = ((" + SIGNED.format("{rs1}") + " * {rs2}) >> 32) & 0xffff_ffff",
+    rv32m.MULHU:    "{rd} = ({rs1} * {rs2}) >> 32",
+    rv32m.DIV:      "{rd} = div({rs1}, {rs2})",
+    rv32m.DIVU:     "{rd} = {rs1} // {rs2} if {rs2} != 0 else 0xffff_ffff",
+    rv32m.REM:      "{rd} = rem({rs1}, {rs2})",
+    rv32m.REMU:     "{rd} = {rs1} % {rs2} if {rs2} != 0 else {rs1}",
+}
+
+SIGNED64 = "(({} ^ 0x8000_0000_0000_0000) - 0x8000_0000_0000_0000)"
+# Sign-extends the lower 32 bits to 64, for the *W ops.
+WORD64 = "(((({}) & 0xffff_ffff) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff"
+
+# RV64I ops, besides the rv32i ones which the RV64 decoder shares (their immediates are formatted at 64 bits).
+TEMPLATES.update({
+    rv64i.AUIPC:    "{rd} = {auipc}",
+    rv64i.LB:       "{rd} = ((read_uint8(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff) ^ 0x80) - 0x80) & 0xffff_ffff_ffff_ffff",
+    rv64i.LH:       "{rd} = ((read_uint16(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff) ^ 0x8000) - 0x8000) & 0xffff_ffff_ffff_ffff",
+    rv64i.LW:       "{rd} = ((read_uint32(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff) ^ 0x8000_0000) - 0x8000_0000) & 0xffff_ffff_ffff_ffff",
+    rv64i.LD:       "{rd} = read_uint64(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff)",
+    rv64i.LBU:      "{rd} = read_uint8(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff)",
+    rv64i.LHU:      "{rd} = read_uint16(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff)",
+    rv64i.LWU:      "{rd} = read_uint32(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff)",
+    rv64i.SB:       "write_uint8(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff, {rs2} & 0xff)",
+    rv64i.SH:       "write_uint16(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff, {rs2} & 0xffff)",
+    rv64i.SW:       "write_uint32(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff, {rs2} & 0xffff_ffff)",
+    rv64i.SD:       "write_uint64(({rs1} + {imm}) & 0xffff_ffff_ffff_ffff, {rs2})",
+    rv64i.ADDI:     "{rd} = ({rs1} + {imm}) & 0xffff_ffff_ffff_ffff",
+    rv64i.SLTI:     "{rd} = 1 if " + SIGNED64.format("{rs1}") + " < {simm} else 0",
+    rv64i.SLLI:     "{rd} = ({rs1} << {shamt}) & 0xffff_ffff_ffff_ffff",
+    rv64i.SRAI:     "{rd} = (" + SIGNED64.format("{rs1}") + " >> {shamt}) & 0xffff_ffff_ffff_ffff",
+    rv64i.ADD:      "{rd} = ({rs1} + {rs2}) & 0xffff_ffff_ffff_ffff",
+    rv64i.SUB:      "{rd} = ({rs1} - {rs2}) & 0xffff_ffff_ffff_ffff",
+    rv64i.SLL:      "{rd} = ({rs1} << ({rs2} & 0x3f)) & 0xffff_ffff_ffff_ffff",
+    rv64i.SLT:      "{rd} = 1 if " + SIGNED64.format("{rs1}") + " < " + SIGNED64.format("{rs2}") + " else 0",
+    rv64i.SRL:      "{rd} = {rs1} >> ({rs2} & 0x3f)",
+    rv64i.SRA:      "{rd} = (" + SIGNED64.format("{rs1}") + " >> ({rs2} & 0x3f)) & 0xffff_ffff_ffff_ffff",
+    rv64i.ADDIW:    "{rd} = " + WORD64.format("{rs1} + {imm}"),
+    rv64i.SLLIW:    "{rd} = " + WORD64.format("{rs1} << {shamt}"),
+    rv64i.SRLIW:    "{rd} = " + WORD64.format("({rs1} & 0xffff_ffff) >> {shamt}"),
+    rv64i.SRAIW:    "{rd} = (" + SIGNED.format("({rs1} & 0xffff_ffff)") + " >> {shamt}) & 0xffff_ffff_ffff_ffff",
+    rv64i.ADDW:     "{rd} = " + WORD64.format("{rs1} + {rs2}"),
+    rv64i.SUBW:     "{rd} = " + WORD64.format("{rs1} - {rs2}"),
+    rv64i.SLLW:     "{rd} = " + WORD64.format("{rs1} << ({rs2} & 0x1f)"),
+    rv64i.SRLW:     "{rd} = " + WORD64.format("({rs1} & 0xffff_ffff) >> ({rs2} & 0x1f)"),
+    rv64i.SRAW:     "{rd} = (" + SIGNED.format("({rs1} & 0xffff_ffff)") + " >> ({rs2} & 0x1f)) & 0xffff_ffff_ffff_ffff",
+})
+
+# Control transfer ops end a block; their template assigns the local 'pc'.
+BRANCH_TEMPLATES = {
+    rv32i.JAL:      "{rd} = {next}\npc = {target}",
+    rv32i.JALR:     "pc = ({rs1} + {imm}) & 0xffff_fffe\n{rd} = {next}",
+    rv32i.BEQ:      "pc = {target} if {rs1} == {rs2} else {next}",
+    rv32i.BNE:      "pc = {target} if {rs1} != {rs2} else {next}",
+    rv32i.BLT:      "pc = {target} if " + SIGNED.format("{rs1}") + " < " + SIGNED.format("{rs2}") + " else {next}",
+    rv32i.BGE:      "pc = {target} if " + SIGNED.format("{rs1}") + " >= " + SIGNED.format("{rs2}") + " else {next}",
+    rv32i.BLTU:     "pc = {target} if {rs1} < {rs2} else {next}",
+    rv32i.BGEU:     "pc = {target} if {rs1} >= {rs2} else {next}",
+    rv64i.JAL:      "{rd} = {next}\npc = {target}",
+    rv64i.JALR:     "pc = ({rs1} + {imm}) & 0xffff_ffff_ffff_fffe\n{rd} = {next}",
+    rv64i.BEQ:      "pc = {target} if {rs1} == {rs2} else {next}",
+    rv64i.BNE:      "pc = {target} if {rs1} != {rs2} else {next}",
+    rv64i.BLT:      "pc = {target} if " + SIGNED64.format("{rs1}") + " < " + SIGNED64.format("{rs2}") + " else {next}",
+    rv64i.BGE:      "pc = {target} if " + SIGNED64.format("{rs1}") + " >= " + SIGNED64.format("{rs2}") + " else {next}",
+    rv64i.BLTU:     "pc = {target} if {rs1} < {rs2} else {next}",
+    rv64i.BGEU:     "pc = {target} if {rs1} >= {rs2} else {next}",
+}
+
+# Ops which may raise mem.MemoryAccessError in the middle of a block.
+MEMORY_OPS = {
+    rv32i.LB, rv32i.LH, rv32i.LW, rv32i.LBU, rv32i.LHU, rv32i.SB, rv32i.SH, rv32i.SW,
+    rv64i.LB, rv64i.LH, rv64i.LW, rv64i.LD, rv64i.LBU, rv64i.LHU, rv64i.LWU, rv64i.SB, rv64i.SH, rv64i.SW, rv64i.SD,
+}
+
+# Ops which may rewrite the code of the block running them.
+STORE_OPS = {
+    rv32i.SB, rv32i.SH, rv32i.SW,
+    rv64i.SB, rv64i.SH, rv64i.SW, rv64i.SD,
+}
+
+def reg_name(index):
+    return f"x{index}" if index != 0 else "0"
+
+def dest_name(index):
+    return f"x{index}" if index != 0 else "_"
+
+def format_op(template, op, pc, mask=0xffff_ffff):
+    """Fill a template with the fields of op, for registers of mask width. Returns (code, read registers, written registers)"""
+    fields = {'next': (pc + op.size) & mask}
+    reads = set()
+    writes = set()
+
+    for name in ('rs1', 'rs2'):
+        if hasattr(op, name):
+            index = int(getattr(op, name))
+            fields[name] = reg_name(index)
+            if index != 0:
+                reads.add(index)
+    if hasattr(op, 'rd'):
+        index = int(op.rd)
+        fields['rd'] = dest_name(index)
+        if index != 0:
+            writes.add(index)
+    if hasattr(op, 'imm'):
+        imm = int(op.imm) & mask
+        sign = (mask >> 1) + 1
+        fields['imm'] = hex(imm)
+        fields['simm'] = (imm ^ sign) - sign
+        fields['target'] = hex((pc + imm) & mask)
+        fields['auipc'] = fields['target']
+    if hasattr(op, 'shamt'):
+        fields['shamt'] = int(op.shamt)
+
+    return template.format(**fields), reads, writes
+
+# =============================================================================
+# Block
+#
+class Block:
+    def __init__(self, pc, length, size, pages, func):
+        self.pc = pc
+        self.length = length
+        # Size in bytes, which differs from 4 * length once compressed ops are mixed in.
+        self.size = size
+        self.pages = pages
+        self.func = func
+        self.valid = True
+        # Blocks which followed this one, keyed by their entry PC, to skip the lookup in BlockEngine.blocks.
+        self.successors = {}
+
+# =============================================================================
+# Block engine
+#
+class BlockEngine:
+    "Execution engine which compiles guest basic blocks into Python functions"
+
+    MAX_BLOCK_LENGTH = 64
+    # The oldest block is evicted once this many are cached.
+    MAX_BLOCKS = 4096
+    PAGE_SHIFT = 12
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.bus = processor.bus
+        self.pc_mask = processor.pc_mask
+        self.blocks = {}
+        self.pages = {}
+        self.last_block = None
+        # Set when a store removes a block or writes tohost, to leave the running block after the store.
+        self.leave_block = False
+        self.translate_count = 0
+        self.bus.add_code_cache(self)
+
+    def find_ops(self, pc):
+        """Decode ops from pc up to (and including) the op that ends the basic block"""
+        ops = []
+        while len(ops) < self.MAX_BLOCK_LENGTH:
+            try:
+                insn = self.processor.fetch(pc)
+                op = self.processor.decodeCache.lookup(pc, insn)
+            except Exception:
+                # Leave fetch and decode errors to the interpreter, unless it is the first op.
+                if len(ops) == 0:
+                    raise
+                break
+
+            ops.append((pc, op))
+            if type(op) not in TEMPLATES:
+                break
+            pc += op.size
+        return ops
+
+    def generate(self, ops):
+        """Return (source, terminator op, fault sites). Fault sites are the (pc, count) of each memory op, indexed by the local 'site'."""
+        body = []
+        reads = set()
+        writes = set()
+        terminator = None
+        end_pc = (ops[-1][0] + ops[-1][1].size) & self.pc_mask
+        fault_sites = []
+        store_lines = []
+
+        for index, (pc, op) in enumerate(ops):
+            template = TEMPLATES.get(type(op))
+            if template is None:
+                template = BRANCH_TEMPLATES.get(type(op))
+            if template is None:
+                # Executed by the interpreter after the registers are written back.
+                terminator = (pc, op)
+                break
+
+            code, op_reads, op_writes = format_op(template, op, pc, self.pc_mask)
+            if type(op) in MEMORY_OPS:
+                body.append(f"site = {len(fault_sites)}")
+                fault_sites.append((pc, index + 1))
+            body.extend(code.split("\n"))
+            if type(op) in STORE_OPS and index + 1 < len(ops):
+                store_lines.append((len(body), (pc + op.size) & self.pc_mask, index + 1))
+            reads |= op_reads - writes
+            writes |= op_writes
+            if type(op) in BRANCH_TEMPLATES:
+                end_pc = None
+
+        # A faulting memory op writes back the registers as they were before it,
+        # so every written register must hold its old value until it is assigned.
+        loads = reads | writes if fault_sites else reads
+        writeback = [f"x[{index}] = x{index}" for index in sorted(writes)]
+
+        # A store which removes a block or writes tohost leaves this one before the ops after the store run.
+        for line, pc, count in reversed(store_lines):
+            body[line:line] = ["if engine.leave_block:"] + ["    " + code for code in writeback] + [
+                f"    state.pc = {pc:#x}", f"    return {count}"]
+
+        lines = ["def block(state):", "    x = state.int_reg"]
+        for index in sorted(loads):
+            lines.append(f"    x{index} = x[{index}]")
+
+        if fault_sites:
+            lines.append("    try:")
+            lines.extend("        " + line for line in body)
+            lines.append("    except MemoryAccessError as e:")
+            lines.extend("        " + line for line in writeback)
+            lines.append("        state.pc, count = fault_sites[site]")
+            lines.append("        processor.process_access_fault(e)")
+            lines.append("        return count")
+        else:
+            lines.extend("    " + line for line in body)
+        lines.extend("    " + line for line in writeback)
+
+        if terminator is not None:
+            # The run loop counts the block after it returns, so counter CSRs read by the terminator need the ops before it.
+            lines.append(f"    state.pc = {terminator[0]:#x}")
+            lines.append(f"    state.count_in_block += {len(ops) - 1}")
+            lines.append("    processor.execute_op(terminator)")
+        elif end_pc is None:
+            lines.append("    state.pc = pc")
+        else:
+            lines.append(f"    state.pc = {end_pc:#x}")
+        lines.append(f"    return {len(ops)}")
+
+        return "\n".join(lines), (terminator[1] if terminator is not None else None), fault_sites
+
+    def translate(self, pc):
+        pc = int(pc)
+        ops = self.find_ops(pc)
+        source, terminator, fault_sites = self.generate(ops)
+
+        bus = self.bus
+        namespace = {
+            'read_uint8': bus.read_uint8,
+            'read_uint16': bus.read_uint16,
+            'read_uint32': bus.read_uint32,
+            'read_uint64': bus.read_uint64,
+            'write_uint8': bus.write_uint8,
+            'write_uint16': bus.write_uint16,
+            'write_uint32': bus.write_uint32,
+            'write_uint64': bus.write_uint64,
+            'div': rv32m.div,
+            'rem': rv32m.rem,
+            'processor': self.processor,
+            'engine': self,
+            'terminator': terminator,
+            'fault_sites': fault_sites,
+            'MemoryAccessError': mem.MemoryAccessError,
+        }
+        exec(compile(source, f"<block 0x{pc:08x}>", "exec"), namespace)
+
+        if len(self.blocks) >= self.MAX_BLOCKS:
+            self.evict(next(iter(self.blocks.values())))
+
+        pages = set()
+        for op_pc, op in ops:
+            pages.add(op_pc >> self.PAGE_SHIFT)
+            pages.add((op_pc + op.size - 1) >> self.PAGE_SHIFT)
+
+        end = ops[-1][0] + ops[-1][1].size
+        block = Block(pc, len(ops), end - pc, pages, namespace['block'])
+        self.blocks[pc] = block
+        for page in pages:
+            self.pages.setdefault(page, []).append(block)
+        self.translate_count += 1
+        return block
+
+    def execute_blocks(self, count):
+        """Execute blocks from the current PC, following each into the next, while they fit in count instructions.
+        Returns the number of executed instructions, which is 0 when the first block does not fit.
+
+        Chaining ends early when leave_block is set, so the run loop sees a write to tohost.
+        An op which takes an access fault is counted, like the interpreter counts a trapped cycle."""
+        state = self.processor.cpuState
+        blocks = self.blocks
+        last_block = self.last_block
+        executed = 0
+
+        while executed < count:
+            pc = state.pc
+            block = last_block.successors.get(pc) if last_block is not None else None
+            if block is None or not block.valid:
+                block = blocks.get(pc)
+                if block is None:
+                    try:
+                        block = self.translate(pc)
+                    except mem.MemoryAccessError as e:
+                        self.processor.process_access_fault(e, fetch=True)
+                        last_block = None
+                        executed += 1
+                        break
+                if last_block is not None and last_block.valid:
+                    last_block.successors[pc] = block
+            if executed + block.length > count:
+                break
+
+            # The instructions already run in this chain are not in the run loop's count yet.
+            state.count_in_block = executed
+            self.leave_block = False
+            executed += block.func(state)
+            last_block = block
+            if self.leave_block:
+                break
+
+        state.count_in_block = 0
+        self.last_block = last_block
+        return executed
+
+    def invalidate(self, addr, size):
+        first_page = addr >> self.PAGE_SHIFT
+        last_page = (addr + size - 1) >> self.PAGE_SHIFT
+        for page in {first_page, last_page}:
+            blocks = self.pages.get(page)
+            if blocks is None:
+                continue
+
+            # Only blocks overlapping the written bytes are dropped, so data on code pages stays cheap.
+            remaining = []
+            for block in blocks:
+                if not block.valid:
+                    continue
+                if block.pc < addr + size and addr < block.pc + block.size:
+                    self.remove(block)
+                else:
+                    remaining.append(block)
+            if remaining:
+                self.pages[page] = remaining
+            else:
+                del self.pages[page]
+
+    def invalidate_all(self):
+        for block in self.blocks.values():
+            block.valid = False
+        self.blocks.clear()
+        self.pages.clear()
+        self.last_block = None
+
+    def evict(self, block):
+        self.remove(block)
+        for page in block.pages:
+            blocks = self.pages[page]
+            blocks.remove(block)
+            if not blocks:
+                del self.pages[page]
+        if self.last_block is block:
+            self.last_block = None
+
+    def remove(self, block):
+        block.valid = False
+        self.leave_block = True
+        if self.blocks.get(block.pc) is block:
+            del self.blocks[block.pc]
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import os
+import sys
+from rafi import bench
+from rafi import emu
+from rafi import mem
+from rafi import runner
+
+parser = argparse.ArgumentParser(description="Micro benchmarks of the emulator.")
+parser.add_argument('binary', nargs='*', help="Binary files to run with each engine")
+parser.add_argument('-r', '--repeat', type=int, default=1000, help="Number of repetitions.")
+parser.add_argument('-c', '--cycle', type=int, default=10_000_000, help="Max number of emulation cycles per binary.")
+parser.add_argument('--kernel-cycle', type=int, default=100_000, help="Number of instructions to run each loop kernel for.")
+parser.add_argument('--riscv-tests', action='store_true', help="Also run all riscv-tests binaries in the manifest with each engine.")
+parser.add_argument('--json', help="Write results as JSON to this path.")
+parser.add_argument('--baseline', help="Compare results with a JSON file written by --json, failing on regressions.")
+parser.add_argument('--threshold', type=float, default=0.1, help="Fraction of a baseline result a result may drop by before it is a regression.")
+
+args = parser.parse_args()
+results = {}
+
+print("execute (fixedint reference ops -> plain int ops):")
+fixed = bench.bench_execute(fixedint=True, repeat=args.repeat)
+fast = bench.bench_execute(fixedint=False, repeat=args.repeat)
+for name, ips in fast.items():
+    print(f"  {name:12s} {1e9 / fixed[name]:8.0f} ns -> {1e9 / ips:8.0f} ns ({ips / fixed[name]:.2f}x)")
+    results[f"execute/{name}"] = ips
+
+print("memory:")
+for name, ips in bench.bench_memory(mem.Memory(), repeat=args.repeat * 10).items():
+    print(f"  {name:24s} {1e9 / ips:8.0f} ns")
+    results[f"memory/{name}"] = ips
+
+print("bus:")
+for name, ips in bench.bench_bus(emu.Emulator().bus, repeat=args.repeat * 10).items():
+    print(f"  {name:24s} {1e9 / ips:8.0f} ns")
+    results[f"bus/{name}"] = ips
+
+reference = bench.bench_decode(emu.decode_reference, repeat=args.repeat)
+table = bench.bench_decode(emu.decode, repeat=args.repeat)
+results["decode_reference"] = reference
+results["decode"] = table
+
+print(f"decode_reference: {reference:12.0f} insn/s")
+print(f"decode:           {table:12.0f} insn/s ({table / reference:.2f}x)")
+
+print("kernels:")
+for name, words in bench.KERNELS.items():
+    for engine in emu.Emulator.ENGINES:
+        ips = bench.bench_kernel(words, engine, args.kernel_cycle)
+        print(f"  {name:8s} {engine:12s} {ips:12.0f} insn/s")
+        results[f"kernel/{name}/{engine}"] = ips
+
+for path in args.binary:
+    print(f"{path}")
+    runs = {engine: bench.bench_run(path, engine, args.cycle) for engine in emu.Emulator.ENGINES}
+    runs["interpreter (fixedint)"] = bench.bench_run(path, "interpreter", args.cycle, fixedint=True)
+    for engine, ips in runs.items():
+        print(f"  {engine:24s} {ips:12.0f} insn/s ({ips / runs['interpreter']:.2f}x)")
+        results[f"run/{os.path.basename(path)}/{engine}"] = ips
+
+if args.riscv_tests:
+    with open(runner.CONFIG_PATH, "r") as f:
+        paths = [runner.find_binary(config) for config in json.load(f)]
+    print("riscv-tests:")
+    for engine in emu.Emulator.ENGINES:
+        ips = bench.bench_runs(paths, engine, args.cycle)
+        print(f"  {engine:24s} {ips:12.0f} insn/s")
+        results[f"riscv-tests/{engine}"] = ips
+
+if args.json:
+    bench.write_json(results, args.json)
+
+if args.baseline:
+    regressions = bench.find_regressions(results, bench.read_json(args.baseline), args.threshold)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%} of {args.baseline}")
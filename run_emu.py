@@ -21,9 +21,97 @@ import rafi
 DefaultCycle = 100
 
 parser = argparse.ArgumentParser(description="Toy RISCV emulator by Python.")
-parser.add_argument('file', help="Binary file to load")
+parser.add_argument('file', nargs='?', help="Binary or ELF file to load")
 parser.add_argument('-c', '--cycle', default=DefaultCycle, help="Number of emulation cycles.")
+parser.add_argument('-e', '--engine', default="interpreter", choices=rafi.emu.Emulator.ENGINES, help="Execution engine.")
+parser.add_argument('--memory-size', default=rafi.mem.Memory.DEFAULT_SIZE, type=lambda x: int(x, 0), help="Guest memory size in bytes. Pages are allocated on first touch.")
+parser.add_argument('--memory-base', default=rafi.mem.Memory.DEFAULT_BASE, type=lambda x: int(x, 0), help="Guest memory base address.")
+parser.add_argument('--mmap', action='store_true', help="Back guest memory with mmap, mapping the binary copy-on-write.")
+parser.add_argument('--xlen', type=int, default=32, choices=(32, 64), help="Register width of the emulated RISC-V core.")
+parser.add_argument('--harts', type=int, default=1, help="Number of harts sharing the memory, each with its own mhartid.")
+parser.add_argument('--quantum', type=int, default=rafi.emu.Emulator.DEFAULT_QUANTUM, help="Instructions a hart runs before the next hart gets its turn.")
+parser.add_argument('--processes', action='store_true', help="Run each hart in its own process, with the guest memory in shared memory.")
+parser.add_argument('--fixedint', action='store_true', help="Run RV32I ops with their fixedint reference implementations to cross-check the plain-int ops.")
+parser.add_argument('--from-checkpoint', help="Start from a checkpoint file instead of loading a binary.")
+parser.add_argument('--save-checkpoint-at', type=int, help="Save a checkpoint when this many instructions have been executed.")
+parser.add_argument('--save-checkpoint-every', type=int, help="Save a checkpoint named <file>.<N>.ckpt every this many instructions, for run_intervals.py.")
+parser.add_argument('--checkpoint-file', help="Path of the checkpoint saved by --save-checkpoint-at. Defaults to <file>.<N>.ckpt.")
+parser.add_argument('--sample-period', type=int, help="Run the first --sample-length instructions of every period in detailed mode and print their statistics.")
+parser.add_argument('--sample-length', type=int, default=10000, help="Length of each detailed interval.")
+parser.add_argument('--stats-json', help="Write the interval statistics as JSON to this path.")
+parser.add_argument('--profile', action='store_true', help="Count executed instructions per op and per PC, and print a report at the end.")
+parser.add_argument('--profile-top', type=int, default=20, help="Number of hot PCs in the profile report.")
+parser.add_argument('--trace', help="Write a binary trace of every executed instruction to this path (.gz or .zst to compress).")
+parser.add_argument('--compare', help="Compare the execution against a reference trace file or Spike commit log, stopping at the first difference.")
+parser.add_argument('--compare-skip-ahead', action='store_true', help="With --compare, only compare at control transfers, running with the selected engine in between.")
+parser.add_argument('--compress', action='store_true', help="Compress the pages of saved checkpoints.")
 
 args = parser.parse_args()
+if args.file is None and args.from_checkpoint is None:
+    parser.error("a binary file or --from-checkpoint is required")
 
-rafi.run_emulation(args.file, args.cycle)
+if args.processes:
+    # Harts in separate processes only run the guest and check tohost.
+    for option in ('from_checkpoint', 'trace', 'profile', 'mmap', 'compare', 'save_checkpoint_at', 'save_checkpoint_every', 'sample_period'):
+        if getattr(args, option):
+            parser.error(f"--{option.replace('_', '-')} is not supported with --processes")
+    shared = rafi.mem.SharedMemory(args.memory_size, args.memory_base)
+    try:
+        emulator = rafi.emu.Emulator(args.engine, args.fixedint, xlen=args.xlen, memory=shared)
+        emulator.load(args.file)
+        rafi.smp.run_processes(emulator, args.harts, args.cycle, args.quantum)
+        emulator.check_host_io(args.cycle)
+    finally:
+        shared.close()
+        shared.unlink()
+    raise SystemExit
+
+emulator = rafi.emu.Emulator(args.engine, args.fixedint, args.memory_size, args.memory_base, args.mmap, args.profile, args.xlen,
+    args.harts, args.quantum)
+if args.from_checkpoint is not None:
+    rafi.checkpoint.load(emulator, args.from_checkpoint)
+else:
+    emulator.load(args.file)
+
+if args.trace is not None:
+    emulator.trace_writer = rafi.trace.TraceWriter(args.trace)
+
+compression = rafi.checkpoint.COMPRESSION_ZLIB if args.compress else rafi.checkpoint.COMPRESSION_NONE
+start = emulator.cycle
+if args.save_checkpoint_at is not None:
+    emulator.step(args.save_checkpoint_at - emulator.cycle)
+    if emulator.host_io_value == 0:
+        path = args.checkpoint_file or f"{args.file or args.from_checkpoint}.{emulator.cycle}.ckpt"
+        rafi.checkpoint.save(emulator, path, compression)
+        print(f"Checkpoint: {path} ({emulator.cycle} insns)")
+    else:
+        print(f"Checkpoint: not saved, the guest finished after {emulator.cycle} insns")
+
+remaining = int(args.cycle) - (emulator.cycle - start)
+try:
+    if args.compare is not None:
+        differ = rafi.lockstep.Differ(emulator, rafi.lockstep.read_reference(args.compare), skip_ahead=args.compare_skip_ahead)
+        divergence = differ.run(remaining)
+        if divergence is not None:
+            print(divergence)
+        else:
+            print(f"Compare: {differ.count} insns match")
+    elif args.save_checkpoint_every is not None:
+        paths = rafi.checkpoint.save_periodic(emulator, args.save_checkpoint_every, args.file or args.from_checkpoint, remaining, compression)
+        print(f"Checkpoint: {len(paths)} files ({paths[0]} ... {paths[-1]})")
+        emulator.check_host_io(remaining)
+    elif args.sample_period is not None:
+        intervals = rafi.sampling.periodic_intervals(args.sample_period, args.sample_length, emulator.cycle + remaining)
+        stats = emulator.run_sampled(remaining, intervals)
+        for interval in stats:
+            print(interval)
+        if args.stats_json:
+            rafi.sampling.write_json(stats, args.stats_json)
+        emulator.check_host_io(remaining)
+    else:
+        emulator.run(remaining)
+finally:
+    if emulator.trace_writer is not None:
+        emulator.trace_writer.close()
+    if emulator.profiler is not None:
+        print(emulator.profiler.report(emulator.bus, rafi.emu.DECODERS[args.xlen], args.profile_top))
@@ -15,27 +15,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import json
 import os
 import rafi
 import sys
+from rafi import runner
 
-CONFIG_PATH = "./riscv_tests.json"
-BINARY_DIR_PATH = "./rafi-prebuilt-binary/riscv-tests/isa"
 MAX_CYCLE = 10000
 
-configs = None
-with open(CONFIG_PATH, "r") as f:
-    configs = json.load(f)
-
-failure_count = 0
-for config in configs:
-    path = os.path.join(BINARY_DIR_PATH, f"{config}.bin")
-    try:
-        print(f"{path}")
-        rafi.run_emulation(path, MAX_CYCLE)
-    except Exception as e:
-        print(e)
-        failure_count += 1
-
-sys.exit(failure_count)
+def main():
+    parser = argparse.ArgumentParser(description="Run riscv-tests on the emulator.")
+    parser.add_argument('-e', '--engine', default="interpreter", choices=rafi.emu.Emulator.ENGINES, help="Execution engine.")
+    parser.add_argument('--fixedint', action='store_true', help="Run RV32I ops with their fixedint reference implementations to cross-check the plain-int ops.")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument('--json', help="Write results as JSON to this path.")
+    parser.add_argument('--junit', help="Write results as JUnit XML to this path.")
+
+    args = parser.parse_args()
+
+    configs = None
+    with open(runner.CONFIG_PATH, "r") as f:
+        configs = json.load(f)
+
+    tests = [(config, runner.find_binary(config)) for config in configs]
+
+    results = []
+    for result in runner.run_tests(tests, args.engine, args.fixedint, MAX_CYCLE, args.jobs):
+        status = "PASS" if result.passed else f"FAIL ({result.message})"
+        if result.test_id is not None:
+            status += f" testId={result.test_id}"
+        print(f"{result.name}: {status} {result.instret} insns {result.wall_time:.3f}s")
+        results.append(result)
+
+    if args.json:
+        runner.write_json(results, args.json)
+    if args.junit:
+        runner.write_junit(results, args.junit)
+
+    return sum(1 for result in results if not result.passed)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Akifumi Fujita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import os
+import rafi
+import sys
+from rafi import interval
+
+DefaultCycle = 1000000
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the intervals between checkpoints in parallel and merge their statistics.")
+    parser.add_argument('checkpoints', nargs='+', help="Checkpoint files, e.g. saved by run_emu.py --save-checkpoint-every.")
+    parser.add_argument('-c', '--cycle', type=int, default=DefaultCycle, help="Maximum length of the interval after the last checkpoint.")
+    parser.add_argument('-e', '--engine', default="interpreter", choices=rafi.emu.Emulator.ENGINES, help="Execution engine.")
+    parser.add_argument('--fixedint', action='store_true', help="Run RV32I ops with their fixedint reference implementations to cross-check the plain-int ops.")
+    parser.add_argument('--memory-size', default=rafi.mem.Memory.DEFAULT_SIZE, type=lambda x: int(x, 0), help="Guest memory size in bytes.")
+    parser.add_argument('--memory-base', default=rafi.mem.Memory.DEFAULT_BASE, type=lambda x: int(x, 0), help="Guest memory base address.")
+    parser.add_argument('--sample-length', type=int, help="Only run the first N instructions of each interval in detailed mode.")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument('--json', help="Write the interval and merged statistics as JSON to this path.")
+
+    args = parser.parse_args()
+
+    results = []
+    failures = 0
+    for result in interval.run_intervals(args.checkpoints, args.engine, args.fixedint, args.memory_size, args.memory_base,
+            args.sample_length, args.cycle, args.jobs):
+        status = "OK" if not result.mismatches else f"MISMATCH ({', '.join(result.mismatches[:4])})"
+        print(f"{result.path}: [{result.start}, {result.end}) {status} {result.wall_time:.3f}s")
+        failures += 1 if result.mismatches else 0
+        results.append(result)
+
+    last = results[-1]
+    if last.host_io_value == 1:
+        print(f"HostIo: {last.host_io_value} (success)")
+    else:
+        print(f"HostIo: {last.host_io_value} (failure)")
+        failures += 1
+
+    merged = interval.merge_stats(results)
+    print(f"Total: {merged}")
+
+    if args.json:
+        report = {
+            'intervals': [dict(result.stats.to_dict() if result.stats else {}, path=result.path, end=result.end,
+                mismatches=result.mismatches, wall_time=result.wall_time) for result in results],
+            'merged': merged.to_dict(),
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(main())